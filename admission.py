@@ -0,0 +1,227 @@
+"""
+Admission control: rate limits, load shedding and per-route concurrency
+limits, checked in that order before a request reaches its endpoint.
+"""
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Optional
+
+from anyio import to_thread
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+
+import database
+import metrics
+from config import redis_client, settings
+
+# Routes that verify or hash a password get the login bucket
+CREDENTIAL_ROUTES = frozenset({"POST /login", "POST /users", "POST /token/refresh"})
+HASHING_ROUTES = frozenset({"POST /login", "POST /users"})
+EXEMPT_ROUTES = frozenset({"GET /metrics"})
+BUCKET_PREFIX = "ratelimit:"
+MAX_MEMORY_BUCKETS = 100000
+SHED_RETRY_AFTER_SECONDS = 1
+
+
+class MemoryBuckets:
+    """Token buckets for one worker; the least recently used are forgotten (a forgotten bucket is a full one)"""
+
+    blocking = False
+
+    def __init__(self, maxsize: int = MAX_MEMORY_BUCKETS):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time of last update)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        """Take a token: 0 when there was one, otherwise the seconds until there will be"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker; one script call per request"""
+
+    blocking = True
+
+    TAKE = """
+    local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or burst
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    local wait = 0
+    if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url: str, client=None):
+        self.client = redis_client(url, client)
+        self._take = self.client.register_script(self.TAKE)
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        return float(self._take(keys=[BUCKET_PREFIX + key], args=[rate, burst, time.time()]))
+
+
+def build_buckets():
+    if settings.rate_limit_backend == "redis":
+        return RedisBuckets(settings.redis_url)
+    return MemoryBuckets()
+
+
+def _endpoints(routes):
+    """Routes with a path, looking inside included routers (FastAPI wraps them in newer versions)"""
+    for route in routes:
+        included = getattr(route, "original_router", None)
+        if included is not None:
+            yield from _endpoints(included.routes)
+        else:
+            yield route
+
+
+def _pool_saturated(pool, app_settings) -> bool:
+    # Only QueuePool has a fixed capacity; SQLite's in-memory pools don't
+    if not hasattr(pool, "checkedout"):
+        return False
+    return pool.checkedout() >= app_settings.db_pool_size + app_settings.db_max_overflow
+
+
+def _threadpool_saturated() -> bool:
+    limiter = to_thread.current_default_thread_limiter()
+    return limiter.borrowed_tokens >= limiter.total_tokens
+
+
+class AdmissionController:
+    """Buckets and counters for the worker; the limits come from each app's settings"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._in_flight = Counter()
+        self.rejected = Counter()
+
+    def route_name(self, request: Request) -> str:
+        """"METHOD /template" of the route the request will reach, "unmatched" for none"""
+        for route in _endpoints(request.app.router.routes):
+            match, _ = route.matches(request.scope)
+            if match == Match.FULL:
+                return f"{request.method} {route.path}"
+        return "unmatched"
+
+    def count_rejection(self, reason: str, route: str) -> None:
+        self.rejected[reason] += 1
+        metrics.rejected_requests.inc(reason, route)
+
+    def reject(self, reason: str, route: str, retry_after: float) -> JSONResponse:
+        self.count_rejection(reason, route)
+        if reason == "rate_limit":
+            code, detail = status.HTTP_429_TOO_MANY_REQUESTS, "Too many requests, slow down"
+        else:
+            code, detail = status.HTTP_503_SERVICE_UNAVAILABLE, "Server is busy, retry shortly"
+        return JSONResponse(
+            status_code=code,
+            content={"detail": detail},
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    async def _rate_limited(self, request: Request, route: str, app_settings) -> float:
+        # Behind a proxy, run uvicorn with --proxy-headers so this is the caller
+        client = request.client.host if request.client else "unknown"
+        if route in CREDENTIAL_ROUTES:
+            key = f"login:{client}"
+            rate, burst = app_settings.login_rate_limit_per_minute / 60, app_settings.login_rate_limit_burst
+        else:
+            key = f"api:{client}"
+            rate, burst = app_settings.rate_limit_per_second, app_settings.rate_limit_burst
+        if self.buckets.blocking:
+            return await run_in_threadpool(self.buckets.take, key, rate, burst)
+        return self.buckets.take(key, rate, burst)
+
+    def _saturation(self, request: Request, route: str) -> Optional[str]:
+        databases = database.app_databases(request.app)
+        if any(_pool_saturated(pool, databases.settings) for pool in databases.connection_pools()):
+            return "db_pool"
+        if _threadpool_saturated():
+            return "threadpool"
+        if route in HASHING_ROUTES and request.app.state.password_hasher.saturated():
+            return "hasher"
+        return None
+
+    async def handle(self, app, scope, receive, send) -> None:
+        """Serve the request through `app`, or refuse it"""
+        request = Request(scope)
+        app_settings = request.app.state.settings
+        route = self.route_name(request)
+        # A refused preflight would fail the request it is asking about
+        if request.method == "OPTIONS" or route in EXEMPT_ROUTES:
+            return await app(scope, receive, send)
+        wait = await self._rate_limited(request, route, app_settings)
+        if wait:
+            return await self.reject("rate_limit", route, wait)(scope, receive, send)
+        if app_settings.shed_on_saturation:
+            reason = self._saturation(request, route)
+            if reason is not None:
+                return await self.reject(reason, route, SHED_RETRY_AFTER_SECONDS)(scope, receive, send)
+
+        limit = app_settings.route_concurrency.get(route)
+        if limit is None:
+            return await app(scope, receive, send)
+        if self._in_flight[route] >= limit:
+            return await self.reject("concurrency", route, SHED_RETRY_AFTER_SECONDS)(scope, receive, send)
+        self._in_flight[route] += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self._in_flight[route] -= 1
+
+        async def send_then_release(message):
+            try:
+                await send(message)
+            finally:
+                if message["type"] == "http.response.body" and not message.get("more_body", False):
+                    release()
+
+        try:
+            await app(scope, receive, send_then_release)
+        finally:
+            # An error, or a client that left before the last chunk
+            release()
+
+    def stats(self) -> dict:
+        return {
+            **{f"rejected_{reason}": count for reason, count in sorted(self.rejected.items())},
+            "limited_in_flight": sum(self._in_flight.values()),
+        }
+
+
+class AdmissionMiddleware:
+    """Pure ASGI, so a slot is released on the last body chunk, an error or a disconnect alike"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        await controller.handle(self.app, scope, receive, send)
+
+
+controller = AdmissionController(build_buckets())
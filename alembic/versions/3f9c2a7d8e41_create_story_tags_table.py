@@ -0,0 +1,67 @@
+"""Create story_tags table and backfill from stories.tags
+
+Revision ID: 3f9c2a7d8e41
+Revises: a1b2c3d4e5f6
+Create Date: 2026-10-18 10:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2a7d8e41'
+down_revision: Union[str, Sequence[str], None] = 'a1b2c3d4e5f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    story_tags = op.create_table(
+        "story_tags",
+        sa.Column("story_id", sa.Integer(), sa.ForeignKey("stories.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("tag", sa.String(length=100), primary_key=True),
+        sa.Column("position", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.create_index("ix_story_tags_tag_story_id", "story_tags", ["tag", "story_id"])
+
+    # Explode the comma separated column into one row per (story, tag)
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT id, tags FROM stories WHERE tags IS NOT NULL")).fetchall()
+    links = []
+    for story_id, tags in rows:
+        seen = []
+        for tag in tags.split(","):
+            tag = tag.strip()[:100]
+            if tag and tag not in seen:
+                seen.append(tag)
+        links.extend(
+            {"story_id": story_id, "tag": tag, "position": i} for i, tag in enumerate(seen)
+        )
+    if links:
+        op.bulk_insert(story_tags, links)
+
+    op.drop_column("stories", "tags")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column("stories", sa.Column("tags", sa.String(length=500), nullable=True))
+
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.text("SELECT story_id, tag FROM story_tags ORDER BY story_id, position")
+    ).fetchall()
+    joined = {}
+    for story_id, tag in rows:
+        joined.setdefault(story_id, []).append(tag)
+    for story_id, tags in joined.items():
+        conn.execute(
+            sa.text("UPDATE stories SET tags = :tags WHERE id = :id"),
+            {"tags": ",".join(tags)[:500], "id": story_id},
+        )
+
+    op.drop_index("ix_story_tags_tag_story_id", table_name="story_tags")
+    op.drop_table("story_tags")
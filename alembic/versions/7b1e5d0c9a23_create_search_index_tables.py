@@ -0,0 +1,43 @@
+"""Create full-text search index tables
+
+Revision ID: 7b1e5d0c9a23
+Revises: 3f9c2a7d8e41
+Create Date: 2026-10-18 11:00:00.000000
+
+The tables start empty; populate them with `python manage.py rebuild-search-index`.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b1e5d0c9a23'
+down_revision: Union[str, Sequence[str], None] = '3f9c2a7d8e41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "search_postings",
+        sa.Column("term", sa.String(length=64), primary_key=True),
+        sa.Column("story_id", sa.Integer(), sa.ForeignKey("stories.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("tf", sa.Integer(), nullable=False),
+        sa.Column("doc_length", sa.Integer(), nullable=False),
+    )
+    op.create_index("ix_search_postings_story_id", "search_postings", ["story_id"])
+    op.create_table(
+        "search_documents",
+        sa.Column("story_id", sa.Integer(), sa.ForeignKey("stories.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("length", sa.Integer(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("search_documents")
+    op.drop_index("ix_search_postings_story_id", table_name="search_postings")
+    op.drop_table("search_postings")
@@ -0,0 +1,41 @@
+"""Create story_daily_snapshots for the analytics endpoints
+
+Revision ID: a8d4e6f2c915
+Revises: f7c3a9e2b614
+Create Date: 2026-10-18 17:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d4e6f2c915'
+down_revision: Union[str, Sequence[str], None] = 'f7c3a9e2b614'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "story_daily_snapshots",
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("assignee", sa.String(length=250), primary_key=True),
+        sa.Column("status", sa.String(length=250), primary_key=True),
+        sa.Column("stories", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("points", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("entered_stories", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("entered_points", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.create_index("ix_story_daily_snapshots_assignee_day", "story_daily_snapshots", ["assignee", "day"])
+    op.create_index("ix_story_activity_timestamp", "story_activity", ["timestamp"])
+    # Filled by: python manage.py build-analytics-snapshots
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_story_activity_timestamp", table_name="story_activity")
+    op.drop_index("ix_story_daily_snapshots_assignee_day", table_name="story_daily_snapshots")
+    op.drop_table("story_daily_snapshots")
@@ -0,0 +1,41 @@
+"""Add impact-ordered search postings
+
+Revision ID: b3e7f1c9d2a4
+Revises: a8d4e6f2c915
+Create Date: 2026-10-18 19:00:00.000000
+
+Existing postings get their impact from the current average document
+length; `python manage.py rebuild-search-index` recomputes everything.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e7f1c9d2a4'
+down_revision: Union[str, Sequence[str], None] = 'a8d4e6f2c915'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# search.K1 and search.B when this was written
+K1 = 1.2
+B = 0.75
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("search_postings", sa.Column("impact", sa.Float(), nullable=False, server_default="0"))
+    average = op.get_bind().execute(sa.text("SELECT AVG(length) FROM search_documents")).scalar() or 1.0
+    op.execute(sa.text(
+        "UPDATE search_postings SET impact = "
+        "tf * (:k1 + 1) / (tf + :k1 * (1 - :b + :b * doc_length / :average))"
+    ).bindparams(k1=K1, b=B, average=float(average)))
+    op.create_index("ix_search_postings_term_impact", "search_postings", ["term", "impact"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_search_postings_term_impact", table_name="search_postings")
+    op.drop_column("search_postings", "impact")
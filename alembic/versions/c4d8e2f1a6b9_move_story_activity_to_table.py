@@ -0,0 +1,142 @@
+"""Move story activity from the JSON column into story_activity
+
+Revision ID: c4d8e2f1a6b9
+Revises: 7b1e5d0c9a23
+Create Date: 2026-10-18 12:00:00.000000
+"""
+import json
+import re
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d8e2f1a6b9'
+down_revision: Union[str, Sequence[str], None] = '7b1e5d0c9a23'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+# The messages the JSON history was written with, after "[<timestamp>] <user>: "
+_PREFIX = re.compile(r"^\[[^\]]*\] ")
+_CHANGED = re.compile(r"^Changed (title|assignee|status) from '(.*)' to '(.*)'$", re.DOTALL)
+_CHANGED_POINTS = re.compile(r"^Changed story points from (\S+) to (\S+)$")
+_UPDATED = {
+    "Created story": "created",
+    "Updated description": "description",
+    "Updated tags": "tags",
+    "Updated acceptance criteria": "acceptance_criteria",
+}
+
+
+def _parse_timestamp(value, fallback):
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return fallback
+
+
+def _parse_action(action: str, user) -> tuple:
+    """(field, old_value, new_value) of a history message; all None for a comment"""
+    message = _PREFIX.sub("", action, count=1)
+    author = f"{user}: " if user is not None else None
+    if author and message.startswith(author):
+        message = message[len(author):]
+    else:
+        message = message.partition(": ")[2]
+    if message in _UPDATED:
+        return _UPDATED[message], None, None
+    match = _CHANGED.match(message)
+    if match:
+        return match.groups()
+    match = _CHANGED_POINTS.match(message)
+    if match:
+        old, new = (None if value == "None" else value for value in match.groups())
+        return "story_points", old, new
+    return None, None, None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    story_activity = op.create_table(
+        "story_activity",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("story_id", sa.Integer(), sa.ForeignKey("stories.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("timestamp", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column("user", sa.String(length=250), nullable=True),
+        sa.Column("action", sa.Text(), nullable=False),
+        sa.Column("field", sa.String(length=50), nullable=True),
+        sa.Column("old_value", sa.Text(), nullable=True),
+        sa.Column("new_value", sa.Text(), nullable=True),
+    )
+    op.create_index(
+        "ix_story_activity_story_id_timestamp", "story_activity", ["story_id", "timestamp"]
+    )
+
+    # One row per JSON entry, keeping the original order within a story
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.text("SELECT id, activity, created_on FROM stories WHERE activity IS NOT NULL ORDER BY id")
+    ).fetchall()
+    for story_id, activity, created_on in rows:
+        entries = json.loads(activity) if isinstance(activity, str) else activity
+        if isinstance(created_on, str):
+            created_on = _parse_timestamp(created_on[:19], None)
+        fallback = created_on or datetime.now().replace(microsecond=0)
+        events = []
+        for entry in entries or []:
+            if not isinstance(entry, dict) or not entry.get("action"):
+                continue
+            field, old_value, new_value = _parse_action(entry["action"], entry.get("user"))
+            events.append({
+                "story_id": story_id,
+                "timestamp": _parse_timestamp(entry.get("timestamp"), fallback),
+                "user": entry.get("user"),
+                "action": entry["action"],
+                "field": field,
+                "old_value": old_value,
+                "new_value": new_value,
+            })
+        if events:
+            op.bulk_insert(story_activity, events)
+
+    op.drop_column("stories", "activity")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column("stories", sa.Column("activity", sa.JSON(), nullable=True))
+
+    conn = op.get_bind()
+    # "user" is a reserved word; let SQLAlchemy quote it for the dialect
+    story_activity = sa.table(
+        "story_activity",
+        sa.column("id"), sa.column("story_id"), sa.column("timestamp"),
+        sa.column("user"), sa.column("action"),
+    )
+    rows = conn.execute(
+        sa.select(
+            story_activity.c.story_id, story_activity.c.timestamp,
+            story_activity.c.user, story_activity.c.action,
+        ).order_by(story_activity.c.story_id, story_activity.c.timestamp, story_activity.c.id)
+    ).fetchall()
+    history = {}
+    for story_id, timestamp, user, action in rows:
+        if not isinstance(timestamp, str):
+            timestamp = timestamp.strftime(TIMESTAMP_FORMAT)
+        history.setdefault(story_id, []).append(
+            {"timestamp": timestamp[:19], "user": user, "action": action}
+        )
+    for story_id, entries in history.items():
+        conn.execute(
+            sa.text("UPDATE stories SET activity = :activity WHERE id = :id"),
+            {"activity": json.dumps(entries), "id": story_id},
+        )
+
+    op.drop_index("ix_story_activity_story_id_timestamp", table_name="story_activity")
+    op.drop_table("story_activity")
@@ -0,0 +1,36 @@
+"""Create story_status_counts and backfill it from stories
+
+Revision ID: d2a7f3b8c510
+Revises: c4d8e2f1a6b9
+Create Date: 2026-10-18 13:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2a7f3b8c510'
+down_revision: Union[str, Sequence[str], None] = 'c4d8e2f1a6b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "story_status_counts",
+        sa.Column("assignee", sa.String(length=250), primary_key=True),
+        sa.Column("status", sa.String(length=250), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.execute(
+        "INSERT INTO story_status_counts (assignee, status, count) "
+        "SELECT assignee, status, COUNT(*) FROM stories GROUP BY assignee, status"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("story_status_counts")
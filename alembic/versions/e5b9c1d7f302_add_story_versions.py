@@ -0,0 +1,34 @@
+"""Add stories.version and collection_versions for conditional GETs
+
+Revision ID: e5b9c1d7f302
+Revises: d2a7f3b8c510
+Create Date: 2026-10-18 14:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b9c1d7f302'
+down_revision: Union[str, Sequence[str], None] = 'd2a7f3b8c510'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("stories", sa.Column("version", sa.Integer(), nullable=False, server_default="1"))
+    collection_versions = op.create_table(
+        "collection_versions",
+        sa.Column("name", sa.String(length=50), primary_key=True),
+        sa.Column("version", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.bulk_insert(collection_versions, [{"name": "stories", "version": 1}])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("collection_versions")
+    op.drop_column("stories", "version")
@@ -0,0 +1,38 @@
+"""Add composite indexes for the story list filters
+
+Revision ID: f7c3a9e2b614
+Revises: e5b9c1d7f302
+Create Date: 2026-10-18 15:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7c3a9e2b614'
+down_revision: Union[str, Sequence[str], None] = 'e5b9c1d7f302'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# GET /stories, /filter and /workspace filter on these columns and page by
+# (created_on, id); see crud.filter_story_query and crud.paginate_stories
+INDEXES = {
+    "ix_stories_created_on_id": ["created_on", "id"],
+    "ix_stories_assignee_created_on_id": ["assignee", "created_on", "id"],
+    "ix_stories_assignee_status_created_on_id": ["assignee", "status", "created_on", "id"],
+    "ix_stories_status_created_on_id": ["status", "created_on", "id"],
+    "ix_stories_created_by_created_on_id": ["created_by", "created_on", "id"],
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for name, columns in INDEXES.items():
+        op.create_index(name, "stories", columns)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name in reversed(list(INDEXES)):
+        op.drop_index(name, table_name="stories")
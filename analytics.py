@@ -0,0 +1,305 @@
+"""
+Velocity and burndown, served from story_daily_snapshots.
+
+A snapshot row holds, for one day and (assignee, status), the stories and
+points there at the end of the day and what moved into that status
+during it. build_snapshots() derives the rows from the status, assignee
+and story_points changes in story activity, replayed in the order they
+were recorded:
+
+- each run starts again from the last day it built (which may have been
+  partial) and goes up to today, so it only reads that much activity;
+- the state every story had when that day began is its current state
+  with the window's changes undone, so no per-story state is kept;
+- the changes become +/- deltas per (day, assignee, status) and a
+  cumulative sum over the days gives the end-of-day totals, in pandas.
+
+The endpoints only read snapshots, a few thousand rows for a year
+whatever the size of the backlog. Run the build from cron or the task
+queue (python manage.py build-analytics-snapshots); responses report the
+day the snapshots run through.
+"""
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException, status
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+import versions
+
+ANALYTICS = "analytics"
+DONE_STATUS = "Done"
+TRACKED_FIELDS = ("story_points", "assignee", "status")
+READ_BATCH_SIZE = 50000
+WRITE_BATCH_SIZE = 5000
+
+STATE_COLUMNS = ["assignee", "status", "points"]
+DELTA_COLUMNS = ["stories", "points", "entered_stories", "entered_points"]
+
+
+def _frames(db: Session, statement, columns: list[str]) -> pd.DataFrame:
+    """Run `statement` and collect its rows READ_BATCH_SIZE at a time"""
+    result = db.execute(statement.execution_options(yield_per=READ_BATCH_SIZE))
+    frames = [pd.DataFrame(part, columns=columns) for part in result.partitions()]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _points(values: pd.Series) -> pd.Series:
+    # Unestimated stories count as 0 points
+    return pd.to_numeric(values, errors="coerce").fillna(0).astype("int64")
+
+
+def _story_states(db: Session) -> pd.DataFrame:
+    story = models.UserStory
+    frame = _frames(
+        db,
+        select(story.id, story.assignee, story.status, story.story_points, story.created_on),
+        ["story_id", "assignee", "status", "points", "created_on"],
+    ).set_index("story_id")
+    frame["points"] = _points(frame["points"])
+    frame["created_on"] = pd.to_datetime(frame["created_on"], utc=True).dt.tz_localize(None)
+    return frame
+
+
+def _changes(db: Session, since: datetime) -> pd.DataFrame:
+    activity = models.StoryActivity
+    frame = _frames(
+        db,
+        select(
+            activity.id, activity.story_id, activity.timestamp, activity.field,
+            activity.old_value, activity.new_value,
+        ).where(activity.timestamp >= since, activity.field.in_(TRACKED_FIELDS)).order_by(activity.id),
+        ["id", "story_id", "timestamp", "field", "old_value", "new_value"],
+    )
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"], utc=True).dt.tz_localize(None)
+    # Changes within one second keep the order they were recorded in
+    return frame.sort_values(["story_id", "timestamp", "id"], kind="stable")
+
+
+def _states_at(current: pd.DataFrame, changes: pd.DataFrame) -> pd.DataFrame:
+    """Each story's state before `changes`: the old value of its first change to each field"""
+    states = current[STATE_COLUMNS].copy()
+    first = changes.drop_duplicates(["story_id", "field"], keep="first")
+    first = first[first["story_id"].isin(states.index)]
+    for field, column in (("assignee", "assignee"), ("status", "status"), ("story_points", "points")):
+        before = first[first["field"] == field].set_index("story_id")["old_value"]
+        if column == "points":
+            before = _points(before)
+        states.loc[before.index, column] = before
+    states["points"] = states["points"].astype("int64")
+    return states
+
+
+def _deltas(current: pd.DataFrame, changes: pd.DataFrame, start: pd.Timestamp) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    The (assignee, status) totals when `start` began, and per-day deltas
+    from stories created or changed since.
+    """
+    initial = _states_at(current, changes)
+    # A story without a creation time has always been there
+    created = current["created_on"].fillna(pd.Timestamp.min)
+    existing = initial[created < start]
+    base = existing.groupby(["assignee", "status"]).agg(stories=("points", "size"), points=("points", "sum"))
+
+    # One row per state a story passes through: its state at `start` (or at
+    # creation), then every change with only the changed column filled in
+    touched = initial[(created >= start) | initial.index.isin(changes["story_id"])]
+    opening = touched.reset_index()
+    opening["timestamp"] = created.loc[touched.index].clip(lower=start).to_numpy()
+    opening["kind"] = np.where(created.loc[touched.index].to_numpy() >= start, "created", "opening")
+    opening["order"] = 0
+
+    steps = changes[changes["story_id"].isin(initial.index)]
+    step_rows = pd.DataFrame({
+        "story_id": steps["story_id"].to_numpy(),
+        "timestamp": steps["timestamp"].to_numpy(),
+        "assignee": np.where(steps["field"] == "assignee", steps["new_value"], None),
+        "status": np.where(steps["field"] == "status", steps["new_value"], None),
+        "points": np.where(steps["field"] == "story_points", _points(steps["new_value"]), np.nan),
+        "kind": "change",
+        "order": np.arange(1, len(steps) + 1),
+    })
+    timeline = pd.concat([opening, step_rows], ignore_index=True).sort_values(["story_id", "order"], kind="stable")
+    grouped = timeline.groupby("story_id", sort=False)
+    timeline[STATE_COLUMNS] = grouped[STATE_COLUMNS].ffill()
+    previous = grouped[STATE_COLUMNS].shift(1)
+    timeline["day"] = timeline["timestamp"].dt.normalize()
+
+    events = timeline[timeline["kind"] != "opening"]
+    previous = previous.loc[events.index]
+    entered = (events["kind"] == "created") | (events["status"] != previous["status"])
+    arrivals = pd.DataFrame({
+        "day": events["day"],
+        "assignee": events["assignee"],
+        "status": events["status"],
+        "stories": 1,
+        "points": events["points"],
+        "entered_stories": entered.astype("int64"),
+        "entered_points": np.where(entered, events["points"], 0),
+    })
+    moved = events["kind"] == "change"
+    departures = pd.DataFrame({
+        "day": events.loc[moved, "day"],
+        "assignee": previous.loc[moved, "assignee"],
+        "status": previous.loc[moved, "status"],
+        "stories": -1,
+        "points": -previous.loc[moved, "points"],
+        "entered_stories": 0,
+        "entered_points": 0,
+    })
+    deltas = pd.concat([arrivals, departures], ignore_index=True)
+    deltas[DELTA_COLUMNS] = deltas[DELTA_COLUMNS].astype("int64")
+    return base, deltas
+
+
+def _daily_totals(base: pd.DataFrame, deltas: pd.DataFrame, days: pd.DatetimeIndex) -> pd.DataFrame:
+    per_day = deltas.pivot_table(
+        index="day", columns=["assignee", "status"], values=DELTA_COLUMNS, aggfunc="sum", fill_value=0,
+    )
+    keys = base.index.union(
+        pd.MultiIndex.from_frame(deltas[["assignee", "status"]].drop_duplicates())
+    ) if len(deltas) else base.index
+    if len(keys) == 0:
+        return pd.DataFrame(columns=["day", "assignee", "status", *DELTA_COLUMNS])
+
+    def wide(column: str) -> pd.DataFrame:
+        values = per_day[column] if column in per_day else pd.DataFrame(index=days)
+        return values.reindex(index=days, columns=keys, fill_value=0)
+
+    start = base.reindex(keys, fill_value=0)
+    totals = {
+        "stories": wide("stories").cumsum() + start["stories"].to_numpy(),
+        "points": wide("points").cumsum() + start["points"].to_numpy(),
+        "entered_stories": wide("entered_stories"),
+        "entered_points": wide("entered_points"),
+    }
+    frame = pd.concat(
+        {name: values.stack(["assignee", "status"]) for name, values in totals.items()}, axis=1,
+    ).rename_axis(["day", "assignee", "status"]).reset_index()
+    frame = frame[(frame["stories"] != 0) | (frame["entered_stories"] != 0)]
+    frame["day"] = frame["day"].dt.date
+    frame[DELTA_COLUMNS] = frame[DELTA_COLUMNS].astype("int64")
+    return frame
+
+
+def build_snapshots(db: Session, full: bool = False) -> int:
+    """
+    Bring story_daily_snapshots up to today, from the last day built (or
+    from the first story with `full`); returns the number of rows written.
+    """
+    snapshot = models.StoryDailySnapshot
+    last_day = None if full else db.query(func.max(snapshot.day)).scalar()
+    if last_day is None:
+        first_story = db.query(func.min(models.UserStory.created_on)).scalar()
+        if first_story is None:
+            db.query(snapshot).delete(synchronize_session=False)
+            db.commit()
+            return 0
+        last_day = pd.Timestamp(first_story).date()
+    start = pd.Timestamp(last_day)
+
+    current = _story_states(db)
+    changes = _changes(db, start.to_pydatetime())
+    seen = [changes["timestamp"].max(), current["created_on"].max()]
+    latest = max([pd.Timestamp(date.today()), *(pd.Timestamp(value) for value in seen if not pd.isna(value))])
+    days = pd.date_range(start, latest.normalize(), freq="D")
+
+    base, deltas = _deltas(current, changes, start)
+    rows = _daily_totals(base, deltas, days).to_dict("records")
+
+    db.query(snapshot).filter(snapshot.day >= start.date()).delete(synchronize_session=False)
+    for offset in range(0, len(rows), WRITE_BATCH_SIZE):
+        db.execute(insert(snapshot), rows[offset:offset + WRITE_BATCH_SIZE])
+    versions.bump(db, ANALYTICS)
+    db.commit()
+    return len(rows)
+
+
+def _window(db: Session, start: Optional[date], end: Optional[date], default_days: int) -> tuple[date, date, Optional[date]]:
+    through = db.query(func.max(models.StoryDailySnapshot.day)).scalar()
+    end = end or through or date.today()
+    start = start or end - timedelta(days=default_days - 1)
+    if start > end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="start must not be after end")
+    return start, end, through
+
+
+def _daily(db: Session, start: date, end: date, assignee: Optional[str], done_only: bool) -> pd.DataFrame:
+    snapshot = models.StoryDailySnapshot
+    query = db.query(
+        snapshot.day, snapshot.status,
+        func.sum(snapshot.stories), func.sum(snapshot.points),
+        func.sum(snapshot.entered_stories), func.sum(snapshot.entered_points),
+    ).filter(snapshot.day >= start, snapshot.day <= end)
+    if assignee is not None:
+        query = query.filter(snapshot.assignee == assignee)
+    if done_only:
+        query = query.filter(snapshot.status == DONE_STATUS)
+    frame = pd.DataFrame(query.group_by(snapshot.day, snapshot.status).all(), columns=["day", "status", *DELTA_COLUMNS])
+    frame["day"] = pd.to_datetime(frame["day"])
+    frame[DELTA_COLUMNS] = frame[DELTA_COLUMNS].astype("int64")
+    return frame
+
+
+def burndown(db: Session, start: Optional[date], end: Optional[date], assignee: Optional[str]) -> schemas.BurndownReport:
+    """Points still open at the end of each day, against a straight line to zero"""
+    start, end, through = _window(db, start, end, default_days=30)
+    last = min(end, through) if through else None
+    days = pd.date_range(start, last, freq="D") if last and last >= start else pd.DatetimeIndex([])
+
+    frame = _daily(db, start, end, assignee, done_only=False)
+    done = frame["status"] == DONE_STATUS
+    totals = frame.groupby("day")[["stories", "points"]].sum().reindex(days, fill_value=0)
+    finished = frame[done].groupby("day")[DELTA_COLUMNS].sum().reindex(days, fill_value=0)
+    remaining_points = (totals["points"] - finished["points"]).to_numpy()
+    ideal = np.linspace(remaining_points[0], 0, len(days)) if len(days) else np.array([])
+
+    return schemas.BurndownReport(
+        assignee=assignee, start=start, end=end, through=through,
+        days=[
+            schemas.BurndownDay(
+                day=day.date(),
+                total_points=int(total),
+                remaining_points=int(remaining),
+                remaining_stories=int(stories - done_stories),
+                completed_points=int(completed),
+                ideal_points=round(float(target), 2),
+            )
+            for day, total, remaining, stories, done_stories, completed, target in zip(
+                days, totals["points"], remaining_points, totals["stories"],
+                finished["stories"], finished["entered_points"], ideal,
+            )
+        ],
+    )
+
+
+PERIODS = {"day": "D", "week": "W-SUN", "month": "M"}
+
+
+def velocity(
+    db: Session, start: Optional[date], end: Optional[date], assignee: Optional[str], period: str,
+) -> schemas.VelocityReport:
+    """Points and stories moved to Done per day, week (from Monday) or month"""
+    start, end, through = _window(db, start, end, default_days=84)
+    # Days past the last snapshot are unknown, not zero
+    last = min(end, through) if through else None
+    frame = _daily(db, start, end, assignee, done_only=True)
+    days = pd.date_range(start, last, freq="D") if last and last >= start else pd.DatetimeIndex([])
+    completed = frame.groupby("day")[["entered_stories", "entered_points"]].sum().reindex(days, fill_value=0)
+    periods = completed.groupby(days.to_period(PERIODS[period]).start_time).sum()
+
+    return schemas.VelocityReport(
+        assignee=assignee, period=period, start=start, end=end, through=through,
+        average_points=round(float(periods["entered_points"].mean()), 2) if len(periods) else 0.0,
+        periods=[
+            schemas.VelocityPeriod(start=period_start.date(), completed_points=int(points), completed_stories=int(stories))
+            for period_start, stories, points in zip(periods.index, periods["entered_stories"], periods["entered_points"])
+        ],
+    )
@@ -1,26 +1,303 @@
+"""
+Access and refresh tokens, their revocation, and the authenticated principal.
+"""
 import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Optional
 from jose import jwt, JWTError
 from fastapi import HTTPException, status
 from dotenv import load_dotenv
 
+from config import redis_client, settings
+
 load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024"))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+REVOKED_PREFIX = "revoked:"
+
 
-def create_access_token(sub: str) -> str:
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode = {"sub": sub, "exp": expire}
+def _encode(claims: dict, lifetime: timedelta, sub: str, uid: Optional[int], username: Optional[str]) -> str:
+    to_encode = {**claims, "sub": sub, "exp": datetime.utcnow() + lifetime, "jti": uuid.uuid4().hex}
+    # Stable identifiers so the request path can find the user without the email index
+    if uid is not None:
+        to_encode["uid"] = uid
+    if username is not None:
+        to_encode["username"] = username
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def verify_access_token(token: str) -> dict:
+
+def create_access_token(
+    sub: str, uid: Optional[int] = None, username: Optional[str] = None, sid: Optional[str] = None,
+) -> str:
+    claims = {"type": "access", "sid": sid or uuid.uuid4().hex}
+    return _encode(claims, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES), sub, uid, username)
+
+
+def create_refresh_token(sub: str, uid: Optional[int], username: Optional[str], sid: str) -> str:
+    return _encode({"type": "refresh", "sid": sid}, timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS), sub, uid, username)
+
+
+def create_token_pair(sub: str, uid: Optional[int], username: Optional[str], sid: Optional[str] = None) -> dict:
+    """A new sign-in (no `sid`) or the next pair of an existing one"""
+    sid = sid or uuid.uuid4().hex
+    return {
+        "access_token": create_access_token(sub, uid, username, sid),
+        "refresh_token": create_refresh_token(sub, uid, username, sid),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+
+def _unauthorized(detail: str = "Invalid or expired token") -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+
+def _decode(token: str) -> dict:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token",
-            headers={"WWW-Authenticate": "Bearer"}
-        )
\ No newline at end of file
+        raise _unauthorized()
+
+
+def verify_access_token(token: str) -> dict:
+    """Claims of a valid access token: signature checked once per token (token_cache), revocation every time"""
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = _decode(token)
+        # Tokens issued before refresh tokens existed have no type
+        if claims.get("type", "access") != "access":
+            raise _unauthorized()
+        token_cache.put(token, claims)
+    if revocations.any_revoked(claims.get("jti"), claims.get("sid")):
+        raise _unauthorized("Token has been revoked")
+    return claims
+
+
+def rotate_refresh_token(token: str) -> dict:
+    """
+    Spend a refresh token on the next token pair of its session. A token
+    spent twice means two holders, so the session is ended for both.
+    """
+    claims = _decode(token)
+    if claims.get("type") != "refresh" or "jti" not in claims or "sid" not in claims:
+        raise _unauthorized()
+    if revocations.is_revoked(claims["sid"]):
+        raise _unauthorized("Token has been revoked")
+    if not revocations.revoke(claims["jti"], claims["exp"]):
+        revoke_session(claims["sid"])
+        raise _unauthorized("Refresh token reused; sign in again")
+    return create_token_pair(claims["sub"], claims.get("uid"), claims.get("username"), claims["sid"])
+
+
+def revoke_session(sid: str) -> None:
+    """End a sign-in: every access and refresh token it issued stops working"""
+    revocations.revoke(sid, time.time() + REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+
+
+class TokenCache:
+    """Bounded LRU of decoded claims by token, each entry living until the token's exp"""
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        with self._lock:
+            claims = self._entries.get(token)
+            if claims is None or claims.get("exp", 0) <= time.time():
+                if claims is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return claims
+
+    def put(self, token: str, claims: dict) -> None:
+        with self._lock:
+            self._entries[token] = claims
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+class MemoryRevocations:
+    """Revoked jti/sid values until their expiry (unix time), for one worker"""
+
+    blocking = False
+    # Expired entries are swept after this many revocations
+    SWEEP_EVERY = 1000
+
+    def __init__(self):
+        self._expires = {}
+        self._lock = threading.Lock()
+        self._since_sweep = 0
+
+    def revoke(self, key: str, expires_at: float) -> bool:
+        """False if `key` was already revoked"""
+        now = time.time()
+        with self._lock:
+            if self._expires.get(key, 0) > now:
+                return False
+            self._expires[key] = expires_at
+            self._since_sweep += 1
+            if self._since_sweep >= self.SWEEP_EVERY:
+                self._expires = {k: v for k, v in self._expires.items() if v > now}
+                self._since_sweep = 0
+            return True
+
+    def is_revoked(self, key: Optional[str]) -> bool:
+        return key is not None and self._expires.get(key, 0) > time.time()
+
+    def any_revoked(self, *keys: Optional[str]) -> bool:
+        return any(self.is_revoked(key) for key in keys)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "size": len(self._expires)}
+
+
+class RedisRevocations:
+    """Revocations shared by every worker, expiring through Redis TTLs"""
+
+    blocking = True
+
+    def __init__(self, url: str, client=None):
+        self.client = redis_client(url, client)
+
+    def revoke(self, key: str, expires_at: float) -> bool:
+        ttl = max(1, int(expires_at - time.time()) + 1)
+        return bool(self.client.set(REVOKED_PREFIX + key, 1, nx=True, ex=ttl))
+
+    def is_revoked(self, key: Optional[str]) -> bool:
+        return key is not None and bool(self.client.exists(REVOKED_PREFIX + key))
+
+    def any_revoked(self, *keys: Optional[str]) -> bool:
+        keys = [REVOKED_PREFIX + key for key in keys if key is not None]
+        return bool(keys) and bool(self.client.exists(*keys))
+
+    def stats(self) -> dict:
+        return {"backend": "redis"}
+
+
+def build_revocations():
+    if settings.revocation_backend == "redis":
+        return RedisRevocations(settings.redis_url)
+    return MemoryRevocations()
+
+
+token_cache = TokenCache()
+revocations = build_revocations()
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Detached snapshot of the authenticated user, safe to share across requests"""
+    id: int
+    username: str
+    first_name: str
+    last_name: str
+    email: str
+    is_active: bool
+    created_on: Optional[datetime]
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            email=user.email,
+            is_active=user.is_active,
+            created_on=user.created_on,
+        )
+
+
+class PrincipalCache:
+    """Bounded LRU of principals by token subject; the User listeners in main.py drop stale ones"""
+
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, subject: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[subject]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(subject)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, subject: str, principal: Principal) -> None:
+        with self._lock:
+            self._entries[subject] = (time.monotonic() + self.ttl, principal)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Drop every entry for a user, whatever subject it was cached under"""
+        with self._lock:
+            stale = [key for key, (_, principal) in self._entries.items() if principal.id == user_id]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,120 @@
+"""
+Time the velocity and burndown reads against a backlog with a year of
+status history, and the snapshot build that feeds them. For comparison,
+"activity scan" computes the same weekly velocity straight from
+story_activity, as an endpoint without snapshots would have to.
+
+    python benchmarks/bench_analytics.py --stories 50000
+"""
+import argparse
+import json
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import func, update
+
+from common import STATUSES, make_session_factory, seed_stories, summarize, timed
+
+import analytics
+import models
+
+TARGET_MS = 100
+
+
+def add_status_history(session_factory, seed=515, days=365, batch_size=5000):
+    """Walk each story from To Do towards Done over `days`; returns the activity rows added"""
+    rng = random.Random(seed)
+    db = session_factory()
+    try:
+        stories = db.query(models.UserStory.id, models.UserStory.created_on).all()
+        activity, final = [], {}
+        for story_id, created_on in stories:
+            when = created_on
+            reached = rng.randrange(len(STATUSES))
+            for old, new in zip(STATUSES, STATUSES[1:reached + 1]):
+                when += timedelta(days=rng.uniform(0.5, days / len(STATUSES)), seconds=1)
+                activity.append({
+                    "story_id": story_id, "timestamp": when, "user": "bench", "action": f"Status {old} -> {new}",
+                    "field": "status", "old_value": old, "new_value": new,
+                })
+            final.setdefault(STATUSES[reached], []).append(story_id)
+        for offset in range(0, len(activity), batch_size):
+            db.bulk_insert_mappings(models.StoryActivity, activity[offset:offset + batch_size])
+        for status, ids in final.items():
+            for offset in range(0, len(ids), batch_size):
+                db.execute(
+                    update(models.UserStory)
+                    .where(models.UserStory.id.in_(ids[offset:offset + batch_size]))
+                    .values(status=status)
+                )
+        db.commit()
+        return len(activity)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stories", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    session_factory = make_session_factory(args.database_url)
+    usernames = seed_stories(session_factory, args.stories, users=args.users)
+    changes = add_status_history(session_factory)
+    db = session_factory()
+
+    builds = {
+        "full": summarize(timed(lambda: analytics.build_snapshots(db, full=True), 1)),
+        "incremental": summarize(timed(lambda: analytics.build_snapshots(db), 3)),
+    }
+    snapshot_rows = db.query(func.count()).select_from(models.StoryDailySnapshot).scalar()
+    # The year the seeded history covers
+    start = db.query(func.min(models.StoryDailySnapshot.day)).scalar()
+    end = start + timedelta(days=364)
+    activity = models.StoryActivity
+
+    def activity_scan():
+        rows = (
+            db.query(func.date(activity.timestamp), func.count(), func.sum(models.UserStory.story_points))
+            .join(models.UserStory, models.UserStory.id == activity.story_id)
+            .filter(activity.field == "status", activity.new_value == analytics.DONE_STATUS)
+            .filter(activity.timestamp >= start, activity.timestamp < end + timedelta(days=1))
+            .group_by(func.date(activity.timestamp))
+            .all()
+        )
+        weeks = {}
+        for day, stories, points in rows:
+            day = date.fromisoformat(str(day))
+            week = day - timedelta(days=day.weekday())
+            weeks[week] = weeks.get(week, 0) + (points or 0)
+        return weeks
+
+    reads = [
+        ("velocity: year by week", lambda: analytics.velocity(db, start, end, None, "week")),
+        ("velocity: year by week, one assignee", lambda: analytics.velocity(db, start, end, usernames[0], "week")),
+        ("velocity: year by month", lambda: analytics.velocity(db, start, end, None, "month")),
+        ("burndown: 30 days", lambda: analytics.burndown(db, None, None, None)),
+        ("burndown: year", lambda: analytics.burndown(db, start, end, None)),
+        ("burndown: year, one assignee", lambda: analytics.burndown(db, start, end, usernames[0])),
+        ("activity scan: year of done entries", activity_scan),
+    ]
+    results = {name: summarize(timed(fn, args.repeat)) for name, fn in reads}
+    db.close()
+    print(json.dumps({
+        "stories": args.stories,
+        "status_changes": changes,
+        "snapshot_rows": snapshot_rows,
+        "build": builds,
+        "results": results,
+        "over_target": [
+            name for name, stats in results.items()
+            if not name.startswith("activity scan") and stats["p95_ms"] > TARGET_MS
+        ],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
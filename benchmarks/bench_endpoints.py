@@ -0,0 +1,325 @@
+"""
+Endpoint benchmark: seed a database, drive the API in-process through the
+ASGI app, and report throughput and latency percentiles per endpoint.
+
+    python benchmarks/bench_endpoints.py --stories 20000 --concurrency 32 --output results.json
+    python benchmarks/bench_endpoints.py --baseline benchmarks/baseline.json --fail-on-regression
+
+Each endpoint runs as its own phase of --requests requests issued by
+--concurrency concurrent clients, so one slow endpoint does not skew the
+others' numbers. The dataset is generated from --seed and is the same on
+every run; results record the parameters so a baseline is only compared
+against a run of the same shape.
+
+SQLite in a temporary directory is used unless --database-url points
+elsewhere (the schema there is dropped and recreated). The story list
+cache is off by default so /stories measures the query path; pass
+--story-cache memory to measure with it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+BENCH_PASSWORD = "benchmark-password"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--stories", type=int, default=20000)
+    parser.add_argument("--activity-per-story", type=int, default=25, help="history rows per story")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400, help="per endpoint")
+    parser.add_argument("--login-requests", type=int, default=40, help="password hashing is deliberately slow")
+    parser.add_argument("--seed", type=int, default=515)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--db-mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--story-cache", choices=["off", "memory"], default="off")
+    parser.add_argument(
+        "--tasks", choices=["eager", "queued"], default="eager",
+        help="eager runs background jobs inside the request; queued hands them to an in-memory broker "
+             "with no worker, as the API sees a Celery deployment",
+    )
+    parser.add_argument("--endpoints", default=None, help="comma-separated subset of endpoint names")
+    parser.add_argument("--output", default=None, help="write results as JSON here")
+    parser.add_argument("--baseline", default=None, help="compare against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative p95/throughput regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """
+    The services behind the app (the story cache, the background jobs and
+    the database they write to) read config.settings at import, so this
+    runs before importing main; the app itself is configured by build_app
+    """
+    if args.database_url is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="ser515-endpoints-"), "bench.db")
+        args.database_url = f"sqlite:///{path}"
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["STORY_CACHE_BACKEND"] = args.story_cache
+    os.environ["TASKS_MODE"] = "eager" if args.tasks == "eager" else "celery"
+    os.environ["CELERY_BROKER_URL"] = "memory://"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+
+def build_app(args):
+    import dataclasses
+
+    import main
+    from config import settings, to_async_url
+
+    return main.create_app(dataclasses.replace(
+        settings,
+        database_url=args.database_url,
+        async_database_url=to_async_url(args.database_url),
+        read_replica_url=None,
+        async_read_replica_url=None,
+        db_mode=args.db_mode,
+        # Every request comes from one client address; the rate limits would be all we measured
+        admission_enabled=False,
+    ))
+
+
+def seed(args):
+    from common import make_session_factory, seed_stories
+
+    import counters
+    import models
+    import search
+    import versions
+    from hashing import crypt_context
+
+    session_factory = make_session_factory(args.database_url)
+    started = time.perf_counter()
+    usernames = seed_stories(
+        session_factory, args.stories, users=args.users,
+        activity_per_story=args.activity_per_story, seed=args.seed,
+    )
+    db = session_factory()
+    try:
+        # Every user shares one real hash so /login does the work it does in production
+        db.query(models.User).update({models.User.password_hash: crypt_context().hash(BENCH_PASSWORD)})
+        counters.rebuild_status_counts(db)
+        versions.bump(db)
+        db.commit()
+        search.rebuild_index(db)
+    finally:
+        db.close()
+    return usernames, time.perf_counter() - started
+
+
+def scenarios(args, usernames):
+    """name -> function(rng, i) returning (method, path, params, json body, user index)"""
+    from common import STATUSES, vocabulary
+
+    words, _ = vocabulary(seed=args.seed)
+    tags = words[:50]
+
+    def user(rng):
+        return rng.randrange(len(usernames))
+
+    return {
+        "POST /login": lambda rng, i: ("POST", "/login", None, None, None),
+        "GET /stories": lambda rng, i: ("GET", "/stories", {}, None, None),
+        "GET /stories?assignee": lambda rng, i: (
+            "GET", "/stories", {"assignee": usernames[user(rng)]}, None, None),
+        "GET /stories?status": lambda rng, i: (
+            "GET", "/stories", {"status": rng.choice(STATUSES)}, None, None),
+        "GET /stories?assignee&status": lambda rng, i: (
+            "GET", "/stories", {"assignee": usernames[user(rng)], "status": rng.choice(STATUSES)}, None, None),
+        "GET /stories?created_by": lambda rng, i: (
+            "GET", "/stories", {"created_by": usernames[user(rng)]}, None, None),
+        "GET /stories?tags": lambda rng, i: (
+            "GET", "/stories", {"tags": ",".join(rng.sample(tags, 2))}, None, None),
+        "GET /stories?date range": lambda rng, i: (
+            "GET", "/stories", {"start_date": date(2025, 1, 2).isoformat(), "end_date": date(2025, 1, 9).isoformat()},
+            None, None),
+        "GET /stories?view=summary": lambda rng, i: (
+            "GET", "/stories", {"view": "summary", "limit": 200}, None, None),
+        "GET /filter": lambda rng, i: (
+            "GET", "/filter", {"search": " ".join(rng.sample(words[:2000], 2)), "limit": 20}, None, None),
+        "GET /filter?id": lambda rng, i: (
+            "GET", "/filter", {"search": str(rng.randint(1, args.stories))}, None, None),
+        "GET /workspace": lambda rng, i: ("GET", "/workspace", {}, None, user(rng)),
+        "GET /workspace?include_stories=false": lambda rng, i: (
+            "GET", "/workspace", {"include_stories": "false"}, None, user(rng)),
+        "PUT /stories/{id}": lambda rng, i: (
+            "PUT", f"/stories/{rng.randint(1, args.stories)}", None, {
+                "title": f"benchmark title {i}",
+                "description": " ".join(rng.sample(words[:2000], 30)),
+                "assignee": usernames[user(rng)],
+                "status": rng.choice(STATUSES),
+                "tags": rng.sample(tags, 2),
+                "acceptance_criteria": [],
+                "story_points": rng.choice([1, 2, 3, 5, 8]),
+            }, user(rng)),
+    }
+
+
+async def run_phase(client, name, make_request, count, concurrency, tokens, usernames, seed):
+    from common import summarize
+
+    rng = random.Random(f"{seed}:{name}")
+    plan = [make_request(rng, i) for i in range(count)]
+    latencies, errors = [], 0
+    cursor = iter(plan)
+
+    async def worker():
+        nonlocal errors
+        for method, path, params, body, user_index in cursor:
+            headers = {}
+            if name == "POST /login":
+                body = {"email": f"{rng.choice(usernames)}@example.com", "password": BENCH_PASSWORD}
+            else:
+                index = user_index if user_index is not None else 0
+                headers["Authorization"] = f"Bearer {tokens[index]}"
+            started = time.perf_counter()
+            response = await client.request(method, path, params=params, json=body, headers=headers)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        **summarize(latencies),
+    }
+
+
+async def drive(args, usernames):
+    import httpx
+
+    import auth
+
+    tokens = [
+        auth.create_access_token(sub=f"{name}@example.com", uid=i + 1, username=name)
+        for i, name in enumerate(usernames)
+    ]
+    selected = scenarios(args, usernames)
+    if args.endpoints:
+        wanted = [name.strip() for name in args.endpoints.split(",")]
+        unknown = [name for name in wanted if name not in selected]
+        if unknown:
+            raise SystemExit(f"Unknown endpoints {unknown}; choose from {list(selected)}")
+        selected = {name: selected[name] for name in wanted}
+
+    results = {}
+    app = build_app(args)
+    # ASGITransport does not run the lifespan, which builds the app's engines
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, make_request in selected.items():
+                count = args.login_requests if name == "POST /login" else args.requests
+                results[name] = await run_phase(
+                    client, name, make_request, count, args.concurrency, tokens, usernames, args.seed
+                )
+                print(f"{name:40} {results[name]['throughput_rps']:>8} rps  "
+                      f"p50 {results[name]['p50_ms']:>8} ms  p95 {results[name]['p95_ms']:>8} ms  "
+                      f"p99 {results[name]['p99_ms']:>8} ms  errors {results[name]['errors']}", file=sys.stderr)
+    return results
+
+
+def metadata(args, seed_seconds):
+    import sqlalchemy
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "database": args.database_url.split(":", 1)[0],
+        "db_mode": args.db_mode,
+        "story_cache": args.story_cache,
+        "tasks": args.tasks,
+        "users": args.users,
+        "stories": args.stories,
+        "activity_per_story": args.activity_per_story,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "seed": args.seed,
+        "seed_seconds": round(seed_seconds, 1),
+    }
+
+
+# Parameters that change what is measured; a baseline with different values is not comparable
+SHAPE = ("database", "db_mode", "story_cache", "tasks", "users", "stories", "activity_per_story", "concurrency")
+# Values of parameters added after a baseline was recorded
+SHAPE_DEFAULTS = {"tasks": "eager"}
+
+
+def compare(results, baseline, tolerance):
+    """Print the change per endpoint against `baseline`; returns the names that regressed"""
+    mismatched = [
+        key for key in SHAPE if baseline["meta"].get(key, SHAPE_DEFAULTS.get(key)) != results["meta"].get(key)
+    ]
+    if mismatched:
+        print(f"warning: baseline differs in {', '.join(mismatched)}; deltas are not like for like", file=sys.stderr)
+
+    regressed = []
+    print(f"\n{'endpoint':40} {'p95 ms':>20} {'rps':>20}", file=sys.stderr)
+    for name, current in results["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before is None:
+            continue
+        p95_change = (current["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+        rps_change = (
+            (current["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"]
+            if before["throughput_rps"] else 0.0
+        )
+        worse = p95_change > tolerance or rps_change < -tolerance
+        if worse:
+            regressed.append(name)
+        print(f"{name:40} {before['p95_ms']:>8} -> {current['p95_ms']:<8} ({p95_change:+.0%}) "
+              f"{before['throughput_rps']:>8} -> {current['throughput_rps']:<8} ({rps_change:+.0%})"
+              f"{'  REGRESSED' if worse else ''}", file=sys.stderr)
+    return regressed
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    usernames, seed_seconds = seed(args)
+    endpoints = asyncio.run(drive(args, usernames))
+    results = {"meta": metadata(args, seed_seconds), "endpoints": endpoints}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressed = compare(results, baseline, args.tolerance)
+        if regressed:
+            print(f"\n{len(regressed)} endpoint(s) regressed beyond {args.tolerance:.0%}", file=sys.stderr)
+            if args.fail_on_regression:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Compare the old GET /filter path (title ICONTAINS) with the inverted index.
+
+    python benchmarks/bench_search.py --stories 100000
+"""
+import argparse
+import json
+
+from common import make_session_factory, seed_stories, summarize, timed, vocabulary
+
+import models
+import search
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stories", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    session_factory = make_session_factory(args.database_url)
+    seed_stories(session_factory, args.stories)
+
+    db = session_factory()
+    search.rebuild_index(db)
+
+    words, _ = vocabulary()
+    # A frequent, a mid-frequency and a rare term, plus a two-term query
+    queries = [words[0], words[200], words[4000], f"{words[10]} {words[3000]}"]
+
+    results = {}
+    for text in queries:
+        def icontains():
+            db.query(models.UserStory).filter(models.UserStory.title.icontains(text)).all()
+
+        def ranking():
+            search.search_stories(db, text, args.limit)
+
+        def ranked():
+            hits = search.search_stories(db, text, args.limit)
+            ids = [story_id for story_id, _ in hits]
+            db.query(models.UserStory).filter(models.UserStory.id.in_(ids)).all()
+
+        old = summarize(timed(icontains, args.repeat))
+        new = summarize(timed(ranked, args.repeat))
+        results[text] = {
+            "icontains": old,
+            "inverted_index": new,
+            # search_stories alone, without loading the page's stories
+            "ranking_only": summarize(timed(ranking, args.repeat)),
+            "speedup_p50": round(old["p50_ms"] / max(new["p50_ms"], 1e-6), 1),
+        }
+    db.close()
+    print(json.dumps({"stories": args.stories, "queries": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Compare serializing a long story list through the response models (ORM
+objects -> StoryResponse -> FastAPI's encoder, the old GET /stories and
+/workspace path) with the fast path in serializers.py (column rows ->
+dicts -> orjson). Also reports, per response format (formats.py), the
+payload size and how long a client takes to load it.
+
+    python benchmarks/bench_serialization.py --rows 10000
+"""
+import argparse
+import json
+
+from fastapi.encoders import jsonable_encoder
+
+from common import make_session_factory, seed_stories, summarize, timed
+
+import formats
+import models
+import schemas
+import serializers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    session_factory = make_session_factory(args.database_url)
+    seed_stories(session_factory, args.rows, users=1)
+    db = session_factory()
+
+    def models_path():
+        # A fresh session each time, as a request would have
+        with session_factory() as session:
+            rows = session.query(models.UserStory).limit(args.rows).all()
+            page = schemas.StoryPage(items=rows, next_cursor=None)
+            return json.dumps(jsonable_encoder(page.model_dump(by_alias=True))).encode()
+
+    def fast_path():
+        with session_factory() as session:
+            rows = session.query(*serializers.story_columns(None)).limit(args.rows).all()
+            return serializers.dumps({"items": serializers.story_dicts(session, rows, None), "nextCursor": None})
+
+    loaded_objects = db.query(models.UserStory).limit(args.rows).all()
+    loaded_rows = db.query(*serializers.story_columns(None)).limit(args.rows).all()
+
+    def models_encode_only():
+        page = schemas.StoryPage(items=loaded_objects, next_cursor=None)
+        return json.dumps(jsonable_encoder(page.model_dump(by_alias=True))).encode()
+
+    def fast_encode_only():
+        # Includes the tags query, which the ORM objects above already ran
+        return serializers.dumps({"items": serializers.story_dicts(db, loaded_rows, None), "nextCursor": None})
+
+    assert json.loads(models_path()) == json.loads(fast_path())
+
+    # name -> (encode, client-side load), for the formats this install has
+    items = serializers.story_dicts(db, loaded_rows, None)
+    payload_formats = {"json": (
+        lambda: serializers.dumps({"items": items, "nextCursor": None}),
+        json.loads,
+    )}
+    if formats.available(formats.ARROW):
+        read_arrow = lambda body: formats.arrow().ipc.open_stream(body).read_all()
+        payload_formats["arrow"] = (lambda: formats.arrow_page(items, None, None), read_arrow)
+    if formats.available(formats.MSGPACK):
+        payload_formats["msgpack"] = (
+            lambda: formats.msgpack_dumps({"items": items, "nextCursor": None}),
+            formats.msgpack.unpackb,
+        )
+    payloads = {}
+    for name, (encode, load) in payload_formats.items():
+        body = encode()
+        payloads[name] = {
+            "bytes": len(body),
+            "encode": summarize(timed(encode, args.repeat)),
+            "client_load": summarize(timed(lambda: load(body), args.repeat)),
+        }
+    results = {
+        name: summarize(timed(fn, args.repeat))
+        for name, fn in [
+            ("models: load + serialize", models_path),
+            ("fast: load + serialize", fast_path),
+            ("models: serialize loaded rows", models_encode_only),
+            ("fast: serialize loaded rows", fast_encode_only),
+        ]
+    }
+    db.close()
+    print(json.dumps({
+        "rows": args.rows,
+        "encoder": "orjson" if serializers.orjson is not None else "json",
+        "results": results,
+        "formats": payloads,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
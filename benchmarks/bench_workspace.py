@@ -0,0 +1,66 @@
+"""
+Compare the old GET /workspace status breakdown (load every assigned story
+and count in Python) with a GROUP BY and with the story_status_counts table.
+
+    python benchmarks/bench_workspace.py --users 5 --stories 50000
+"""
+import argparse
+import json
+
+from sqlalchemy import func
+
+from common import make_session_factory, seed_stories, summarize, timed
+
+import counters
+import models
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--stories", type=int, default=50000, help="total; spread evenly over --users")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    session_factory = make_session_factory(args.database_url)
+    usernames = seed_stories(session_factory, args.stories, users=args.users)
+    db = session_factory()
+    counters.rebuild_status_counts(db)
+    username = usernames[0]
+    story = models.UserStory
+
+    def load_and_count():
+        by_status = {}
+        for s in db.query(story).filter(story.assignee == username).all():
+            by_status[s.status] = by_status.get(s.status, 0) + 1
+        return by_status
+
+    def group_by():
+        return dict(
+            db.query(story.status, func.count(story.id))
+            .filter(story.assignee == username)
+            .group_by(story.status)
+            .all()
+        )
+
+    def counter_table():
+        return counters.status_breakdown(db, username)
+
+    assert load_and_count() == group_by() == counter_table()
+    assigned = sum(counter_table().values())
+
+    results = {
+        name: summarize(timed(fn, args.repeat))
+        for name, fn in [
+            ("load_and_count", load_and_count),
+            ("group_by", group_by),
+            ("counter_table", counter_table),
+        ]
+    }
+    db.close()
+    print(json.dumps({"stories_for_user": assigned, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Startup regression check: how long `import main` takes and what it does.
+
+Imports main in fresh interpreters and takes the fastest run, so a cold
+disk or a busy machine does not fail the check. Exits nonzero when the
+import is over budget, loads a module that belongs to the first request
+instead (pandas, pyarrow, passlib, the database drivers), creates a
+database engine or starts a thread.
+
+    python benchmarks/check_import_time.py
+    python benchmarks/check_import_time.py --budget-ms 1500 --runs 7
+
+`python -X importtime -c "import main"` shows where the time goes.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# About 15% over the measured ~950 ms, so a new eager import shows up
+DEFAULT_BUDGET_MS = 1100
+
+# Loaded by the request that needs them, never by `import main`
+DEFERRED_MODULES = ("pandas", "numpy", "pyarrow", "passlib", "pymysql", "aiomysql", "aiosqlite", "psycopg2")
+
+PROBE = """
+import json, sys, threading, time
+started = time.perf_counter()
+import main
+elapsed_ms = (time.perf_counter() - started) * 1000
+import database
+print(json.dumps({
+    "elapsed_ms": elapsed_ms,
+    "deferred_loaded": [name for name in json.loads(sys.argv[1]) if name in sys.modules],
+    "engines": len(database._engines) + (getattr(main.app.state, "databases", None) is not None),
+    "threads": [thread.name for thread in threading.enumerate() if thread is not threading.main_thread()],
+}))
+"""
+
+
+def probe() -> dict:
+    env = {**os.environ, "SECRET_KEY": os.environ.get("SECRET_KEY", "import-time-check")}
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, json.dumps(DEFERRED_MODULES)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    # The first run also compiles the bytecode; it only counts if it is the fastest
+    runs = [probe() for _ in range(args.runs)]
+    best = min(run["elapsed_ms"] for run in runs)
+    last = runs[-1]
+
+    failures = []
+    if best > args.budget_ms:
+        failures.append(f"import main took {best:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+    if last["deferred_loaded"]:
+        failures.append(f"import main loaded {', '.join(last['deferred_loaded'])}")
+    if last["engines"]:
+        failures.append(f"import main created {last['engines']} database engine(s)")
+    if last["threads"]:
+        failures.append(f"import main started threads: {', '.join(last['threads'])}")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"import main: {best:.0f} ms (budget {args.budget_ms:.0f} ms), no connections, no threads")
+
+
+if __name__ == "__main__":
+    main()
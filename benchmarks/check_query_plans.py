@@ -0,0 +1,172 @@
+"""
+Query-plan regression check for the hot read paths.
+
+Seeds a database, runs the crud functions behind GET /stories, /filter,
+/workspace, /stories/{id}, story activity and /analytics while recording
+every SQL statement they issue, then EXPLAINs each statement with its
+actual parameters. Exits nonzero if any of them reads a table with a full scan,
+so a filter that loses its index fails CI instead of production.
+
+    python benchmarks/check_query_plans.py
+    python benchmarks/check_query_plans.py --database-url mysql+pymysql://root:@127.0.0.1/plan_check
+
+Use a scratch database: the schema is dropped and recreated.
+"""
+import argparse
+import json
+import re
+import sys
+from datetime import date
+
+from sqlalchemy import event
+
+from common import make_session_factory, seed_stories, vocabulary
+
+import analytics
+import counters
+import crud
+import models
+import schemas
+import search
+import versions
+
+# Full scans that are expected, with the reason
+ALLOWED_SCANS = {
+    "search_documents": "BM25 collection stats, one aggregate cached for search.STATS_TTL_SECONDS",
+}
+
+_SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+_POSTGRES_SCAN = re.compile(r"Seq Scan on (\w+)")
+_WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+
+
+def hot_queries(usernames):
+    """(label, fn(db)) for every read the API serves on its hot paths"""
+    user = usernames[0]
+    words, _ = vocabulary()
+    filters = schemas.StoryFilters
+    page = 50
+
+    def second_page(db, **kwargs):
+        query_filters = filters(**kwargs)
+        first = json.loads(crud.list_stories(db, query_filters, None, page, None).body)
+        return crud.list_stories(db, query_filters, first["nextCursor"], page, None)
+
+    return [
+        ("list: first page", lambda db: crud.list_stories(db, filters(), None, page, None)),
+        ("list: next page", lambda db: second_page(db)),
+        ("list: assignee", lambda db: second_page(db, assignee=user)),
+        ("list: status", lambda db: second_page(db, status="Done")),
+        ("list: assignee + status", lambda db: second_page(db, assignee=user, status="Done")),
+        ("list: created_by", lambda db: second_page(db, created_by=user)),
+        ("list: tags any", lambda db: crud.list_stories(db, filters(tags=words[:2]), None, page, None)),
+        ("list: tags all", lambda db: crud.list_stories(db, filters(tags=words[:2], tags_match="all"), None, page, None)),
+        ("list: date range", lambda db: crud.list_stories(
+            db, filters(start_date=date(2025, 1, 2), end_date=date(2025, 1, 3)), None, page, None)),
+        ("list: summary view", lambda db: crud.list_stories(db, filters(assignee=user), None, page, crud.SUMMARY_FIELDS)),
+        ("workspace: counts", lambda db: crud.workspace(db, user, False, None)),
+        ("workspace: summary stories", lambda db: crud.workspace(db, user, True, crud.SUMMARY_FIELDS)),
+        ("filter: text search", lambda db: crud.search_stories(db, f"{words[0]} {words[500]}", None, page, None)),
+        ("filter: id", lambda db: crud.search_stories(db, "42", None, page, None)),
+        ("story: etag", lambda db: versions.story_etag(db, 42)),
+        ("story: get", lambda db: crud.get_story(db, 42)),
+        ("story: activity", lambda db: crud.story_activity_page(db, 42, None, page)),
+        ("story: activity next page", lambda db: crud.story_activity_page(
+            db, 42, crud.story_activity_page(db, 42, None, 1).next_cursor, page)),
+        ("list: etag", lambda db: versions.collection_etag(db, versions.STORIES, "list")),
+        ("analytics: velocity", lambda db: analytics.velocity(db, None, None, None, "week")),
+        ("analytics: burndown", lambda db: analytics.burndown(db, None, None, None)),
+        ("analytics: burndown assignee", lambda db: analytics.burndown(db, None, None, user)),
+    ]
+
+
+def full_scans(connection, statement, parameters):
+    """
+    Tables the plan for `statement` reads in full. Walking a whole index
+    counts too when the statement filters: that is what a filter whose own
+    index went missing looks like once the planner settles for the
+    (created_on, id) ordering index. Without a WHERE clause an ordered
+    index walk is just the first page of an unfiltered list.
+    """
+    dialect = connection.dialect.name
+    filtered = _WHERE.search(statement) is not None
+    if dialect == "sqlite":
+        rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+        return [
+            m.group(1) for row in rows
+            if (m := _SQLITE_SCAN.match(row[-1])) and (filtered or " INDEX " not in row[-1])
+        ]
+    if dialect == "mysql":
+        result = connection.exec_driver_sql("EXPLAIN " + statement, parameters)
+        columns = list(result.keys())
+        return [
+            row[columns.index("table")] for row in result.fetchall()
+            if (row[columns.index("type")] == "ALL" or (filtered and row[columns.index("type")] == "index"))
+            and not str(row[columns.index("table")]).startswith("<")
+        ]
+    if dialect == "postgresql":
+        rows = connection.exec_driver_sql("EXPLAIN " + statement, parameters).fetchall()
+        return [m.group(1) for (line,) in rows if (m := _POSTGRES_SCAN.search(line))]
+    raise SystemExit(f"No plan check for dialect {dialect!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stories", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--database-url", default=None, help="scratch database; a temporary SQLite file by default")
+    parser.add_argument("--verbose", action="store_true", help="print every plan, not only failures")
+    args = parser.parse_args()
+
+    session_factory = make_session_factory(args.database_url)
+    usernames = seed_stories(session_factory, args.stories, users=args.users, activity_per_story=3)
+    db = session_factory()
+    search.rebuild_index(db)
+    counters.rebuild_status_counts(db)
+    analytics.build_snapshots(db, full=True)
+    versions.bump(db)
+    db.commit()
+    engine = db.get_bind()
+    with engine.begin() as connection:
+        # Give the planner real statistics, as a production database would have
+        if engine.dialect.name == "sqlite":
+            connection.exec_driver_sql("ANALYZE")
+        elif engine.dialect.name == "mysql":
+            for table in models.Base.metadata.tables:
+                connection.exec_driver_sql(f"ANALYZE TABLE {table}")
+        elif engine.dialect.name == "postgresql":
+            connection.exec_driver_sql("ANALYZE")
+
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    failures = 0
+    queries = hot_queries(usernames)
+    for label, run in queries:
+        statements.clear()
+        run(db)
+        db.rollback()
+        captured = list(statements)
+        with engine.connect() as connection:
+            for statement, parameters in captured:
+                scans = [table for table in full_scans(connection, statement, parameters) if table not in ALLOWED_SCANS]
+                one_line = " ".join(statement.split())
+                if scans:
+                    failures += 1
+                    print(f"FAIL {label}: full scan of {', '.join(scans)}\n     {one_line}")
+                elif args.verbose:
+                    print(f"ok   {label}: {one_line}")
+    db.close()
+
+    if failures:
+        print(f"{failures} statement(s) fall back to a full table scan")
+        sys.exit(1)
+    print(f"All {len(queries)} hot read paths use indexes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Shared helpers for the benchmark scripts: a throwaway database and a
+synthetic backlog with a Zipf-like vocabulary so term selectivity looks
+like real text.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+
+STATUSES = ["To Do", "In Progress", "In Review", "Done"]
+
+
+def make_session_factory(database_url=None):
+    """Create the schema in `database_url` (a temporary SQLite file by default)"""
+    if database_url is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="ser515-bench-"), "bench.db")
+        database_url = f"sqlite:///{path}"
+    engine = create_engine(database_url)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def vocabulary(size=5000, seed=515):
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    words = sorted(words)
+    weights = [1 / (rank + 1) for rank in range(size)]
+    return words, weights
+
+
+def seed_stories(session_factory, stories, users=10, activity_per_story=1, seed=515, batch_size=2000):
+    """Insert `stories` synthetic stories spread across `users` assignees; returns the usernames"""
+    rng = random.Random(seed)
+    words, weights = vocabulary(seed=seed)
+    usernames = [f"user{i}" for i in range(users)]
+    start = datetime(2025, 1, 1)
+
+    def sentence(n):
+        return " ".join(rng.choices(words, weights, k=n))
+
+    db = session_factory()
+    try:
+        db.bulk_insert_mappings(models.User, [
+            {"username": name, "first_name": name, "last_name": "Bench",
+             "email": f"{name}@example.com", "password_hash": "x", "is_active": True,
+             "created_on": start}
+            for name in usernames
+        ])
+        rows, tags, activity = [], [], []
+        for i in range(1, stories + 1):
+            created_on = start + timedelta(minutes=i)
+            author = rng.choice(usernames)
+            rows.append({
+                "id": i,
+                "title": sentence(6),
+                "description": sentence(40),
+                "assignee": rng.choice(usernames),
+                "status": rng.choice(STATUSES),
+                "acceptance_criteria": [sentence(8) for _ in range(3)],
+                "story_points": rng.choice([1, 2, 3, 5, 8, 13]),
+                "created_by": author,
+                "created_on": created_on,
+            })
+            tags.extend(
+                {"story_id": i, "tag": tag, "position": p}
+                for p, tag in enumerate(dict.fromkeys(rng.choices(words[:50], k=2)))
+            )
+            activity.extend(
+                {"story_id": i, "timestamp": created_on + timedelta(seconds=n), "user": author,
+                 "action": f"[{created_on + timedelta(seconds=n):%Y-%m-%d %H:%M:%S}] {author}: {sentence(5)}"}
+                for n in range(activity_per_story)
+            )
+            if len(rows) >= batch_size:
+                db.bulk_insert_mappings(models.UserStory, rows)
+                db.bulk_insert_mappings(models.StoryTag, tags)
+                db.bulk_insert_mappings(models.StoryActivity, activity)
+                rows, tags, activity = [], [], []
+        if rows:
+            db.bulk_insert_mappings(models.UserStory, rows)
+            db.bulk_insert_mappings(models.StoryTag, tags)
+            db.bulk_insert_mappings(models.StoryActivity, activity)
+        db.commit()
+    finally:
+        db.close()
+    return usernames
+
+
+def timed(fn, repeat):
+    """Run fn `repeat` times and return the per-call latencies in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "p50_ms": round(pct(50), 3),
+        "p95_ms": round(pct(95), 3),
+        "p99_ms": round(pct(99), 3),
+        "max_ms": round(ordered[-1], 3),
+    }
@@ -0,0 +1,112 @@
+"""
+Drive the app in-process with many concurrent clients to compare the sync
+and async database stacks on a local SQLite file.
+
+    python benchmarks/load_test.py --mode both --clients 200
+
+Each mode runs in its own interpreter because DB_MODE and DATABASE_URL are
+read when the app is imported.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def run_mode(args):
+    from common import make_session_factory, seed_stories, summarize, vocabulary
+
+    import httpx
+
+    import auth
+    import counters
+    import main
+    import search
+
+    session_factory = make_session_factory(os.environ["DATABASE_URL"])
+    usernames = seed_stories(session_factory, args.stories)
+    db = session_factory()
+    counters.rebuild_status_counts(db)
+    search.rebuild_index(db)
+    db.close()
+
+    tokens = [
+        auth.create_access_token(sub=f"{name}@example.com", uid=i + 1, username=name)
+        for i, name in enumerate(usernames)
+    ]
+    words, _ = vocabulary()
+    requests = [
+        ("GET /stories", "/stories", {"limit": 50, "view": "summary"}),
+        ("GET /workspace", "/workspace", {"include_stories": "false"}),
+        ("GET /filter", "/filter", {"search": words[300], "limit": 20}),
+    ]
+    latencies = {name: [] for name, _, _ in requests}
+    errors = 0
+
+    async def client_loop(client, n):
+        nonlocal errors
+        headers = {"Authorization": f"Bearer {tokens[n % len(tokens)]}"}
+        for i in range(args.requests_per_client):
+            name, path, params = requests[(n + i) % len(requests)]
+            started = time.perf_counter()
+            response = await client.get(path, params=params, headers=headers)
+            latencies[name].append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    async def drive():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(client_loop(client, n) for n in range(args.clients)))
+            return time.perf_counter() - started
+
+    elapsed = asyncio.run(drive())
+    total = sum(len(samples) for samples in latencies.values())
+    print(json.dumps({
+        "mode": os.environ["DB_MODE"],
+        "clients": args.clients,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 1),
+        "endpoints": {name: summarize(samples) for name, samples in latencies.items()},
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["sync", "async", "both"], default="both")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests-per-client", type=int, default=10)
+    parser.add_argument("--stories", type=int, default=5000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_mode(args)
+        return
+
+    modes = ["sync", "async"] if args.mode == "both" else [args.mode]
+    results = []
+    for mode in modes:
+        path = os.path.join(tempfile.mkdtemp(prefix="ser515-load-"), "load.db")
+        # All clients share one address, so admission control would cap the load at its rate limit
+        env = dict(os.environ, DB_MODE=mode, DATABASE_URL=f"sqlite:///{path}", ADMISSION_ENABLED="false")
+        env.setdefault("SECRET_KEY", "load-test-secret")
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", "--mode", mode,
+             "--clients", str(args.clients),
+             "--requests-per-client", str(args.requests_per_client),
+             "--stories", str(args.stories)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
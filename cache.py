@@ -0,0 +1,246 @@
+"""
+Result cache for GET /stories pages, in process or in Redis (STORY_CACHE_BACKEND).
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import schemas
+from config import redis_client, settings
+
+KEY_PREFIX = "storycache:"
+
+
+def filter_tag(filters: schemas.StoryFilters) -> str:
+    """An entry's tag: its most selective equality filter, so a write only drops the pages it can change"""
+    if filters.assignee:
+        return f"assignee:{filters.assignee}"
+    if filters.status:
+        return f"status:{filters.status}"
+    if filters.created_by:
+        return f"created_by:{filters.created_by}"
+    return "all"
+
+
+def tags_for_story(*states: tuple) -> set[str]:
+    """Tags to invalidate for a story write, given (assignee, status, created_by) before and/or after it"""
+    tags = {"all"}
+    for assignee, status, created_by in states:
+        tags.add(f"assignee:{assignee}")
+        tags.add(f"status:{status}")
+        if created_by:
+            tags.add(f"created_by:{created_by}")
+    return tags
+
+
+def page_key(filters: schemas.StoryFilters, cursor: Optional[str], limit: int, fields: Optional[list[str]]) -> str:
+    shape = json.dumps([filters.model_dump(mode="json"), cursor, limit, fields], sort_keys=True)
+    return hashlib.sha1(shape.encode()).hexdigest()
+
+
+class MemoryBackend:
+    """Bounded LRU with per-entry expiry, local to the worker process"""
+
+    blocking = False
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (expires_at, tag, value)
+        self._tag_keys = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def generation(self, tag: str) -> int:
+        with self._lock:
+            return self._generations.get(tag, 0)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key: str, tag: str, generation: int, value: bytes, ttl: float) -> bool:
+        with self._lock:
+            if self._generations.get(tag, 0) != generation:
+                return False
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + ttl, tag, value)
+            self._tag_keys.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        dropped = 0
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+                for key in self._tag_keys.pop(tag, ()):
+                    if self._entries.pop(key, None) is not None:
+                        dropped += 1
+        return dropped
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tag_keys.clear()
+            self._generations.clear()
+
+    def _drop(self, key: str) -> None:
+        _, tag, _ = self._entries.pop(key)
+        keys = self._tag_keys.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tag_keys[tag]
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Cache shared by every worker: entries expire through TTLs, and each tag is a key set plus a generation"""
+
+    blocking = True
+    evictions = 0
+
+    def __init__(self, url: str, client=None):
+        self.client = redis_client(url, client)
+
+    def generation(self, tag: str) -> int:
+        return int(self.client.get(f"{KEY_PREFIX}gen:{tag}") or 0)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(f"{KEY_PREFIX}page:{key}")
+
+    def set(self, key: str, tag: str, generation: int, value: bytes, ttl: float) -> bool:
+        if self.generation(tag) != generation:
+            return False
+        ttl = max(1, int(ttl))
+        pipe = self.client.pipeline()
+        pipe.set(f"{KEY_PREFIX}page:{key}", value, ex=ttl)
+        pipe.sadd(f"{KEY_PREFIX}tag:{tag}", key)
+        pipe.expire(f"{KEY_PREFIX}tag:{tag}", ttl)
+        pipe.execute()
+        return True
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        dropped = 0
+        for tag in tags:
+            tag_key = f"{KEY_PREFIX}tag:{tag}"
+            pipe = self.client.pipeline()
+            pipe.incr(f"{KEY_PREFIX}gen:{tag}")
+            pipe.smembers(tag_key)
+            pipe.delete(tag_key)
+            _, keys, _ = pipe.execute()
+            if keys:
+                dropped += self.client.delete(*(f"{KEY_PREFIX}page:{key.decode()}" for key in keys))
+        return dropped
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(f"{KEY_PREFIX}*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class StoryListCache:
+    """Counts hits, misses and time spent on each path on top of a backend"""
+
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.skipped_stores = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    @property
+    def blocking(self) -> bool:
+        return self.backend.blocking
+
+    def lookup(self, key: str, tag: str) -> tuple[Optional[tuple[str, bytes]], int]:
+        """The cached (etag, body) or None, and the tag generation to hand back to store()"""
+        # A hit keeps the ETag it was built under, so a stale page never carries a newer one
+        generation = self.backend.generation(tag)
+        value = self.backend.get(key)
+        if value is None:
+            return None, generation
+        etag, body = value.split(b"\n", 1)
+        return (etag.decode(), body), generation
+
+    def store(self, key: str, tag: str, generation: int, etag: str, body: bytes) -> None:
+        """Skipped if the tag was invalidated since lookup(), so a page read before a write is not kept"""
+        if not self.backend.set(key, tag, generation, etag.encode() + b"\n" + body, self.ttl):
+            with self._lock:
+                self.skipped_stores += 1
+
+    def invalidate(self, tags: Iterable[str]) -> None:
+        dropped = self.backend.invalidate(tags)
+        with self._lock:
+            self.invalidations += dropped
+
+    def observe(self, hit: bool, seconds: float) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.hit_seconds += seconds
+            else:
+                self.misses += 1
+                self.miss_seconds += seconds
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": type(self.backend).__name__,
+                "size": self.backend.size(),
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "avg_hit_ms": (self.hit_seconds / self.hits * 1000) if self.hits else 0.0,
+                "avg_miss_ms": (self.miss_seconds / self.misses * 1000) if self.misses else 0.0,
+                "evictions": self.backend.evictions,
+                "invalidations": self.invalidations,
+                "skipped_stores": self.skipped_stores,
+            }
+
+
+def build_story_cache() -> Optional[StoryListCache]:
+    if settings.story_cache_backend == "off":
+        return None
+    if settings.story_cache_backend == "redis":
+        backend = RedisBackend(settings.redis_url)
+    else:
+        backend = MemoryBackend(settings.story_cache_size)
+    return StoryListCache(backend, settings.story_cache_ttl_seconds)
+
+
+story_cache = build_story_cache()
+
+
+def invalidate_stories(tags: Iterable[str]) -> None:
+    """Called by the story write paths after they commit"""
+    if story_cache is not None:
+        story_cache.invalidate(tags)
@@ -0,0 +1,228 @@
+"""
+Application settings, read from the environment (and .env).
+"""
+import os
+import tempfile
+from dataclasses import dataclass, field
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_DATABASE_URL = "mysql+pymysql://root:@127.0.0.1/agile_db"
+
+# Sync driver -> async driver for the same database
+ASYNC_DRIVERS = {
+    "mysql+pymysql": "mysql+aiomysql",
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def to_async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+def redis_client(url: str, client=None):
+    """
+    `client`, or a Redis client for `url`. Stores built on one set
+    blocking = True: their calls do network I/O, so callers run them off
+    the event loop.
+    """
+    if client is None:
+        import redis  # only the Redis backends need it
+
+        client = redis.Redis.from_url(url)
+    return client
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_limits(name: str, default: dict) -> dict:
+    """Parse "METHOD /route=limit,..." into {"METHOD /route": limit}"""
+    value = os.getenv(name)
+    if value is None:
+        return dict(default)
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        route, _, limit = item.rpartition("=")
+        limits[route.strip()] = int(limit)
+    return limits
+
+
+# In-flight requests allowed per route before the next is turned away
+DEFAULT_ROUTE_CONCURRENCY = {
+    "POST /stories/bulk": 2,
+    "GET /stories/export": 4,
+    "POST /stories/exports": 4,
+    "GET /analytics/velocity": 8,
+    "GET /analytics/burndown": 8,
+}
+
+
+def _env_list(name: str, default: tuple) -> tuple:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return tuple(filter(None, (part.strip() for part in value.split(","))))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class Settings:
+    database_url: str = DEFAULT_DATABASE_URL
+    # "sync" runs queries on the threadpool with SessionLocal, "async" on the
+    # event loop with an AsyncSession
+    db_mode: str = "sync"
+    async_database_url: str = to_async_url(DEFAULT_DATABASE_URL)
+    # Connection pool, per engine and per worker process
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    # Server-side limit for a single statement, in milliseconds (MySQL/PostgreSQL)
+    db_statement_timeout_ms: Optional[int] = None
+    # Optional replica that read-only endpoints are routed to
+    read_replica_url: Optional[str] = None
+    async_read_replica_url: Optional[str] = None
+    # How long a client keeps reading from the primary after it writes
+    read_your_writes_seconds: int = 5
+    # Password hashing pool, see hashing.py
+    hash_executor: str = "thread"
+    hash_workers: int = min(4, os.cpu_count() or 1)
+    hash_max_queue: int = 64
+    # pbkdf2 rounds for new hashes; stored hashes below this are upgraded at login
+    hash_rounds: Optional[int] = None
+    # GET /stories result cache, see cache.py: memory, redis or off
+    story_cache_backend: str = "memory"
+    story_cache_size: int = 1024
+    story_cache_ttl_seconds: int = 30
+    redis_url: str = "redis://localhost:6379/0"
+    # GET /stories/stream, see events.py: memory or redis
+    events_backend: str = "memory"
+    events_replay_size: int = 1000
+    # Revoked tokens and sessions, see auth.py: memory or redis
+    revocation_backend: str = "memory"
+    # Request/SQL instrumentation and GET /metrics, see metrics.py
+    metrics_enabled: bool = True
+    slow_query_ms: int = 200
+    n_plus_one_threshold: int = 10
+    # Background jobs, see tasks.py: eager runs them in-process after the
+    # write commits, celery sends them to workers through the broker
+    tasks_mode: str = "eager"
+    celery_broker_url: str = "redis://localhost:6379/0"
+    # Files written by POST /stories/exports; shared by the API and the workers
+    export_dir: str = os.path.join(tempfile.gettempdir(), "story-exports")
+    export_ttl_seconds: int = 86400
+    analytics_snapshot_minutes: int = 15
+    # Assignment and status notifications; logged instead of mailed without a host
+    smtp_host: Optional[str] = None
+    smtp_port: int = 25
+    notify_from: str = "noreply@localhost"
+    # Admission control, see admission.py
+    admission_enabled: bool = True
+    rate_limit_backend: str = "memory"
+    rate_limit_per_second: float = 20.0
+    rate_limit_burst: int = 100
+    # /login, /users and /token/refresh, per client
+    login_rate_limit_per_minute: float = 10.0
+    login_rate_limit_burst: int = 5
+    route_concurrency: dict = field(default_factory=lambda: dict(DEFAULT_ROUTE_CONCURRENCY))
+    shed_on_saturation: bool = True
+    # Browser origins allowed to call the API (the frontend dev servers)
+    cors_origins: tuple = ("http://localhost:5173", "http://localhost:3000")
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        database_url = os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL)
+        db_mode = os.getenv("DB_MODE", "sync").lower()
+        if db_mode not in ("sync", "async"):
+            raise ValueError(f"DB_MODE must be 'sync' or 'async', got {db_mode!r}")
+        hash_executor = os.getenv("PASSWORD_HASH_EXECUTOR", "thread").lower()
+        if hash_executor not in ("thread", "process"):
+            raise ValueError(f"PASSWORD_HASH_EXECUTOR must be 'thread' or 'process', got {hash_executor!r}")
+        story_cache_backend = os.getenv("STORY_CACHE_BACKEND", "memory").lower()
+        if story_cache_backend not in ("memory", "redis", "off"):
+            raise ValueError(f"STORY_CACHE_BACKEND must be 'memory', 'redis' or 'off', got {story_cache_backend!r}")
+        events_backend = os.getenv("EVENTS_BACKEND", "memory").lower()
+        if events_backend not in ("memory", "redis"):
+            raise ValueError(f"EVENTS_BACKEND must be 'memory' or 'redis', got {events_backend!r}")
+        revocation_backend = os.getenv("REVOCATION_BACKEND", "memory").lower()
+        if revocation_backend not in ("memory", "redis"):
+            raise ValueError(f"REVOCATION_BACKEND must be 'memory' or 'redis', got {revocation_backend!r}")
+        rate_limit_backend = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+        if rate_limit_backend not in ("memory", "redis"):
+            raise ValueError(f"RATE_LIMIT_BACKEND must be 'memory' or 'redis', got {rate_limit_backend!r}")
+        tasks_mode = os.getenv("TASKS_MODE", "eager").lower()
+        if tasks_mode not in ("eager", "celery"):
+            raise ValueError(f"TASKS_MODE must be 'eager' or 'celery', got {tasks_mode!r}")
+        read_replica_url = os.getenv("READ_REPLICA_URL") or None
+        redis_url = os.getenv("REDIS_URL", cls.redis_url)
+        return cls(
+            database_url=database_url,
+            db_mode=db_mode,
+            async_database_url=os.getenv("ASYNC_DATABASE_URL", to_async_url(database_url)),
+            db_pool_size=_env_int("DB_POOL_SIZE", cls.db_pool_size),
+            db_max_overflow=_env_int("DB_MAX_OVERFLOW", cls.db_max_overflow),
+            db_pool_timeout=_env_int("DB_POOL_TIMEOUT", cls.db_pool_timeout),
+            db_pool_recycle=_env_int("DB_POOL_RECYCLE", cls.db_pool_recycle),
+            db_pool_pre_ping=_env_bool("DB_POOL_PRE_PING", cls.db_pool_pre_ping),
+            db_statement_timeout_ms=_env_int("DB_STATEMENT_TIMEOUT_MS", None),
+            read_replica_url=read_replica_url,
+            async_read_replica_url=os.getenv("ASYNC_READ_REPLICA_URL") or (
+                to_async_url(read_replica_url) if read_replica_url else None
+            ),
+            read_your_writes_seconds=_env_int("READ_YOUR_WRITES_SECONDS", cls.read_your_writes_seconds),
+            hash_executor=hash_executor,
+            hash_workers=_env_int("PASSWORD_HASH_WORKERS", cls.hash_workers),
+            hash_max_queue=_env_int("PASSWORD_HASH_MAX_QUEUE", cls.hash_max_queue),
+            hash_rounds=_env_int("PASSWORD_HASH_ROUNDS", None),
+            story_cache_backend=story_cache_backend,
+            story_cache_size=_env_int("STORY_CACHE_SIZE", cls.story_cache_size),
+            story_cache_ttl_seconds=_env_int("STORY_CACHE_TTL_SECONDS", cls.story_cache_ttl_seconds),
+            redis_url=redis_url,
+            events_backend=events_backend,
+            events_replay_size=_env_int("EVENTS_REPLAY_SIZE", cls.events_replay_size),
+            revocation_backend=revocation_backend,
+            metrics_enabled=_env_bool("METRICS_ENABLED", cls.metrics_enabled),
+            slow_query_ms=_env_int("SLOW_QUERY_MS", cls.slow_query_ms),
+            n_plus_one_threshold=_env_int("N_PLUS_ONE_THRESHOLD", cls.n_plus_one_threshold),
+            tasks_mode=tasks_mode,
+            celery_broker_url=os.getenv("CELERY_BROKER_URL", redis_url),
+            export_dir=os.getenv("EXPORT_DIR", cls.export_dir),
+            export_ttl_seconds=_env_int("EXPORT_TTL_SECONDS", cls.export_ttl_seconds),
+            analytics_snapshot_minutes=_env_int("ANALYTICS_SNAPSHOT_MINUTES", cls.analytics_snapshot_minutes),
+            smtp_host=os.getenv("SMTP_HOST") or None,
+            smtp_port=_env_int("SMTP_PORT", cls.smtp_port),
+            notify_from=os.getenv("NOTIFY_FROM", cls.notify_from),
+            admission_enabled=_env_bool("ADMISSION_ENABLED", cls.admission_enabled),
+            rate_limit_backend=rate_limit_backend,
+            rate_limit_per_second=_env_float("RATE_LIMIT_PER_SECOND", cls.rate_limit_per_second),
+            rate_limit_burst=_env_int("RATE_LIMIT_BURST", cls.rate_limit_burst),
+            login_rate_limit_per_minute=_env_float("LOGIN_RATE_LIMIT_PER_MINUTE", cls.login_rate_limit_per_minute),
+            login_rate_limit_burst=_env_int("LOGIN_RATE_LIMIT_BURST", cls.login_rate_limit_burst),
+            route_concurrency=_env_limits("ROUTE_CONCURRENCY", DEFAULT_ROUTE_CONCURRENCY),
+            shed_on_saturation=_env_bool("SHED_ON_SATURATION", cls.shed_on_saturation),
+            cors_origins=_env_list("CORS_ORIGINS", cls.cors_origins),
+        )
+
+
+settings = Settings.from_env()
@@ -0,0 +1,62 @@
+"""
+Per-assignee, per-status story counts for GET /workspace.
+
+The counts live in story_status_counts and are adjusted in the same
+transaction as the story write that changes them, so the dashboard reads
+a handful of rows instead of counting the assignee's whole backlog.
+"""
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+
+
+def adjust_status_count(db: Session, assignee: str, status: str, delta: int) -> None:
+    """Add `delta` to the (assignee, status) counter, creating it on first use"""
+    counter = models.StoryStatusCount
+    updated = db.query(counter).filter(
+        counter.assignee == assignee, counter.status == status
+    ).update({counter.count: counter.count + delta}, synchronize_session=False)
+    if updated or delta <= 0:
+        return
+
+    try:
+        with db.begin_nested():
+            db.add(counter(assignee=assignee, status=status, count=delta))
+    except IntegrityError:
+        # Another transaction created the row first
+        db.query(counter).filter(
+            counter.assignee == assignee, counter.status == status
+        ).update({counter.count: counter.count + delta}, synchronize_session=False)
+
+
+def move_story(db: Session, old_assignee: str, old_status: str, new_assignee: str, new_status: str) -> None:
+    """Account for a story whose assignee and/or status changed"""
+    if (old_assignee, old_status) == (new_assignee, new_status):
+        return
+    adjust_status_count(db, old_assignee, old_status, -1)
+    adjust_status_count(db, new_assignee, new_status, 1)
+
+
+def status_breakdown(db: Session, assignee: str) -> dict:
+    counter = models.StoryStatusCount
+    rows = db.query(counter.status, counter.count).filter(
+        counter.assignee == assignee, counter.count > 0
+    ).all()
+    return {status: count for status, count in rows}
+
+
+def rebuild_status_counts(db: Session) -> int:
+    """Recompute every counter with one GROUP BY over stories; returns the number of counters"""
+    story = models.UserStory
+    rows = db.query(story.assignee, story.status, func.count(story.id)).group_by(
+        story.assignee, story.status
+    ).all()
+    db.query(models.StoryStatusCount).delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.StoryStatusCount, [
+        {"assignee": assignee, "status": status, "count": count}
+        for assignee, status, count in rows
+    ])
+    db.commit()
+    return len(rows)
@@ -0,0 +1,773 @@
+"""
+Database operations behind the API endpoints.
+
+Everything here takes a plain sync Session so the same code serves both
+stacks: main.py runs it on the threadpool (DB_MODE=sync) or inside
+AsyncSession.run_sync (DB_MODE=async), see database.run_db. Functions
+return fully serialized responses because lazy loads are not possible
+once an async session hands control back to the event loop.
+
+Writes leave what follows their commit to the endpoint, through the
+AfterCommit they are given: the cache invalidation and the change event
+run off the event loop before the response and the background jobs are
+queued after it, all once the session is closed.
+"""
+import csv
+import io
+import json
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Iterator, Optional
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from pydantic import ValidationError
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, Query as SAQuery
+
+import auth
+import cache
+import counters
+import events
+import formats
+import models
+import schemas
+import search as search_index
+import serializers
+import tasks
+import versions
+from helper import (
+    encode_cursor, decode_cursor, encode_offset_cursor, decode_offset_cursor, normalize_tags,
+    to_camel_case,
+)
+
+# Field name (snake_case) -> key in the JSON response, for sparse fieldsets
+STORY_FIELD_ALIASES = {name: to_camel_case(name) for name in schemas.StoryResponse.model_fields}
+SUMMARY_FIELDS = list(schemas.StorySummary.model_fields)
+
+
+logger = logging.getLogger("crud")
+
+
+class AfterCommit:
+    """What a write leaves for after its session closes: (fn, *args) effects and (task, *args) jobs"""
+
+    def __init__(self):
+        self.effects = []
+        self.jobs = []
+
+    def run_effects(self) -> None:
+        """Run and forget the effects; blocking. A failure is logged, the write has committed"""
+        effects, self.effects = self.effects, []
+        for fn, *args in effects:
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("%s after commit failed", fn.__name__)
+
+
+def create_user(db: Session, request: schemas.UserCreate, password_hash: str) -> schemas.UserResponse:
+    name_parts = request.name.strip().split(maxsplit=1)
+    first_name = name_parts[0]
+    last_name = name_parts[1] if len(name_parts) > 1 else ""
+
+    user = models.User(
+        username=request.username,
+        first_name=first_name,
+        last_name=last_name,
+        email=request.email,
+        password_hash=password_hash
+    )
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return schemas.UserResponse.model_validate(user)
+
+
+def get_credentials(db: Session, email: str) -> Optional[tuple[auth.Principal, str]]:
+    """The user and their password hash, or None for an unknown email"""
+    user = db.query(models.User).filter_by(email=email).first()
+    if not user:
+        return None
+    return auth.Principal.from_user(user), user.password_hash
+
+
+def update_password_hash(db: Session, user_id: int, password_hash: str) -> None:
+    user = db.get(models.User, user_id)
+    if user:
+        user.password_hash = password_hash
+        db.commit()
+
+
+def load_principal(db: Session, creds: dict) -> auth.Principal:
+    query = db.query(models.User)
+    uid = creds.get("uid")
+    if uid is not None:
+        user = query.filter(models.User.id == uid).first()
+    else:
+        # Tokens minted before the uid claim existed
+        user = query.filter(models.User.email == creds.get("sub")).first()
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    return auth.Principal.from_user(user)
+
+
+def story_query(db: Session, fields: Optional[list[str]]) -> SAQuery:
+    """Query plain column rows for `fields` (plus the cursor key); see serializers.py"""
+    return db.query(*serializers.story_columns(fields))
+
+
+def story_page(
+    db: Session, rows: list, next_cursor: Optional[str], fields: Optional[list[str]], media_type: str = formats.JSON,
+) -> Response:
+    # Bypasses the StoryPage response model, which would revalidate every row
+    items = serializers.story_dicts(db, rows, fields)
+    if media_type == formats.ARROW:
+        return Response(formats.arrow_page(items, next_cursor, fields), media_type=formats.ARROW)
+    if media_type == formats.MSGPACK:
+        return Response(formats.msgpack_dumps({"items": items, "nextCursor": next_cursor}), media_type=formats.MSGPACK)
+    return serializers.FastJSONResponse({"items": items, "nextCursor": next_cursor})
+
+
+def paginate_stories(query: SAQuery, cursor: Optional[str], limit: int) -> tuple[list, Optional[str]]:
+    """
+    Keyset pagination over (created_on, id): the cursor carries the last row
+    we returned, so every page is an index range scan of `limit` rows no
+    matter how deep the client has scrolled.
+    """
+    if cursor:
+        try:
+            last_created_on, last_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=400, detail={"message": "Invalid cursor"}
+            )
+        query = query.filter(
+            # The redundant bound is what lets the planner seek on the index;
+            # the OR alone is not sargable
+            models.UserStory.created_on >= last_created_on,
+            or_(
+                models.UserStory.created_on > last_created_on,
+                and_(
+                    models.UserStory.created_on == last_created_on,
+                    models.UserStory.id > last_id,
+                ),
+            ),
+        )
+
+    # Fetch one extra row to find out whether another page exists
+    rows = query.order_by(
+        models.UserStory.created_on, models.UserStory.id
+    ).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_on, rows[-1].id)
+    return rows, next_cursor
+
+
+def filter_story_query(query: SAQuery, filters: schemas.StoryFilters) -> SAQuery:
+    if filters.assignee:
+        query = query.filter(models.UserStory.assignee == filters.assignee)
+
+    if filters.status:
+        query = query.filter(models.UserStory.status == filters.status)
+
+    if filters.tags:
+        # Resolved through ix_story_tags_tag_story_id instead of a LIKE scan
+        matching = select(models.StoryTag.story_id).where(models.StoryTag.tag.in_(filters.tags))
+        if filters.tags_match == "all":
+            matching = matching.group_by(models.StoryTag.story_id).having(
+                func.count(models.StoryTag.tag) == len(filters.tags)
+            )
+        query = query.filter(models.UserStory.id.in_(matching))
+
+    if filters.created_by:
+        query = query.filter(models.UserStory.created_by == filters.created_by)
+
+    if filters.start_date:
+        query = query.filter(models.UserStory.created_on >= filters.start_date)
+
+    if filters.end_date:
+        end_datetime = datetime.combine(filters.end_date, datetime.max.time())
+        query = query.filter(models.UserStory.created_on <= end_datetime)
+
+    return query
+
+
+def list_stories(
+    db: Session,
+    filters: schemas.StoryFilters,
+    cursor: Optional[str],
+    limit: int,
+    fields: Optional[list[str]],
+    media_type: str = formats.JSON,
+):
+    query = filter_story_query(story_query(db, fields), filters)
+    rows, next_cursor = paginate_stories(query, cursor, limit)
+    return story_page(db, rows, next_cursor, fields, media_type)
+
+
+def search_stories(
+    db: Session,
+    search: Optional[str],
+    cursor: Optional[str],
+    limit: int,
+    fields: Optional[list[str]],
+):
+    query = story_query(db, fields)
+
+    if search and search.isdigit():
+        story_id = int(search)
+        rows, next_cursor = paginate_stories(query.filter(models.UserStory.id == story_id), cursor, limit)
+        return story_page(db, rows, next_cursor, fields)
+
+    if not search or not search.strip():
+        rows, next_cursor = paginate_stories(query, cursor, limit)
+        return story_page(db, rows, next_cursor, fields)
+
+    # Ranked results have no stable sort key to seek on, so page by offset
+    offset = 0
+    if cursor:
+        try:
+            offset = decode_offset_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=400, detail={"message": "Invalid cursor"}
+            )
+
+    hits = search_index.search_stories(db, search, limit + 1, offset)
+    next_cursor = encode_offset_cursor(offset + limit) if len(hits) > limit else None
+    hits = hits[:limit]
+
+    found = {
+        story.id: story
+        for story in query.filter(models.UserStory.id.in_([story_id for story_id, _ in hits]))
+    }
+    items = [found[story_id] for story_id, _ in hits if story_id in found]
+    return story_page(db, items, next_cursor, fields)
+
+
+EXPORT_CSV_COLUMNS = [
+    "id", "title", "description", "assignee", "status", "tags",
+    "acceptance_criteria", "story_points", "created_by", "created_on",
+]
+
+
+def story_batches(db: Session, filters: schemas.StoryFilters, batch_size: int) -> Iterator[list[dict]]:
+    """
+    Every story matching `filters`, oldest first, as response dicts
+    `batch_size` at a time. Each batch is its own keyset page, so no cursor
+    stays open between batches and memory does not grow with the table.
+    """
+    query = filter_story_query(story_query(db, None), filters)
+    cursor = None
+    while True:
+        rows, cursor = paginate_stories(query, cursor, batch_size)
+        if rows:
+            yield serializers.story_dicts(db, rows, None)
+        if cursor is None:
+            return
+
+
+def export_stories(db: Session, filters: schemas.StoryFilters, fmt: str, batch_size: int = 1000) -> Iterator:
+    """Stream every story matching `filters` in one of formats.EXPORT_FORMATS, a batch per chunk"""
+    batches = story_batches(db, filters, batch_size)
+    if fmt == "arrow":
+        return formats.arrow_stream(batches, None)
+    if fmt == "msgpack":
+        return formats.msgpack_stream(batches)
+    if fmt == "csv":
+        return _csv_export(batches)
+    return (b"".join(serializers.dumps(item) + b"\n" for item in items) for items in batches)
+
+
+def _csv_value(name: str, value):
+    if name == "tags":
+        return ",".join(value)
+    if name == "acceptance_criteria":
+        return json.dumps(value or [])
+    if name == "created_on" and value is not None:
+        return serializers.json_default(value)
+    return value
+
+
+def _csv_export(batches: Iterator[list[dict]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([STORY_FIELD_ALIASES[name] for name in EXPORT_CSV_COLUMNS])
+    for items in batches:
+        for item in items:
+            writer.writerow([_csv_value(name, item[STORY_FIELD_ALIASES[name]]) for name in EXPORT_CSV_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header only, nothing matched
+        yield buffer.getvalue()
+
+
+def record_activity(
+    db: Session,
+    story_id: int,
+    username: str,
+    message: str,
+    field: Optional[str] = None,
+    old_value: Optional[str] = None,
+    new_value: Optional[str] = None,
+    when: Optional[datetime] = None,
+):
+    """Append one history row; never reads the existing history"""
+    when = when or datetime.now().replace(microsecond=0)
+    db.add(models.StoryActivity(
+        story_id=story_id,
+        timestamp=when,
+        user=username,
+        action=f"[{when.strftime('%Y-%m-%d %H:%M:%S')}] {username}: {message}",
+        field=field,
+        old_value=old_value,
+        new_value=new_value,
+    ))
+
+
+def validate_new_story(request: schemas.StoryCreate) -> None:
+    if not request.title or not request.title.strip():
+        raise HTTPException(
+            status_code=400, detail={"message":"Title cannot be empty"}
+        )
+    if not request.description or not request.description.strip():
+        raise HTTPException(
+            status_code=400, detail={"message":"Description cannot be empty"}
+        )
+    if not request.assignee or not request.assignee.strip():
+        raise HTTPException(
+            status_code=400, detail={"message":"Assignee cannot be empty"}
+        )
+    # Rejects an over-long tag here, so a bulk import reports it against its row
+    normalize_tags(request.tags)
+
+
+def new_story_row(request: schemas.StoryCreate, username: str) -> models.UserStory:
+    story = models.UserStory(
+        title=request.title,
+        description=request.description,
+        assignee=request.assignee,
+        status=request.status,
+        acceptance_criteria=request.acceptance_criteria or [],
+        story_points=request.story_points,
+        created_by=username
+    )
+    story.set_tags(normalize_tags(request.tags))
+    return story
+
+
+def create_story(db: Session, request: schemas.StoryCreate, username: str, after_commit: AfterCommit) -> dict:
+    validate_new_story(request)
+    new_story = new_story_row(request, username)
+    db.add(new_story)
+    db.flush()
+    record_activity(
+        db, new_story.id, username, "Created story",
+        field="created", new_value=new_story.status,
+    )
+    counters.adjust_status_count(db, new_story.assignee, new_story.status, 1)
+    versions.bump(db)
+    written = (new_story.assignee, new_story.status, username)
+    db.commit()
+    after_commit.effects.append((cache.invalidate_stories, cache.tags_for_story(written)))
+    db.refresh(new_story)
+    story = schemas.StoryResponse.model_validate(new_story)
+    after_commit.effects.append((events.publish, events.story_event(
+        "created", story.model_dump(mode="json", by_alias=True), written[:2]
+    )))
+    after_commit.jobs.append((tasks.index_stories, [story.id]))
+    tasks.notify_change(after_commit.jobs, story.id, new_story.version, username, None, written[:2])
+    return {"message": "Story added successfully", "story": story.model_dump()}
+
+
+def _insert_stories(db: Session, stories: list, username: str) -> None:
+    """Flush a batch of new stories with their history and counters; no commit"""
+    db.add_all(stories)
+    db.flush()
+    now = datetime.now().replace(microsecond=0)
+    created = Counter()
+    for story in stories:
+        record_activity(
+            db, story.id, username, "Created story",
+            field="created", new_value=story.status, when=now,
+        )
+        created[(story.assignee, story.status)] += 1
+    versions.bump(db)
+    # One counter update per (assignee, status) in the batch rather than per story
+    for (assignee, story_status), count in created.items():
+        counters.adjust_status_count(db, assignee, story_status, count)
+
+
+def import_stories(db: Session, rows: list, first_row: int, username: str, after_commit: AfterCommit) -> schemas.BulkImportResult:
+    """
+    Create one batch of stories from raw request items in a single
+    transaction. Items that fail validation are reported by row number
+    (counting from 1 across the whole upload) and the rest still go in; if
+    the batch itself fails to insert, its rows are retried one at a time so
+    a single bad row doesn't sink its neighbours.
+    """
+    result = schemas.BulkImportResult()
+    pending = []
+    for row_number, item in enumerate(rows, start=first_row):
+        if isinstance(item, Exception):
+            result.errors.append(schemas.BulkRowError(row=row_number, detail=str(item)))
+            continue
+        try:
+            request = schemas.StoryCreate.model_validate(item)
+            validate_new_story(request)
+        except ValidationError as exc:
+            result.errors.append(schemas.BulkRowError(
+                row=row_number, detail=jsonable_encoder(exc.errors(include_url=False, include_context=False)),
+            ))
+            continue
+        except HTTPException as exc:
+            result.errors.append(schemas.BulkRowError(row=row_number, detail=exc.detail["message"]))
+            continue
+        pending.append((row_number, request))
+
+    if not pending:
+        return result
+
+    stories = [new_story_row(request, username) for _, request in pending]
+    try:
+        _insert_stories(db, stories, username)
+        written = {(story.assignee, story.status, username) for story in stories}
+        ids = [story.id for story in stories]
+        db.commit()
+        result.ids.extend(ids)
+        after_commit.effects.append((cache.invalidate_stories, cache.tags_for_story(*written)))
+        after_commit.effects.append((events.publish, events.story_event(
+            "created", {"ids": ids}, *{state[:2] for state in written}
+        )))
+        # Imports index in one job per batch and notify no one
+        after_commit.jobs.append((tasks.index_stories, ids))
+    except SQLAlchemyError:
+        db.rollback()
+        for row_number, request in pending:
+            story = new_story_row(request, username)
+            try:
+                _insert_stories(db, [story], username)
+                written, story_id = (story.assignee, story.status, username), story.id
+                db.commit()
+                result.ids.append(story_id)
+                after_commit.effects.append((cache.invalidate_stories, cache.tags_for_story(written)))
+                after_commit.effects.append((events.publish, events.story_event(
+                    "created", {"ids": [story_id]}, written[:2]
+                )))
+                after_commit.jobs.append((tasks.index_stories, [story_id]))
+            except SQLAlchemyError as exc:
+                db.rollback()
+                result.errors.append(schemas.BulkRowError(row=row_number, detail=str(getattr(exc, "orig", None) or exc)))
+
+    result.created = len(result.ids)
+    result.errors.sort(key=lambda error: error.row)
+    return result
+
+
+def get_story(db: Session, story_id: int) -> schemas.StoryResponse:
+    story = db.get(models.UserStory, story_id)
+    if not story:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Story not found"
+        )
+    return schemas.StoryResponse.model_validate(story)
+
+
+PATCH_ORDER = ("title", "description", "story_points", "assignee", "status", "tags", "acceptance_criteria")
+
+# Columns that feed the search index; changing any of them means reindexing
+INDEXED_FIELDS = ("title", "description", "acceptance_criteria", "tags")
+
+
+def update_story(db: Session, story_id: int, request: schemas.StoryCreate, username: str, after_commit: AfterCommit) -> dict:
+    # Concurrent PUTs of one story would otherwise both replace its tag rows
+    story = db.query(models.UserStory).filter(models.UserStory.id == story_id).with_for_update().first()
+
+    if not story:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Story not found"
+        )
+
+    now = datetime.now().replace(microsecond=0)
+    old_assignee, old_status = story.assignee, story.status
+    changes = []
+
+    def track(message, field, old_value=None, new_value=None):
+        changes.append(field)
+        record_activity(db, story.id, username, message, field, old_value, new_value, when=now)
+
+    # Track title changes
+    if story.title != request.title:
+        track(f"Changed title from '{story.title}' to '{request.title}'", "title", story.title, request.title)
+        story.title = request.title
+
+    # Track description changes
+    if story.description != request.description:
+        track("Updated description", "description")
+        story.description = request.description
+
+    # Track story points changes; before assignee and status, so analytics,
+    # which replays changes in the order recorded, credits the new points
+    if story.story_points != request.story_points:
+        old_points = story.story_points or "None"
+        new_points = request.story_points or "None"
+        track(
+            f"Changed story points from {old_points} to {new_points}", "story_points",
+            None if story.story_points is None else str(story.story_points),
+            None if request.story_points is None else str(request.story_points),
+        )
+        story.story_points = request.story_points
+
+    # Track assignee changes
+    if story.assignee != request.assignee:
+        track(f"Changed assignee from '{story.assignee}' to '{request.assignee}'", "assignee", story.assignee, request.assignee)
+        story.assignee = request.assignee
+
+    # Track status changes
+    if story.status != request.status:
+        track(f"Changed status from '{story.status}' to '{request.status}'", "status", story.status, request.status)
+        story.status = request.status
+
+    # Handle tags
+    tags_value = normalize_tags(request.tags)
+
+    if list(story.tags) != tags_value:
+        track("Updated tags", "tags", ",".join(story.tags), ",".join(tags_value))
+        story.set_tags(tags_value)
+
+    # Track acceptance criteria changes
+    if story.acceptance_criteria != (request.acceptance_criteria or []):
+        track("Updated acceptance criteria", "acceptance_criteria")
+        story.acceptance_criteria = request.acceptance_criteria or []
+
+    # New comments arrive as {"text": ...} items; entries echoed back from
+    # the history have no "text" key and are skipped
+    for activity_item in request.activity or []:
+        if isinstance(activity_item, dict) and "text" in activity_item:
+            track(activity_item["text"], None)
+
+    # A comment alone leaves the story, and so its version, as it was (as in patch_story)
+    changed_fields = {field for field in changes if field}
+    if changed_fields:
+        story.version += 1
+        versions.bump(db)
+    counters.move_story(db, old_assignee, old_status, story.assignee, story.status)
+    reindex = bool(changed_fields & set(INDEXED_FIELDS))
+    # Read before commit() expires the instance
+    written = [(old_assignee, old_status, story.created_by), (story.assignee, story.status, story.created_by)]
+    db.commit()
+    if changed_fields:
+        after_commit.effects.append((cache.invalidate_stories, cache.tags_for_story(*written)))
+    db.refresh(story)
+    response = schemas.StoryResponse.model_validate(story)
+    if changed_fields:
+        payload = response.model_dump(mode="json", by_alias=True, include={"id", *changed_fields})
+        after_commit.effects.append((events.publish, events.story_event(
+            "updated", {**payload, "version": story.version}, *(state[:2] for state in written)
+        )))
+    if reindex:
+        after_commit.jobs.append((tasks.index_stories, [story_id]))
+    tasks.notify_change(after_commit.jobs, story_id, story.version, username, written[0][:2], written[1][:2])
+    return {"message": "Story updated successfully", "story": response.model_dump()}
+
+
+def patch_story(
+    db: Session,
+    story_id: int,
+    patch: schemas.StoryPatch,
+    expected_version: Optional[int],
+    username: str,
+    after_commit: AfterCommit,
+) -> dict:
+    """
+    Apply only the fields present in `patch`. Reads just the columns it
+    compares against, then writes them with one UPDATE guarded by the
+    version it read, so a concurrent change makes this fail with 409
+    instead of being overwritten. `expected_version` comes from If-Match.
+    Returns the whole story, the same shape as create and update.
+    """
+    requested = patch.model_fields_set - {"comment"}
+    if "tags" in requested:
+        patch.tags = normalize_tags(patch.tags)
+    if "acceptance_criteria" in requested:
+        patch.acceptance_criteria = patch.acceptance_criteria or []
+    for name in ("title", "description", "assignee", "status"):
+        if name in requested and (getattr(patch, name) is None or not getattr(patch, name).strip()):
+            raise HTTPException(
+                status_code=400, detail={"message": f"{name.capitalize()} cannot be empty"}
+            )
+
+    story = models.UserStory
+    # Counters and cache invalidation need assignee/status/created_by
+    columns = sorted((set(requested) | {"assignee", "status", "created_by"}) - {"tags"})
+    row = db.query(story.version, *(getattr(story, name) for name in columns)).filter(
+        story.id == story_id
+    ).first()
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Story not found"
+        )
+    current = dict(zip(columns, row[1:]))
+    version = row[0]
+    if expected_version is not None and expected_version != version:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Story was changed by someone else", "currentVersion": version},
+        )
+    if "tags" in requested:
+        current["tags"] = [
+            tag for (tag,) in db.query(models.StoryTag.tag)
+            .filter(models.StoryTag.story_id == story_id)
+            .order_by(models.StoryTag.position)
+        ]
+
+    # Recorded in the order update_story records them (points before status)
+    changed = {
+        name: getattr(patch, name) for name in PATCH_ORDER
+        if name in requested and getattr(patch, name) != current[name]
+    }
+    if not changed and not patch.comment:
+        return {"message": "No changes", "story": get_story(db, story_id).model_dump(), "version": version}
+
+    now = datetime.now().replace(microsecond=0)
+
+    def track(message, field, old_value=None, new_value=None):
+        record_activity(db, story_id, username, message, field, old_value, new_value, when=now)
+
+    for name, value in changed.items():
+        old = current[name]
+        if name in ("title", "assignee", "status"):
+            track(f"Changed {name} from '{old}' to '{value}'", name, old, value)
+        elif name == "story_points":
+            track(
+                f"Changed story points from {old or 'None'} to {value or 'None'}", name,
+                None if old is None else str(old), None if value is None else str(value),
+            )
+        elif name == "tags":
+            track("Updated tags", name, ",".join(old), ",".join(value))
+        else:
+            track(f"Updated {name.replace('_', ' ')}", name)
+    if patch.comment:
+        track(patch.comment, None)
+    if not changed:
+        # A comment alone leaves the story, and so its version, as it was
+        db.commit()
+        return {"message": "Comment added", "story": get_story(db, story_id).model_dump(), "version": version}
+
+    values = {name: value for name, value in changed.items() if name != "tags"}
+    updated = db.execute(
+        update(story)
+        .where(story.id == story_id, story.version == version)
+        .values(**values, version=story.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not updated:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Story was changed by someone else"},
+        )
+
+    if "tags" in changed:
+        db.query(models.StoryTag).filter(models.StoryTag.story_id == story_id).delete(synchronize_session=False)
+        db.bulk_insert_mappings(models.StoryTag, [
+            {"story_id": story_id, "tag": tag, "position": i} for i, tag in enumerate(changed["tags"])
+        ])
+
+    after = {**current, **changed}
+    counters.move_story(db, current["assignee"], current["status"], after["assignee"], after["status"])
+    versions.bump(db)
+    db.commit()
+    after_commit.effects.append((cache.invalidate_stories, cache.tags_for_story(
+        (current["assignee"], current["status"], current["created_by"]),
+        (after["assignee"], after["status"], after["created_by"]),
+    )))
+
+    story_fields = {STORY_FIELD_ALIASES[name]: value for name, value in changed.items()}
+    after_commit.effects.append((events.publish, events.story_event(
+        "updated", jsonable_encoder({"id": story_id, **story_fields, "version": version + 1}),
+        (current["assignee"], current["status"]), (after["assignee"], after["status"]),
+    )))
+    if set(changed) & set(INDEXED_FIELDS):
+        after_commit.jobs.append((tasks.index_stories, [story_id]))
+    tasks.notify_change(
+        after_commit.jobs, story_id, version + 1, username,
+        (current["assignee"], current["status"]), (after["assignee"], after["status"]),
+    )
+    return {
+        "message": "Story updated successfully",
+        "story": get_story(db, story_id).model_dump(),
+        "version": version + 1,
+    }
+
+
+def story_activity_page(db: Session, story_id: int, cursor: Optional[str], limit: int) -> schemas.ActivityPage:
+    exists = db.query(models.UserStory.id).filter(models.UserStory.id == story_id).first()
+    if not exists:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Story not found"
+        )
+
+    # Oldest first, seeking on ix_story_activity_story_id_timestamp
+    query = db.query(models.StoryActivity).filter(models.StoryActivity.story_id == story_id)
+    if cursor:
+        try:
+            last_timestamp, last_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=400, detail={"message": "Invalid cursor"}
+            )
+        query = query.filter(
+            models.StoryActivity.timestamp >= last_timestamp,
+            or_(
+                models.StoryActivity.timestamp > last_timestamp,
+                and_(
+                    models.StoryActivity.timestamp == last_timestamp,
+                    models.StoryActivity.id > last_id,
+                ),
+            ),
+        )
+
+    rows = query.order_by(
+        models.StoryActivity.timestamp, models.StoryActivity.id
+    ).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return schemas.ActivityPage(items=rows, next_cursor=next_cursor)
+
+
+def workspace(db: Session, username: str, include_stories: bool, fields: Optional[list[str]]):
+    # Served from story_status_counts rather than counting the backlog
+    by_status = counters.status_breakdown(db, username)
+    total_stories = sum(by_status.values())
+
+    stories = None
+    if include_stories:
+        rows = story_query(db, fields).filter(models.UserStory.assignee == username).all()
+        stories = serializers.story_dicts(db, rows, fields)
+
+    return serializers.FastJSONResponse({
+        "username": username,
+        "totalStories": total_stories,
+        "byStatus": by_status,
+        "stories": stories,
+    })
@@ -1,13 +1,226 @@
 import os
+import time
+from typing import Optional
+
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
 
 # The format for a passwordless connection is "username:@"
-# The database name at the end is 'agile_db'.
-SQLALCHEMY_DATABASE_URL = "mysql+pymysql://root:@127.0.0.1/agile_db"
+# The database name at the end is 'agile_db'. Override with DATABASE_URL.
+SQLALCHEMY_DATABASE_URL = settings.database_url
+
+# Cookie holding the time until which a client that just wrote reads from the primary
+READ_PIN_COOKIE = "db_primary_until"
+
+
+def engine_options(url: str, app_settings=settings) -> dict:
+    """create_engine/create_async_engine keyword arguments for `url` from `app_settings`"""
+    backend = make_url(url).get_backend_name()
+    options = {}
+    if backend == "sqlite":
+        # Sessions are handed between threadpool workers, which SQLite refuses by default
+        options["connect_args"] = {"check_same_thread": False}
+        if make_url(url).database in (None, "", ":memory:"):
+            # In-memory databases use a single-connection pool that takes no sizing
+            return options
+    options.update(
+        pool_size=app_settings.db_pool_size,
+        max_overflow=app_settings.db_max_overflow,
+        pool_timeout=app_settings.db_pool_timeout,
+        pool_recycle=app_settings.db_pool_recycle,
+        pool_pre_ping=app_settings.db_pool_pre_ping,
+    )
+    return options
+
+
+def install_statement_timeout(engine, timeout_ms) -> None:
+    """Cap every statement server side; a no-op on backends without a session setting for it"""
+    if not timeout_ms:
+        return
+    backend = engine.dialect.name
+    if backend == "mysql":
+        statement = f"SET SESSION max_execution_time = {int(timeout_ms)}"
+    elif backend == "postgresql":
+        statement = f"SET statement_timeout = {int(timeout_ms)}"
+    else:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_statement_timeout(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(statement)
+        cursor.close()
+
+
+def build_engine(url: str, app_settings=settings):
+    engine = create_engine(url, **engine_options(url, app_settings))
+    install_statement_timeout(engine, app_settings.db_statement_timeout_ms)
+    return engine
+
+
+def _build_sessionmaker(url: str, app_settings=settings):
+    return sessionmaker(autocommit=False, autoflush=False, bind=build_engine(url, app_settings))
+
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+# Engines and session factories for code outside a request (the background
+# jobs, manage.py), from config.settings. They are created on first use, in
+# the process that uses them: importing this module opens nothing, and a
+# pre-fork server's workers each build their own pools. An application has
+# its own, see Databases
+_engines = {}
+_sessionmakers = {}
+
+
+def _key(read_only: bool, replica_url: Optional[str]) -> str:
+    return "read" if read_only and replica_url else "primary"
+
+
+def get_engine(read_only: bool = False):
+    """The primary's engine, or with `read_only` the replica's (the primary's without one)"""
+    key = _key(read_only, settings.read_replica_url)
+    if key not in _engines:
+        _engines[key] = build_engine(settings.read_replica_url if key == "read" else SQLALCHEMY_DATABASE_URL)
+    return _engines[key]
+
+
+def get_sessionmaker(read_only: bool = False):
+    key = _key(read_only, settings.read_replica_url)
+    if key not in _sessionmakers:
+        _sessionmakers[key] = sessionmaker(autocommit=False, autoflush=False, bind=get_engine(read_only))
+    return _sessionmakers[key]
+
+
+def __getattr__(name: str):
+    # engine, SessionLocal and, for read-only work (the replica when one is
+    # configured), read_engine and ReadSessionLocal
+    if name == "engine":
+        return get_engine()
+    if name == "read_engine":
+        return get_engine(read_only=True)
+    if name == "SessionLocal":
+        return get_sessionmaker()
+    if name == "ReadSessionLocal":
+        return get_sessionmaker(read_only=True)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _build_async_sessionmaker(url: str, app_settings=settings):
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(url, **engine_options(url, app_settings))
+    install_statement_timeout(async_engine.sync_engine, app_settings.db_statement_timeout_ms)
+    return async_sessionmaker(async_engine, autoflush=False)
+
+
+class Databases:
+    """
+    An application's session factories for its DB_MODE stack, primary and
+    read-only (the replica when one is configured), built from the
+    application's settings. The lifespan builds them in each worker process.
+    """
+
+    def __init__(self, app_settings):
+        self.settings = app_settings
+        self.is_async = app_settings.db_mode == "async"
+        self._sync_factories = {}
+        if self.is_async:
+            self._factories = self._build(
+                _build_async_sessionmaker, app_settings.async_database_url, app_settings.async_read_replica_url
+            )
+        else:
+            self._factories = self._sync_factories = self._build(
+                _build_sessionmaker, app_settings.database_url, app_settings.read_replica_url
+            )
+
+    def _build(self, build, url: str, replica_url: Optional[str]) -> dict:
+        primary = build(url, self.settings)
+        return {"primary": primary, "read": build(replica_url, self.settings) if replica_url else primary}
+
+    def session_factory(self, read_only: bool = False):
+        return self._factories["read" if read_only else "primary"]
+
+    def sync_session_factory(self, read_only: bool = False):
+        """Plain Session factory on either stack, for work that runs in a thread (streamed exports)"""
+        if not self._sync_factories:
+            self._sync_factories = self._build(
+                _build_sessionmaker, self.settings.database_url, self.settings.read_replica_url
+            )
+        return self._sync_factories["read" if read_only else "primary"]
+
+    def _binds(self) -> list:
+        factories = [*self._factories.values(), *self._sync_factories.values()]
+        return list({id(factory.kw["bind"]): factory.kw["bind"] for factory in factories}.values())
+
+    def connection_pools(self) -> list:
+        """Pools of the engines created so far, the async ones by their sync side"""
+        return [getattr(engine, "sync_engine", engine).pool for engine in self._binds()]
+
+    async def dispose(self) -> None:
+        """Close every pooled connection, at shutdown"""
+        for engine in self._binds():
+            if hasattr(engine, "sync_engine"):
+                await engine.dispose()
+            else:
+                engine.dispose()
+
+
+def app_databases(app) -> Databases:
+    """
+    `app`'s Databases: the ones its lifespan built, or, for an app served
+    without its lifespan (httpx.ASGITransport), ones built on first use
+    """
+    if getattr(app.state, "databases", None) is None:
+        app.state.databases = Databases(app.state.settings)
+    return app.state.databases
+
+
+def _forget_inherited_connections() -> None:
+    # A forked child must not touch the parent's pooled connections (the
+    # socket is shared); new pools, leaving the parent's connections alone
+    for engine in _engines.values():
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_forget_inherited_connections)
+
+
+def reads_from_primary(cookies) -> bool:
+    """True while a client is pinned to the primary after its own write (read-your-writes)"""
+    try:
+        return float(cookies.get(READ_PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+async def run_db(db, fn, *args, **kwargs):
+    """
+    Run a sync `fn(session, *args, **kwargs)` against either stack: on the
+    event loop through AsyncSession.run_sync, or on the threadpool for a
+    plain Session.
+
+    Each call is a unit of work: the session is closed afterwards so its
+    connection goes back to the pool right away instead of at dependency
+    teardown, which on the sync stack would itself wait for a free thread.
+    The session stays usable for the next call.
+    """
+    if hasattr(db, "run_sync"):
+        try:
+            return await db.run_sync(fn, *args, **kwargs)
+        finally:
+            await db.close()
+
+    def unit_of_work():
+        try:
+            return fn(db, *args, **kwargs)
+        finally:
+            db.close()
+
+    return await run_in_threadpool(unit_of_work)
@@ -0,0 +1,215 @@
+"""
+Story change feed behind GET /stories/stream.
+
+The story write paths publish an event after they commit (off the event
+loop, before responding; see crud.AfterCommit): the whole story for
+"created" (just the ids for a bulk import batch), only the changed
+fields for "updated". Events carry the assignee and status the story had
+before and after the change, so a subscriber filtering on them also
+hears about stories leaving its view.
+
+Backends:
+
+- MemoryBroker (default): events live in a bounded in-process replay
+  buffer and are fanned out to per-connection queues. Only sees writes
+  made by the same worker.
+- RedisStreamBroker (EVENTS_BACKEND=redis): events go to a capped Redis
+  stream that every worker both writes and reads, so any worker can serve
+  any subscriber.
+
+Clients resume with Last-Event-ID. When that id has already dropped out
+of the replay buffer, or a subscriber falls too far behind to keep up,
+the feed sends a "reset" event and the client should reload the list.
+"""
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from config import redis_client, settings
+
+# Events queued per connection before it is considered too slow and reset
+SUBSCRIBER_QUEUE_SIZE = 1000
+HEARTBEAT_SECONDS = 15
+STREAM_KEY = "stories:events"
+
+
+def story_event(kind: str, story: dict, *states: tuple) -> dict:
+    """
+    Build an event. `story` is the payload in response casing (camelCase);
+    `states` are the (assignee, status) pairs the change touched, for
+    filtering.
+    """
+    return {"type": kind, "story": story, "states": [list(state) for state in states]}
+
+
+def matches(event: dict, assignee: Optional[str], status: Optional[str]) -> bool:
+    if event["type"] == "reset":
+        return True
+    return any(
+        (assignee is None or state_assignee == assignee) and (status is None or state_status == status)
+        for state_assignee, state_status in event["states"]
+    )
+
+
+class MemoryBroker:
+    def __init__(self, replay_size: int):
+        self._buffer = deque(maxlen=replay_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def publish(self, event: dict) -> None:
+        """Safe to call from any thread; the write paths run on the threadpool"""
+        with self._lock:
+            self._last_id += 1
+            event = {**event, "id": str(self._last_id)}
+            self._buffer.append(event)
+            subscribers = list(self._subscribers)
+            self.published += 1
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._deliver, queue, event)
+
+    def _deliver(self, queue: asyncio.Queue, event: dict) -> None:
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Let the client reload rather than buffering without bound
+            self.dropped_subscribers += 1
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"type": "reset", "id": event["id"]})
+
+    async def subscribe(self, last_event_id: Optional[str]) -> AsyncIterator[Optional[dict]]:
+        """Replay after `last_event_id`, then live events; yields None as a heartbeat"""
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            # Register before copying the buffer so nothing published in between is missed
+            self._subscribers.add(subscriber)
+            backlog = list(self._buffer)
+            last_id = self._last_id
+        try:
+            seen = last_id
+            if last_event_id is not None:
+                try:
+                    seen = int(last_event_id)
+                except ValueError:
+                    seen = -1
+                # Unknown id (e.g. from before a restart) or events already trimmed away
+                if seen < 0 or seen > last_id or (backlog and seen < int(backlog[0]["id"]) - 1):
+                    yield {"type": "reset", "id": str(last_id)}
+                    seen = last_id
+                for event in backlog:
+                    if int(event["id"]) > seen:
+                        seen = int(event["id"])
+                        yield event
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event["type"] != "reset" and int(event["id"]) <= seen:
+                    continue
+                seen = int(event["id"])
+                yield event
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "subscribers": len(self._subscribers),
+                "buffered": len(self._buffer),
+                "last_event_id": self._last_id,
+                "published": self.published,
+                "dropped_subscribers": self.dropped_subscribers,
+            }
+
+
+class RedisStreamBroker:
+    """
+    Events in a Redis stream trimmed to about `replay_size` entries. Stream
+    ids double as event ids, so Last-Event-ID works across workers.
+    """
+
+    def __init__(self, url: str, replay_size: int, client=None, async_client=None):
+        if async_client is None:
+            import redis.asyncio
+
+            async_client = redis.asyncio.Redis.from_url(url)
+        self.client = redis_client(url, client)
+        self.async_client = async_client
+        self.replay_size = replay_size
+        self.published = 0
+
+    def publish(self, event: dict) -> None:
+        self.client.xadd(
+            STREAM_KEY, {"event": json.dumps(event, default=str)},
+            maxlen=self.replay_size, approximate=True,
+        )
+        self.published += 1
+
+    async def subscribe(self, last_event_id: Optional[str]) -> AsyncIterator[Optional[dict]]:
+        # An explicit id rather than "$", which would skip events published between reads
+        latest = await self.async_client.xrevrange(STREAM_KEY, count=1)
+        cursor = latest[0][0].decode() if latest else "0-0"
+        if last_event_id is not None:
+            oldest = await self.async_client.xrange(STREAM_KEY, count=1)
+            oldest_id = oldest[0][0].decode() if oldest else None
+            if oldest_id is None or not (_stream_id(oldest_id) <= _stream_id(last_event_id) <= _stream_id(cursor)):
+                yield {"type": "reset", "id": cursor}
+            else:
+                cursor = last_event_id
+        while True:
+            batches = await self.async_client.xread(
+                {STREAM_KEY: cursor}, block=HEARTBEAT_SECONDS * 1000, count=100
+            )
+            if not batches:
+                yield None
+                continue
+            for entry_id, fields in batches[0][1]:
+                cursor = entry_id.decode()
+                event = json.loads(fields[b"event"])
+                event["id"] = cursor
+                yield event
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "published": self.published}
+
+
+def _stream_id(value: str) -> tuple[int, int]:
+    try:
+        millis, _, sequence = value.partition("-")
+        return int(millis), int(sequence or 0)
+    except ValueError:
+        return (-1, -1)
+
+
+def build_broker():
+    if settings.events_backend == "redis":
+        return RedisStreamBroker(settings.redis_url, settings.events_replay_size)
+    return MemoryBroker(settings.events_replay_size)
+
+
+broker = build_broker()
+
+
+def publish(event: dict) -> None:
+    """Called by the story write paths after they commit"""
+    broker.publish(event)
+
+
+def format_sse(event: Optional[dict]) -> str:
+    if event is None:
+        # Comment line; keeps proxies from timing out an idle stream
+        return ": heartbeat\n\n"
+    payload = {"type": event["type"], "story": event.get("story")}
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(payload, default=str)}\n\n"
@@ -0,0 +1,206 @@
+"""
+Response formats for story lists besides JSON, picked by the Accept
+header on GET /stories and GET /stories/export:
+
+- Arrow IPC stream (application/vnd.apache.arrow.stream): columnar and
+  zstd-compressed, one record batch per page or export batch.
+  pyarrow.ipc.open_stream(...).read_pandas() loads it without parsing. A
+  list page carries its nextCursor in the schema metadata.
+- MessagePack (application/msgpack): the JSON document, binary. Export
+  streams one story map per row, for msgpack.Unpacker.
+
+Both are built from the column rows and dicts in serializers.py, a batch
+at a time, without pydantic models. pyarrow and msgpack are optional:
+without them the format is not offered and asking only for it is a 406.
+pyarrow is slow to import, so the first Arrow response loads it rather
+than startup.
+"""
+import importlib.util
+import json
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional
+
+import serializers
+
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional, see requirements.txt
+    msgpack = None
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+CSV = "text/csv"
+ARROW = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/msgpack"
+
+# Other names clients use for the same formats
+MEDIA_TYPE_ALIASES = {
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+    "application/jsonl": NDJSON,
+}
+
+ARROW_COMPRESSION = "zstd"
+
+# Export ?format= names
+EXPORT_FORMATS = {"ndjson": NDJSON, "csv": CSV, "arrow": ARROW, "msgpack": MSGPACK}
+
+
+@lru_cache(maxsize=None)
+def arrow():
+    """The pyarrow module, imported on first use"""
+    import pyarrow
+    import pyarrow.ipc
+
+    return pyarrow
+
+
+def available(media_type: str) -> bool:
+    if media_type == ARROW:
+        return HAS_PYARROW
+    if media_type == MSGPACK:
+        return msgpack is not None
+    return True
+
+
+def negotiate(accept: Optional[str], offered: list[str]) -> Optional[str]:
+    """
+    The offered media type the Accept header prefers. Falls back to the
+    first offered type (the default) when the header names nothing we
+    serve, as before formats were negotiable; None only when the client
+    asked for an offered format this install cannot produce.
+    """
+    usable = [media_type for media_type in offered if available(media_type)]
+    best, best_rank, missing = None, None, False
+    for position, part in enumerate((accept or "").split(",")):
+        media_range, *params = [piece.strip() for piece in part.split(";")]
+        media_range = MEDIA_TYPE_ALIASES.get(media_range.lower(), media_range.lower())
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality <= 0 or not media_range:
+            continue
+        if media_range == "*/*":
+            candidates = usable
+        elif media_range.endswith("/*"):
+            candidates = [media_type for media_type in usable if media_type.startswith(media_range[:-1])]
+        else:
+            candidates = [media_type for media_type in usable if media_type == media_range]
+            missing = missing or (not candidates and media_range in offered)
+        if not candidates:
+            continue
+        # Higher q wins; on a tie, specific types beat wildcards, then header order
+        rank = (quality, "*" not in media_range, -position)
+        if best_rank is None or rank > best_rank:
+            best, best_rank = candidates[0], rank
+    if best is None and not missing:
+        best = offered[0]
+    return best
+
+
+def _arrow_type(name: str):
+    pyarrow = arrow()
+    if name == "id":
+        return pyarrow.int64()
+    if name == "story_points":
+        return pyarrow.int32()
+    if name == "tags":
+        return pyarrow.list_(pyarrow.string())
+    if name == "created_on":
+        return pyarrow.timestamp("us", tz="UTC")
+    # acceptance_criteria is free-form, so it travels as a JSON string as in CSV
+    return pyarrow.string()
+
+
+def arrow_schema(fields: Optional[list[str]], metadata: Optional[dict] = None):
+    pyarrow = arrow()
+    fields = serializers.STORY_FIELDS if fields is None else tuple(fields)
+    return pyarrow.schema(
+        [pyarrow.field(alias, _arrow_type(name)) for name, alias in serializers.aliases(fields)],
+        metadata=metadata,
+    )
+
+
+def arrow_batch(items: list[dict], schema):
+    """A record batch, column by column, from response dicts"""
+    pyarrow = arrow()
+    columns = []
+    for field in schema:
+        values = [item[field.name] for item in items]
+        if field.name == "acceptanceCriteria":
+            values = [None if value is None else json.dumps(value) for value in values]
+        columns.append(pyarrow.array(values, type=field.type))
+    return pyarrow.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def _ipc_options():
+    # Story text compresses about 3x; readers decompress transparently
+    pyarrow = arrow()
+    codec = ARROW_COMPRESSION if pyarrow.Codec.is_available(ARROW_COMPRESSION) else None
+    return pyarrow.ipc.IpcWriteOptions(compression=codec)
+
+
+class _Chunks:
+    """Write-only file for the IPC writer that hands back what was written since the last drain"""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def arrow_stream(
+    batches: Iterable[list[dict]], fields: Optional[list[str]], metadata: Optional[dict] = None
+) -> Iterator[bytes]:
+    """An Arrow IPC stream, yielded as each batch is written so memory stays at one batch"""
+    schema = arrow_schema(fields, metadata)
+    sink = _Chunks()
+    writer = arrow().ipc.new_stream(sink, schema, options=_ipc_options())
+    for items in batches:
+        writer.write_batch(arrow_batch(items, schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def arrow_page(items: list[dict], next_cursor: Optional[str], fields: Optional[list[str]]) -> bytes:
+    metadata = {"nextCursor": next_cursor} if next_cursor else None
+    return b"".join(arrow_stream([items], fields, metadata))
+
+
+def msgpack_dumps(value) -> bytes:
+    # Timestamps as the same strings the JSON responses use
+    return msgpack.packb(value, default=serializers.json_default, use_bin_type=True)
+
+
+def msgpack_stream(batches: Iterable[list[dict]]) -> Iterator[bytes]:
+    packer = msgpack.Packer(default=serializers.json_default, use_bin_type=True)
+    for items in batches:
+        yield b"".join(packer.pack(item) for item in items)
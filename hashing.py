@@ -0,0 +1,108 @@
+"""
+Password hashing off the request workers.
+
+pbkdf2 costs tens to hundreds of milliseconds of CPU per call. Running it
+inline lets a burst of logins occupy every threadpool worker, so hashing
+goes through a small dedicated pool instead. Callers beyond
+`workers + max_queue` outstanding jobs are turned away with
+HasherSaturated rather than queueing indefinitely.
+"""
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+from config import settings
+
+
+@lru_cache(maxsize=None)
+def crypt_context():
+    """The passlib context, built on first use (in each hashing process for a process pool)"""
+    from passlib.context import CryptContext
+
+    rounds = {}
+    if settings.hash_rounds:
+        # min_rounds makes needs_update() flag hashes made with a lower cost
+        rounds = {
+            "pbkdf2_sha256__default_rounds": settings.hash_rounds,
+            "pbkdf2_sha256__min_rounds": settings.hash_rounds,
+        }
+    return CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto", **rounds)
+
+
+class HasherSaturated(Exception):
+    """Too many hashing jobs are already running or queued"""
+
+
+# Module level so they can be pickled for a process pool
+def _hash(password: str) -> str:
+    return crypt_context().hash(password)
+
+
+def _verify_and_update(password: str, password_hash: str) -> tuple[bool, Optional[str]]:
+    return crypt_context().verify_and_update(password, password_hash)
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_queue: int, kind: str = "thread"):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        # Created on first use so forking servers don't inherit worker threads/processes
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    def saturated(self) -> bool:
+        return self._pending >= self.workers + self.max_queue
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self.saturated():
+                self.rejected += 1
+                raise HasherSaturated()
+            self._pending += 1
+            executor = self._get_executor()
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify_and_update(self, password: str, password_hash: str) -> tuple[bool, Optional[str]]:
+        """(matches, new_hash); new_hash is set when the stored hash uses outdated parameters"""
+        return await self._run(_verify_and_update, password, password_hash)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = min(self._pending, self.workers)
+            return {
+                "executor": self.kind,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": in_flight,
+                "queued": self._pending - in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
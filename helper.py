@@ -1,3 +1,78 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+
+# Matches StoryTag.tag, which is String(100)
+MAX_TAG_LENGTH = 100
+
+
 def to_camel_case(snake_str: str) -> str:
     parts = snake_str.split('_')
     return parts[0] + ''.join(x.title() for x in parts[1:])
+
+
+def normalize_tags(value) -> list[str]:
+    """
+    Accept a list or a comma separated string and return unique, stripped
+    tags in order. Tags differing only in case count as one, since they
+    share a primary key under a case-insensitive collation.
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    tags, seen = [], set()
+    for tag in value:
+        tag = str(tag).strip()
+        if len(tag) > MAX_TAG_LENGTH:
+            raise HTTPException(
+                status_code=400, detail={"message": f"Tags cannot be longer than {MAX_TAG_LENGTH} characters"}
+            )
+        if tag and tag.casefold() not in seen:
+            seen.add(tag.casefold())
+            tags.append(tag)
+    return tags
+
+
+def _encode_token(payload: dict) -> str:
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_token(cursor: str) -> dict:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    if not isinstance(payload, dict):
+        raise ValueError("Invalid cursor")
+    return payload
+
+
+def encode_cursor(created_on: datetime, story_id: int) -> str:
+    """Encode the (created_on, id) position of the last row of a page into an opaque token"""
+    return _encode_token({"c": created_on.isoformat(), "i": story_id})
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Inverse of encode_cursor; raises ValueError for anything we did not issue"""
+    try:
+        payload = _decode_token(cursor)
+        return datetime.fromisoformat(payload["c"]), int(payload["i"])
+    except (ValueError, KeyError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def encode_offset_cursor(offset: int) -> str:
+    """Cursor for ranked results, where there is no stable key to seek on"""
+    return _encode_token({"o": offset})
+
+
+def decode_offset_cursor(cursor: str) -> int:
+    try:
+        offset = int(_decode_token(cursor)["o"])
+    except (ValueError, KeyError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    if offset < 0:
+        raise ValueError("Invalid cursor")
+    return offset
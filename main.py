@@ -1,305 +1,793 @@
+"""
+The API. create_app(settings) builds the application; `app` is the one
+built from the environment, for `uvicorn main:app`.
+
+Importing this module opens no connections and starts no threads: engines
+and pools are created per process by the lifespan (see database.py), the
+password hasher's workers on first use, and pandas (analytics) and
+pyarrow (formats) load with the first request that needs them.
+benchmarks/check_import_time.py keeps `import main` within its budget.
+"""
+import admission
 import auth
-from auth import create_access_token, verify_access_token
+import cache
+import crud
+import events
+import formats
+import metrics
+import tasks
+from auth import verify_access_token
 from schemas import UserCreate, UserResponse
-from passlib.context import CryptContext
+from hashing import HasherSaturated, PasswordHasher
 import schemas
 import models
-from datetime import date, datetime
-from typing import Optional
-from database import SessionLocal
+import versions
+import database
+from config import Settings, settings
+import json
+import time
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Literal, Optional
+from database import READ_PIN_COOKIE, app_databases, reads_from_primary, run_db
+from helper import normalize_tags
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, FastAPI, Depends, Header, HTTPException, Path, Query, Request, status
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 load_dotenv()
 
-app = FastAPI(title="Requirements Engineering Tool Prototype")
+router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
-origins = [
-    "http://localhost:5173",
-    "http://localhost:3000",
-]
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Stories per transaction in POST /stories/bulk, and per chunk in GET /stories/export
+BULK_BATCH_SIZE = 1000
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
-
-def get_db():
-    db = SessionLocal()
+@asynccontextmanager
+async def sync_session(session_factory):
+    db = session_factory()
     try:
         yield db
     finally:
-        db.close()
-
-
-@app.post("/users", response_model=schemas.UserResponse)
-def create_user(request: schemas.UserCreate, db: Session = Depends(get_db)):
-    name_parts = request.name.strip().split(maxsplit=1)
-    first_name = name_parts[0]
-    last_name = name_parts[1] if len(name_parts) > 1 else ""
-
-    hashed = pwd_context.hash(request.password)
-    user = models.User(
-        username=request.username,
-        first_name=first_name,
-        last_name=last_name,
-        email=request.email,
-        password_hash=hashed
+        # Closing may return a connection with a rollback; keep that off the event loop
+        await run_in_threadpool(db.close)
+
+
+def get_read_sessionmaker(request: Request):
+    """Plain Session factory for the replica, unless this client just wrote"""
+    return app_databases(request.app).sync_session_factory(read_only=not reads_from_primary(request.cookies))
+
+
+async def open_session(databases: database.Databases, read_only: bool = False):
+    """
+    Session on the stack the app's DB_MODE picks: an AsyncSession, or a
+    plain Session whose queries run on the threadpool (see database.run_db)
+    """
+    session_factory = databases.session_factory(read_only)
+    if databases.is_async:
+        async with session_factory() as db:
+            yield db
+    else:
+        async with sync_session(session_factory) as db:
+            yield db
+
+
+async def db_session(request: Request):
+    async for db in open_session(app_databases(request.app)):
+        yield db
+
+
+def app_hasher(request: Request) -> PasswordHasher:
+    return request.app.state.password_hasher
+
+
+async def read_db_session(request: Request):
+    """Session for read-only endpoints: the replica's, unless this client just wrote"""
+    async for db in open_session(app_databases(request.app), read_only=not reads_from_primary(request.cookies)):
+        yield db
+
+
+async def pin_reads_after_writes(request: Request, call_next):
+    """
+    After a successful write, send the client's reads to the primary for a
+    few seconds so it sees its own change despite replica lag. The pin is a
+    cookie, so it holds across workers.
+    """
+    response = await call_next(request)
+    app_settings = request.app.state.settings
+    if (
+        app_settings.read_replica_url
+        and request.method not in ("GET", "HEAD", "OPTIONS")
+        and response.status_code < 400
+    ):
+        response.set_cookie(
+            READ_PIN_COOKIE,
+            str(time.time() + app_settings.read_your_writes_seconds),
+            max_age=app_settings.read_your_writes_seconds,
+            httponly=True,
+            samesite="lax",
+        )
+    return response
+
+
+async def instrument_requests(request: Request, call_next):
+    """Per-route latency, SQL count and SQL time; see metrics.py"""
+    stats = metrics.start_request(request.method, request.url.path)
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["Server-Timing"] = (
+            f'db;dur={stats.sql_seconds * 1000:.1f};desc="{stats.queries} queries"'
+        )
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.finish_request(
+            stats, route.path if route else "unmatched", status_code, time.perf_counter() - started
+        )
+
+
+async def hasher_saturated_handler(request, exc):
+    route = request.scope.get("route")
+    admission.controller.count_rejection("hasher", f"{request.method} {route.path}" if route else "unmatched")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many sign-ins in progress, retry shortly"},
+        headers={"Retry-After": "1"},
     )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user
 
 
-@app.post("/login", response_model=schemas.Token)
-def login_json(request: schemas.LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter_by(email=request.email).first()
-    if not user or not pwd_context.verify(request.password, user.password_hash):
+@router.post("/users", response_model=schemas.UserResponse)
+async def create_user(
+    request: schemas.UserCreate,
+    db: Session = Depends(db_session),
+    password_hasher: PasswordHasher = Depends(app_hasher),
+):
+    hashed = await password_hasher.hash(request.password)
+    return await run_db(db, crud.create_user, request, hashed)
+
+
+@router.post("/login", response_model=schemas.Token)
+async def login_json(
+    request: schemas.LoginRequest,
+    db: Session = Depends(db_session),
+    password_hasher: PasswordHasher = Depends(app_hasher),
+):
+    credentials = await run_db(db, crud.get_credentials, request.email)
+    valid, new_hash = False, None
+    if credentials:
+        user, password_hash = credentials
+        valid, new_hash = await password_hasher.verify_and_update(request.password, password_hash)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
-    token = auth.create_access_token(sub=user.email)
-    return {"access_token": token, "token_type": "bearer"}
+    if new_hash:
+        # Stored with outdated cost parameters; upgrade while we have the password
+        await run_db(db, crud.update_password_hash, user.id, new_hash)
+    return auth.create_token_pair(user.email, user.id, user.username)
+
+
+async def auth_call(fn, *args):
+    """Token checks touch the revocation store, which is network I/O with Redis"""
+    if auth.revocations.blocking:
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
+
 
+@router.post("/token/refresh", response_model=schemas.Token)
+async def refresh_token(request: schemas.RefreshRequest):
+    """New token pair for a refresh token, which is used up (rotation); no password check"""
+    return await auth_call(auth.rotate_refresh_token, request.refresh_token)
 
-@app.post("/logout")
-def logout():
+
+@router.post("/logout")
+async def logout(token: str = Depends(oauth2_scheme)):
     """
-    Dummy logout endpoint – client should discard its JWT.
+    End the sign-in the access token belongs to: it and every token
+    refreshed from the same login stop working, on every worker with
+    REVOCATION_BACKEND=redis.
     """
+    creds = await auth_call(verify_access_token, token)
+    if "sid" in creds:
+        await auth_call(auth.revoke_session, creds["sid"])
     return {"message": "Successfully logged out"}
 
 
-def get_current_user(
+async def get_current_user(
         token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
-):
-    creds = verify_access_token(token)
+        db: Session = Depends(db_session)
+) -> auth.Principal:
+    creds = await auth_call(verify_access_token, token)
     email = creds.get("sub")
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if not user:
+
+    principal = auth.principal_cache.get(email)
+    if principal is None:
+        principal = await run_db(db, crud.load_principal, creds)
+        auth.principal_cache.put(email, principal)
+
+    if not principal.is_active:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="User is inactive"
         )
-    return user
+    return principal
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def invalidate_cached_principal(mapper, connection, target):
+    # Bulk query.update()/delete() bypass these hooks; go through the ORM
+    # (or call principal_cache.invalidate_user) when changing users
+    auth.principal_cache.invalidate_user(target.id)
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 when the client's If-None-Match already names `etag`"""
+    if versions.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return None
+
+
+def with_etag(result, response: Response, etag: str):
+    """Attach the ETag whether the endpoint returns a model or a ready-made response"""
+    target = result if isinstance(result, Response) else response
+    target.headers["ETag"] = etag
+    # Let clients keep the copy but revalidate it on every use
+    target.headers["Cache-Control"] = "private, no-cache"
+    return result
+
 
+# Response formats offered by content negotiation, the default first
+STORY_LIST_FORMATS = [formats.JSON, formats.ARROW, formats.MSGPACK]
+EXPORT_FORMATS = [formats.NDJSON, formats.CSV, formats.ARROW, formats.MSGPACK]
 
-@app.get("/stories", response_model=list[schemas.StoryResponse])
-def get_stories(
+
+def format_not_available() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_406_NOT_ACCEPTABLE,
+        detail="The requested format needs an optional dependency (pyarrow or msgpack) that is not installed",
+    )
+
+
+def response_format(request: Request, offered: list[str]) -> str:
+    """The media type to answer with, from the Accept header; see formats.negotiate"""
+    media_type = formats.negotiate(request.headers.get("accept"), offered)
+    if media_type is None:
+        raise format_not_available()
+    return media_type
+
+
+async def call_cache(fn, *args):
+    """Run a story cache operation, off the event loop when the backend does network I/O"""
+    if cache.story_cache.blocking:
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
+
+
+def story_fields(
+    view: Literal["full", "summary"] = "full",
+    fields: Optional[str] = None,
+) -> Optional[list[str]]:
+    """
+    Resolve the `view`/`fields` query parameters into the story fields to
+    return; None means the full StoryResponse. `fields` takes precedence and
+    accepts either snake_case or camelCase names.
+    """
+    if fields:
+        by_alias = {alias: name for name, alias in crud.STORY_FIELD_ALIASES.items()}
+        selected = ["id"]
+        for raw in fields.split(","):
+            raw = raw.strip()
+            if not raw:
+                continue
+            name = raw if raw in crud.STORY_FIELD_ALIASES else by_alias.get(raw)
+            if name is None:
+                raise HTTPException(
+                    status_code=400, detail={"message": f"Unknown field '{raw}'"}
+                )
+            if name not in selected:
+                selected.append(name)
+        return selected
+    if view == "summary":
+        return crud.SUMMARY_FIELDS
+    return None
+
+
+def story_filters(
     assignee: Optional[str] = None,
     status: Optional[str] = None,
     tags: Optional[str] = None,
+    tags_match: Literal["any", "all"] = "any",
     created_by: Optional[str] = None,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
-    db: Session = Depends(get_db)
+) -> schemas.StoryFilters:
+    return schemas.StoryFilters(
+        assignee=assignee,
+        status=status,
+        tags=normalize_tags(tags),
+        tags_match=tags_match,
+        created_by=created_by,
+        start_date=start_date,
+        end_date=end_date,
+    )
+
+
+@router.get("/stories", response_model=schemas.StoryPage)
+async def get_stories(
+    request: Request,
+    response: Response,
+    filters: schemas.StoryFilters = Depends(story_filters),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[list[str]] = Depends(story_fields),
+    db: Session = Depends(read_db_session)
 ):
-    query = db.query(models.UserStory)
+    media_type = response_format(request, STORY_LIST_FORMATS)
+    etag = await run_db(
+        db, versions.collection_etag, versions.STORIES, "list", filters.model_dump(), cursor, limit, fields, media_type
+    )
+    if cached := not_modified(request, etag):
+        cached.headers["Vary"] = "Accept"
+        return cached
+    story_cache = cache.story_cache
+    if story_cache is None or media_type != formats.JSON or reads_from_primary(request.cookies):
+        # Clients that just wrote skip the cache, which may hold a replica's older copy;
+        # only JSON pages are cached
+        result = await run_db(db, crud.list_stories, filters, cursor, limit, fields, media_type)
+        result.headers["Vary"] = "Accept"
+        return with_etag(result, response, etag)
+
+    started = time.perf_counter()
+    key, tag = cache.page_key(filters, cursor, limit, fields), cache.filter_tag(filters)
+    entry, generation = await call_cache(story_cache.lookup, key, tag)
+    hit = entry is not None
+    if hit:
+        # Served under the ETag it was built with, which a write elsewhere leaves valid
+        etag, body = entry
+        if cached := not_modified(request, etag):
+            story_cache.observe(hit, time.perf_counter() - started)
+            cached.headers["Vary"] = "Accept"
+            return cached
+    else:
+        result = await run_db(db, crud.list_stories, filters, cursor, limit, fields)
+        body = result.body
+        await call_cache(story_cache.store, key, tag, generation, etag, body)
+    story_cache.observe(hit, time.perf_counter() - started)
+    return with_etag(Response(content=body, media_type=formats.JSON, headers={"Vary": "Accept"}), response, etag)
 
-    if assignee:
-        query = query.filter(models.UserStory.assignee == assignee)
 
-    if status:
-        query = query.filter(models.UserStory.status == status)
+async def finish_write(after_commit: crud.AfterCommit, background_tasks: BackgroundTasks) -> None:
+    """
+    After a write's session has closed: its effects (cache invalidation,
+    the change event) off the event loop before the response, its jobs
+    after it
+    """
+    await run_in_threadpool(after_commit.run_effects)
+    background_tasks.add_task(tasks.enqueue_all, after_commit.jobs)
 
-    if tags:
-        query = query.filter(models.UserStory.tags.contains(tags))
 
-    if created_by:
-        query = query.filter(models.UserStory.created_by == created_by)
+@router.post("/stories")
+async def add_story(
+    request: schemas.StoryCreate,
+    background_tasks: BackgroundTasks,
+    current_user: auth.Principal = Depends(get_current_user),
+    db: Session = Depends(db_session),
+):
+    after_commit = crud.AfterCommit()
+    result = await run_db(db, crud.create_story, request, current_user.username, after_commit)
+    await finish_write(after_commit, background_tasks)
+    return result
+
+
+async def ndjson_items(request: Request):
+    """Parse an NDJSON body line by line as it arrives; unparseable lines come through as the error"""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield parse_json_line(line)
+    if pending.strip():
+        yield parse_json_line(pending)
+
+
+def parse_json_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as exc:
+        return ValueError(f"Invalid JSON: {exc}")
 
-    if start_date:
-        query = query.filter(models.UserStory.created_on >= start_date)
 
-    if end_date:
-        end_datetime = datetime.combine(end_date, datetime.max.time())
-        query = query.filter(models.UserStory.created_on <= end_datetime)
+@router.post("/stories/bulk", response_model=schemas.BulkImportResult)
+async def bulk_add_stories(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    current_user: auth.Principal = Depends(get_current_user),
+    db: Session = Depends(db_session),
+):
+    """
+    Create many stories at once from a JSON array or NDJSON (one StoryCreate
+    object per line, Content-Type application/x-ndjson). Stories are
+    committed in batches of BULK_BATCH_SIZE; rows that fail are listed in
+    `errors` by their 1-based position and do not stop the rest.
+    """
+    result = schemas.BulkImportResult()
+    after_commit = crud.AfterCommit()
+
+    async def flush(batch, first_row):
+        outcome = await run_db(db, crud.import_stories, batch, first_row, current_user.username, after_commit)
+        await run_in_threadpool(after_commit.run_effects)
+        result.ids.extend(outcome.ids)
+        result.errors.extend(outcome.errors)
+
+    if "ndjson" in request.headers.get("content-type", ""):
+        batch, first_row = [], 1
+        async for item in ndjson_items(request):
+            batch.append(item)
+            if len(batch) >= BULK_BATCH_SIZE:
+                await flush(batch, first_row)
+                first_row += len(batch)
+                batch = []
+        if batch:
+            await flush(batch, first_row)
+    else:
+        try:
+            items = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail={"message": "Body must be a JSON array of stories"})
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail={"message": "Body must be a JSON array of stories"})
+        for start in range(0, len(items), BULK_BATCH_SIZE):
+            await flush(items[start:start + BULK_BATCH_SIZE], start + 1)
+
+    await finish_write(after_commit, background_tasks)
+    result.created = len(result.ids)
+    return result
+
+
+@router.get("/stories/export")
+def export_stories(
+    request: Request,
+    filters: schemas.StoryFilters = Depends(story_filters),
+    format: Optional[Literal["ndjson", "csv", "arrow", "msgpack"]] = None,
+    session_factory=Depends(get_read_sessionmaker),
+):
+    """
+    Stream every matching story as NDJSON, CSV, Arrow IPC or MessagePack,
+    independent of DB_MODE. `format` wins over the Accept header.
+    """
+    if format is None:
+        media_type = response_format(request, EXPORT_FORMATS)
+        format = next(name for name, value in formats.EXPORT_FORMATS.items() if value == media_type)
+    elif not formats.available(formats.EXPORT_FORMATS[format]):
+        raise format_not_available()
+    def rows():
+        # Owned by the stream rather than a dependency so it stays open until the last chunk
+        db = session_factory()
+        try:
+            yield from crud.export_stories(db, filters, format, BULK_BATCH_SIZE)
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        rows(),
+        media_type=formats.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="stories.{format}"', "Vary": "Accept"},
+    )
 
-    return query.all()
 
+EXPORT_ID_PATTERN = r"^[0-9a-f]{32}\.(ndjson|csv|arrow|msgpack)$"
 
-@app.post("/stories")
-def add_story(request: schemas.StoryCreate, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    if not request.title or not request.title.strip():
-        raise HTTPException(
-            status_code=400, detail={"message":"Title cannot be empty"}
-        )
-    if not request.description or not request.description.strip():
-        raise HTTPException(
-            status_code=400, detail={"message":"Description cannot be empty"}
-        )
-    if not request.assignee or not request.assignee.strip():
-        raise HTTPException(
-            status_code=400, detail={"message":"Assignee cannot be empty"}
+
+@router.post("/stories/exports", status_code=status.HTTP_202_ACCEPTED)
+async def start_story_export(
+    request: Request,
+    filters: schemas.StoryFilters = Depends(story_filters),
+    format: Literal["ndjson", "csv", "arrow", "msgpack"] = "ndjson",
+    db: Session = Depends(db_session),
+):
+    """
+    Export in the background (see tasks.py) for a download at the returned
+    url. The same filters and format return the same export until a story
+    changes.
+    """
+    if not formats.available(formats.EXPORT_FORMATS[format]):
+        raise format_not_available()
+    version = await run_db(db, versions.current)
+    export_id, state = await run_in_threadpool(tasks.start_export, version, filters, format)
+    if state == "failed":
+        # Eager mode runs the job before it returns
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Export failed")
+    url = request.app.url_path_for("download_story_export", export_id=export_id)
+    return JSONResponse(
+        {"id": export_id, "status": state, "url": url},
+        status_code=status.HTTP_200_OK if state == "ready" else status.HTTP_202_ACCEPTED,
+        headers={"Location": url},
+    )
+
+
+@router.get("/stories/exports/{export_id}")
+async def download_story_export(export_id: str = Path(pattern=EXPORT_ID_PATTERN)):
+    state = await run_in_threadpool(tasks.export_status, export_id)
+    if state == "unknown":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Export not found or expired")
+    if state == "failed":
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Export failed, start it again")
+    if state == "pending":
+        return JSONResponse(
+            {"id": export_id, "status": state}, status_code=status.HTTP_202_ACCEPTED, headers={"Retry-After": "2"}
         )
-    tags_value = None
-    if isinstance(request.tags, list):
-        tags_value = ",".join(request.tags)
-    elif isinstance(request.tags, str):
-        tags_value = request.tags
-    else:
-        tags_value = None
-
-    # Initialize activity with story creation entry
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    initial_activity = [
-        {
-            "timestamp": timestamp,
-            "user": current_user.username,
-            "action": f"[{timestamp}] {current_user.username}: Created story"
-        }
-    ]
-
-    new_story = models.UserStory(
-        title=request.title,
-        description=request.description,
-        assignee=request.assignee,
-        status=request.status,
-        tags=tags_value,
-        acceptance_criteria=request.acceptance_criteria or [],
-        story_points=request.story_points,
-        activity=initial_activity,
-        created_by=current_user.username
+    format = export_id.rpartition(".")[2]
+    return FileResponse(
+        tasks.export_path(export_id), media_type=formats.EXPORT_FORMATS[format], filename=f"stories.{format}",
+    )
+
+
+@router.get("/stories/stream")
+async def stream_stories(
+    request: Request,
+    assignee: Optional[str] = None,
+    status: Optional[str] = None,
+    last_event_id: Optional[str] = Header(default=None),
+):
+    """
+    Server-sent events for story changes, optionally only those touching
+    `assignee` and/or `status`. Reconnecting browsers send Last-Event-ID
+    and get what they missed; a "reset" event means reload the list.
+    """
+    async def feed():
+        yield "retry: 3000\n\n"
+        async for message in events.broker.subscribe(last_event_id):
+            if await request.is_disconnected():
+                break
+            if message is None or events.matches(message, assignee, status):
+                yield events.format_sse(message)
+
+    return StreamingResponse(
+        feed(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    db.add(new_story)
-    db.commit()
-    db.refresh(new_story)
-    return {"message": "Story added successfully", "story": new_story}
 
 
-@app.put("/stories/{story_id}")
-def update_story(story_id: int, request: schemas.StoryCreate, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    story = db.query(models.UserStory).filter(models.UserStory.id == story_id).first()
-    
-    if not story:
+@router.get("/stories/{story_id}", response_model=schemas.StoryResponse)
+async def get_story(
+    story_id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(read_db_session)
+):
+    etag = await run_db(db, versions.story_etag, story_id)
+    if etag is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Story not found"
         )
-    
-    # Initialize activity list if it doesn't exist
-    if not story.activity:
-        story.activity = []
-    
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    username = current_user.username
-    
-    # Track title changes
-    if story.title != request.title:
-        activity_entry = f"[{timestamp}] {username}: Changed title from '{story.title}' to '{request.title}'"
-        story.activity.append({"timestamp": timestamp, "user": username, "action": activity_entry})
-        story.title = request.title
-    
-    # Track description changes
-    if story.description != request.description:
-        activity_entry = f"[{timestamp}] {username}: Updated description"
-        story.activity.append({"timestamp": timestamp, "user": username, "action": activity_entry})
-        story.description = request.description
-    
-    # Track assignee changes
-    if story.assignee != request.assignee:
-        activity_entry = f"[{timestamp}] {username}: Changed assignee from '{story.assignee}' to '{request.assignee}'"
-        story.activity.append({"timestamp": timestamp, "user": username, "action": activity_entry})
-        story.assignee = request.assignee
-    
-    # Track status changes
-    if story.status != request.status:
-        activity_entry = f"[{timestamp}] {username}: Changed status from '{story.status}' to '{request.status}'"
-        story.activity.append({"timestamp": timestamp, "user": username, "action": activity_entry})
-        story.status = request.status
-    
-    # Handle tags
-    tags_value = None
-    if isinstance(request.tags, list):
-        tags_value = ",".join(request.tags)
-    elif isinstance(request.tags, str):
-        tags_value = request.tags
-    
-    if story.tags != tags_value:
-        activity_entry = f"[{timestamp}] {username}: Updated tags"
-        story.activity.append({"timestamp": timestamp, "user": username, "action": activity_entry})
-        story.tags = tags_value
-    
-    # Track story points changes
-    if story.story_points != request.story_points:
-        old_points = story.story_points or "None"
-        new_points = request.story_points or "None"
-        activity_entry = f"[{timestamp}] {username}: Changed story points from {old_points} to {new_points}"
-        story.activity.append({"timestamp": timestamp, "user": username, "action": activity_entry})
-        story.story_points = request.story_points
-    
-    # Track acceptance criteria changes
-    if story.acceptance_criteria != (request.acceptance_criteria or []):
-        activity_entry = f"[{timestamp}] {username}: Updated acceptance criteria"
-        story.activity.append({"timestamp": timestamp, "user": username, "action": activity_entry})
-        story.acceptance_criteria = request.acceptance_criteria or []
-    
-    # If activity is provided in request (new comments), add them
-    if request.activity and len(request.activity) > len(story.activity):
-        # Only add new activities that weren't already tracked
-        for activity_item in request.activity:
-            if activity_item not in story.activity:
-                # Check if it's a manual comment (doesn't start with timestamp pattern)
-                if isinstance(activity_item, dict) and "text" in activity_item:
-                    new_entry = {
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "user": username,
-                        "action": f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {username}: {activity_item['text']}"
-                    }
-                    story.activity.append(new_entry)
-    
-    db.commit()
-    db.refresh(story)
-    return {"message": "Story updated successfully", "story": story}
+    if cached := not_modified(request, etag):
+        return cached
+    result = await run_db(db, crud.get_story, story_id)
+    return with_etag(result, response, etag)
+
+
+@router.put("/stories/{story_id}")
+async def update_story(
+    story_id: int,
+    request: schemas.StoryCreate,
+    background_tasks: BackgroundTasks,
+    current_user: auth.Principal = Depends(get_current_user),
+    db: Session = Depends(db_session),
+):
+    after_commit = crud.AfterCommit()
+    result = await run_db(db, crud.update_story, story_id, request, current_user.username, after_commit)
+    await finish_write(after_commit, background_tasks)
+    return result
+
+
+@router.patch("/stories/{story_id}")
+async def patch_story(
+    story_id: int,
+    patch: schemas.StoryPatch,
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    current_user: auth.Principal = Depends(get_current_user),
+    db: Session = Depends(db_session),
+):
+    """
+    Change only the fields sent. Send the story's ETag as If-Match to
+    have the update refused with 409 if someone changed it since.
+    """
+    expected_version = versions.parse_story_etag(request.headers.get("if-match"), story_id)
+    after_commit = crud.AfterCommit()
+    result = await run_db(
+        db, crud.patch_story, story_id, patch, expected_version, current_user.username, after_commit
+    )
+    await finish_write(after_commit, background_tasks)
+    response.headers["ETag"] = versions.format_story_etag(story_id, result["version"])
+    return result
 
-# Endpoint for filtering ideas
 
+@router.get("/stories/{story_id}/activity", response_model=schemas.ActivityPage)
+async def get_story_activity(
+    story_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(read_db_session)
+):
+    return await run_db(db, crud.story_activity_page, story_id, cursor, limit)
 
-@app.get("/filter", response_model=list[schemas.StoryResponse])
-def filter_stories(search: Optional[str] = None, db: Session = Depends(get_db)):
-    if not search:
-        return db.query(models.UserStory).all()
+# Endpoint for filtering ideas
 
-    if search.isdigit():
-        story_id = int(search)
-        return db.query(models.UserStory).filter(models.UserStory.id == story_id).all()
-    else:
-        return db.query(models.UserStory).filter(models.UserStory.title.icontains(search)).all()
 
+@router.get("/filter", response_model=schemas.StoryPage)
+async def filter_stories(
+    request: Request,
+    response: Response,
+    search: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[list[str]] = Depends(story_fields),
+    db: Session = Depends(read_db_session)
+):
+    # The results change with the stories and again when the index catches up with them
+    etag = await run_db(
+        db, versions.collections_etag, (versions.STORIES, versions.SEARCH), "search", search, cursor, limit, fields
+    )
+    if cached := not_modified(request, etag):
+        return cached
+    result = await run_db(db, crud.search_stories, search, cursor, limit, fields)
+    return with_etag(result, response, etag)
+
+
+@router.get("/analytics/velocity", response_model=schemas.VelocityReport)
+async def get_velocity(
+    request: Request,
+    response: Response,
+    period: Literal["day", "week", "month"] = "week",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    assignee: Optional[str] = None,
+    db: Session = Depends(read_db_session),
+):
+    """Points moved to Done per period, from the daily snapshots (defaults to the last 12 weeks)"""
+    import analytics  # pandas, loaded by the first analytics request
+    etag = await run_db(db, versions.collection_etag, analytics.ANALYTICS, "velocity", period, start, end, assignee)
+    if cached := not_modified(request, etag):
+        return cached
+    result = await run_db(db, analytics.velocity, start, end, assignee, period)
+    return with_etag(result, response, etag)
+
+
+@router.get("/analytics/burndown", response_model=schemas.BurndownReport)
+async def get_burndown(
+    request: Request,
+    response: Response,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    assignee: Optional[str] = None,
+    db: Session = Depends(read_db_session),
+):
+    """Open points at the end of each day, from the daily snapshots (defaults to the last 30 days)"""
+    import analytics
+    etag = await run_db(db, versions.collection_etag, analytics.ANALYTICS, "burndown", start, end, assignee)
+    if cached := not_modified(request, etag):
+        return cached
+    result = await run_db(db, analytics.burndown, start, end, assignee)
+    return with_etag(result, response, etag)
 
-@app.get("/profile", response_model=schemas.UserResponse)
-def get_user_profile(current_user: models.User = Depends(get_current_user)):
+
+@router.get("/profile", response_model=schemas.UserResponse)
+async def get_user_profile(current_user: auth.Principal = Depends(get_current_user)):
     return current_user
 
 
-@app.get("/workspace", response_model=schemas.WorkspaceSummary)
-def get_workspace_data(
-        current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+@router.get("/stats")
+async def get_stats(password_hasher: PasswordHasher = Depends(app_hasher)):
+    """Cache counters, for sizing and dashboards"""
+    return {
+        "principal_cache": auth.principal_cache.stats(),
+        "token_cache": auth.token_cache.stats(),
+        "revocations": auth.revocations.stats(),
+        "password_hasher": password_hasher.stats(),
+        "story_cache": cache.story_cache.stats() if cache.story_cache else None,
+        "events": events.broker.stats(),
+        "tasks": tasks.stats(),
+        "admission": admission.controller.stats(),
+    }
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint"""
+    if not request.app.state.settings.metrics_enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Metrics are disabled")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/workspace", response_model=schemas.WorkspaceSummary)
+async def get_workspace_data(
+        request: Request,
+        response: Response,
+        include_stories: bool = True,
+        current_user: auth.Principal = Depends(get_current_user),
+        fields: Optional[list[str]] = Depends(story_fields),
+        db: Session = Depends(read_db_session)
 ):
-    username = current_user.username
-
-    stories = db.query(models.UserStory).filter(
-        models.UserStory.assignee == username
-    ).all()
-
-    by_status = {}
-    for s in stories:
-        by_status[s.status] = by_status.get(s.status, 0) + 1
-    return schemas.WorkspaceSummary(
-        username=username,
-        total_stories=len(stories),
-        by_status=by_status,
-        stories=stories,
+    etag = await run_db(
+        db, versions.collection_etag, versions.STORIES, "workspace", current_user.username, include_stories, fields
     )
+    if cached := not_modified(request, etag):
+        return cached
+    result = await run_db(db, crud.workspace, current_user.username, include_stories, fields)
+    return with_etag(result, response, etag)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in each worker process, after a pre-fork server has forked
+    app.state.databases = database.Databases(app.state.settings)
+    try:
+        yield
+    finally:
+        # Only this app's: other apps in the process keep their own
+        await app.state.databases.dispose()
+        app.state.databases = None
+        app.state.password_hasher.shutdown()
+
+
+def create_app(app_settings: Settings = settings) -> FastAPI:
+    """
+    The application configured by `app_settings`: CORS origins, its
+    databases (the DB_MODE stack, with engines and pools the lifespan builds
+    in app.state.databases), its password hasher and the admission and
+    metrics middleware. The services behind it (caches, token stores,
+    background jobs) follow config.settings.
+    """
+    application = FastAPI(title="Requirements Engineering Tool Prototype", lifespan=lifespan)
+    application.state.settings = app_settings
+    # Its executor starts on first use, after a pre-fork server has forked
+    application.state.password_hasher = PasswordHasher(
+        app_settings.hash_workers, app_settings.hash_max_queue, app_settings.hash_executor
+    )
+    application.include_router(router)
+    application.exception_handler(HasherSaturated)(hasher_saturated_handler)
+
+    # The last added runs first: metrics sees every request, including the ones admission turns away
+    application.middleware("http")(pin_reads_after_writes)
+    if app_settings.admission_enabled:
+        application.add_middleware(admission.AdmissionMiddleware)
+    if app_settings.metrics_enabled:
+        metrics.install_sql_hooks()
+        metrics.register_stats("principal_cache", auth.principal_cache.stats)
+        metrics.register_stats("token_cache", auth.token_cache.stats)
+        metrics.register_stats("password_hasher", application.state.password_hasher.stats)
+        metrics.register_stats("story_cache", lambda: cache.story_cache.stats() if cache.story_cache else None)
+        metrics.register_stats("events", events.broker.stats)
+        metrics.register_stats("tasks", tasks.stats)
+        metrics.register_stats("admission", admission.controller.stats)
+        application.middleware("http")(instrument_requests)
+    # Outermost, so the 429 and 503 refusals carry the CORS headers too
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=list(app_settings.cors_origins),
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return application
+
+
+app = create_app(settings)
@@ -0,0 +1,69 @@
+"""
+Maintenance commands.
+
+    python manage.py rebuild-search-index
+    python manage.py rebuild-status-counts
+    python manage.py build-analytics-snapshots [--full]
+"""
+import argparse
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from database import SessionLocal
+import analytics
+import counters
+import search
+
+
+def rebuild_search_index(args):
+    db = SessionLocal()
+    try:
+        count = search.rebuild_index(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"Indexed {count} stories")
+
+
+def rebuild_status_counts(args):
+    db = SessionLocal()
+    try:
+        count = counters.rebuild_status_counts(db)
+    finally:
+        db.close()
+    print(f"Rebuilt {count} status counters")
+
+
+def build_analytics_snapshots(args):
+    db = SessionLocal()
+    try:
+        count = analytics.build_snapshots(db, full=args.full)
+    finally:
+        db.close()
+    print(f"Wrote {count} snapshot rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requirements Engineering Tool maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-search-index", help="Rebuild the full-text search index from the stories table")
+    rebuild.add_argument("--batch-size", type=int, default=1000)
+    rebuild.set_defaults(func=rebuild_search_index)
+
+    status_counts = commands.add_parser("rebuild-status-counts", help="Recompute the workspace status counters from the stories table")
+    status_counts.set_defaults(func=rebuild_status_counts)
+
+    snapshots = commands.add_parser(
+        "build-analytics-snapshots",
+        help="Bring the velocity/burndown daily snapshots up to today; run it daily or more often",
+    )
+    snapshots.add_argument("--full", action="store_true", help="rebuild from the first story instead of the last snapshot day")
+    snapshots.set_defaults(func=build_analytics_snapshots)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
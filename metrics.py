@@ -0,0 +1,230 @@
+"""
+Request and SQL instrumentation, exported at GET /metrics in the
+Prometheus text format.
+
+The HTTP middleware in main.py opens a RequestStats for each request in
+a context variable; SQLAlchemy cursor events add each statement's count
+and duration to it. Context variables follow the request onto the
+threadpool and into AsyncSession.run_sync, so the sync and async stacks
+are both covered. When the request finishes, its latency, query count
+and SQL time go into per-route histograms.
+
+Two diagnostics come out of the same hooks:
+
+- statements slower than SLOW_QUERY_MS are logged with their parameters;
+- a request that runs the same SQL N_PLUS_ONE_THRESHOLD times or more
+  is logged as a likely N+1 and counted per route.
+
+Everything is in-process counters under a lock: a few microseconds per
+statement, cheap enough to leave on. Each worker exposes its own
+numbers, so scrape every worker, as with any multi-process Prometheus
+setup.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import settings
+
+logger = logging.getLogger("metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+MAX_LOGGED_PARAMETERS = 500
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple, labels: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{_braced(labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_braced(labels)} {cumulative}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        if not snapshot and not self.labels:
+            snapshot[()] = 0
+        for label_values, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_braced(_labels(self.labels, label_values))} {value}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _braced(labels: str) -> str:
+    return f"{{{labels}}}" if labels else ""
+
+
+request_latency = Histogram(
+    "http_request_duration_seconds", "Time to produce the response, by route template",
+    LATENCY_BUCKETS, ("method", "route", "status"),
+)
+request_queries = Histogram(
+    "db_queries_per_request", "SQL statements executed per request",
+    QUERY_COUNT_BUCKETS, ("method", "route"),
+)
+request_sql_time = Histogram(
+    "db_time_per_request_seconds", "Time spent executing SQL per request",
+    LATENCY_BUCKETS, ("method", "route"),
+)
+slow_queries = CounterMetric("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS")
+n_plus_one = CounterMetric(
+    "db_n_plus_one_total", "Requests that repeated one statement at least N_PLUS_ONE_THRESHOLD times",
+    ("method", "route"),
+)
+rejected_requests = CounterMetric(
+    "http_requests_rejected_total", "Requests turned away by admission control (admission.py), by reason",
+    ("reason", "route"),
+)
+
+_stats_sources: dict[str, Callable[[], Optional[dict]]] = {}
+
+
+class RequestStats:
+    __slots__ = ("method", "path", "queries", "sql_seconds", "statements")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements = Counter()
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def start_request(method: str, path: str) -> RequestStats:
+    stats = RequestStats(method, path)
+    _current.set(stats)
+    return stats
+
+
+def finish_request(stats: RequestStats, route: str, status_code: int, seconds: float) -> None:
+    _current.set(None)
+    request_latency.observe(seconds, stats.method, route, status_code)
+    request_queries.observe(stats.queries, stats.method, route)
+    request_sql_time.observe(stats.sql_seconds, stats.method, route)
+    if stats.statements:
+        statement, repeats = stats.statements.most_common(1)[0]
+        if repeats >= settings.n_plus_one_threshold:
+            n_plus_one.inc(stats.method, route)
+            logger.warning(
+                "Possible N+1 in %s %s: one statement ran %d times of %d: %s",
+                stats.method, route, repeats, stats.queries, statement,
+            )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_seconds += elapsed
+        stats.statements[statement] += 1
+    if elapsed * 1000 >= settings.slow_query_ms:
+        slow_queries.inc()
+        logger.warning(
+            "Slow query (%.1f ms) in %s: %s; parameters %.*s",
+            elapsed * 1000, f"{stats.method} {stats.path}" if stats is not None else "-",
+            " ".join(statement.split()), MAX_LOGGED_PARAMETERS, repr(parameters),
+        )
+
+
+def _handle_error(exception_context):
+    # Keep the timing stack balanced when a statement fails
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+_installed = False
+
+
+def install_sql_hooks() -> None:
+    """Instrument every engine, including those created later (the async ones are built lazily)"""
+    global _installed
+    if _installed:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+    _installed = True
+
+
+def register_stats(prefix: str, source: Callable[[], Optional[dict]]) -> None:
+    """Export the numeric values of a stats() dict (as shown by GET /stats) as gauges"""
+    _stats_sources[prefix] = source
+
+
+def render() -> str:
+    lines = []
+    for metric in (request_latency, request_queries, request_sql_time, slow_queries, n_plus_one, rejected_requests):
+        lines.extend(metric.render())
+    for prefix, source in _stats_sources.items():
+        values = source() or {}
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
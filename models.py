@@ -1,6 +1,18 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, func, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, func, Boolean, JSON, ForeignKey, Index, Float
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.orm import relationship
 from database import Base
 
+# SQLite's CURRENT_TIMESTAMP has no fractional part; store bound values the same
+# way so keyset comparisons on created_on see identical strings.
+Timestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(
+        storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"
+    ),
+    "sqlite",
+)
+
 
 class UserStory(Base):
     __tablename__ = "stories"
@@ -9,12 +21,129 @@ class UserStory(Base):
     description = Column(Text, nullable=False)
     assignee = Column(String(250), nullable=False, server_default="Unassigned")
     status = Column(String(250), nullable=False, server_default="In Progress")
-    tags = Column(String(500), nullable=True)
     acceptance_criteria = Column(JSON, nullable=True, default=[])
     story_points = Column(Integer, nullable=True)
-    activity = Column(JSON, nullable=True, default=[])
     created_by = Column(String(250), nullable=True)
-    created_on = Column(DateTime(timezone=True), server_default=func.now())
+    created_on = Column(Timestamp, server_default=func.now())
+    # Incremented on every change; the single-story ETag
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    tag_links = relationship(
+        "StoryTag",
+        order_by="StoryTag.position",
+        cascade="all, delete-orphan",
+        lazy="selectin",
+    )
+    tags = association_proxy("tag_links", "tag")
+
+    # One index per filter shape in crud.filter_story_query, each ending in the
+    # (created_on, id) keyset so filtered pages are range scans in page order
+    __table_args__ = (
+        Index("ix_stories_created_on_id", "created_on", "id"),
+        Index("ix_stories_assignee_created_on_id", "assignee", "created_on", "id"),
+        Index("ix_stories_assignee_status_created_on_id", "assignee", "status", "created_on", "id"),
+        Index("ix_stories_status_created_on_id", "status", "created_on", "id"),
+        Index("ix_stories_created_by_created_on_id", "created_by", "created_on", "id"),
+    )
+
+    def set_tags(self, tags):
+        """Replace the story's tags, keeping the order they were given in"""
+        self.tag_links = [StoryTag(tag=tag, position=i) for i, tag in enumerate(tags)]
+
+
+class StoryTag(Base):
+    __tablename__ = "story_tags"
+
+    story_id = Column(Integer, ForeignKey("stories.id", ondelete="CASCADE"), primary_key=True)
+    tag = Column(String(100), primary_key=True)
+    position = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_story_tags_tag_story_id", "tag", "story_id"),
+    )
+
+
+class StoryActivity(Base):
+    """Append-only history of a story, one row per event"""
+    __tablename__ = "story_activity"
+
+    id = Column(Integer, primary_key=True)
+    story_id = Column(Integer, ForeignKey("stories.id", ondelete="CASCADE"), nullable=False)
+    timestamp = Column(Timestamp, nullable=False, server_default=func.now())
+    user = Column(String(250), nullable=True)
+    action = Column(Text, nullable=False)
+    # Structured copy of what changed; null for comments
+    field = Column(String(50), nullable=True)
+    old_value = Column(Text, nullable=True)
+    new_value = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_story_activity_story_id_timestamp", "story_id", "timestamp"),
+        # Incremental analytics builds read the history since their last day
+        Index("ix_story_activity_timestamp", "timestamp"),
+    )
+
+
+class CollectionVersion(Base):
+    """Watermark per collection, bumped by every write to it; list ETags derive from it"""
+    __tablename__ = "collection_versions"
+
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class StoryStatusCount(Base):
+    """Number of stories per (assignee, status), maintained by the story write paths"""
+    __tablename__ = "story_status_counts"
+
+    assignee = Column(String(250), primary_key=True)
+    status = Column(String(250), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class StoryDailySnapshot(Base):
+    """
+    End-of-day story count and points per (assignee, status), plus what
+    moved into that status during the day. Built from story activity by
+    analytics.build_snapshots for the velocity and burndown endpoints.
+    """
+    __tablename__ = "story_daily_snapshots"
+
+    day = Column(Date, primary_key=True)
+    assignee = Column(String(250), primary_key=True)
+    status = Column(String(250), primary_key=True)
+    stories = Column(Integer, nullable=False, default=0)
+    points = Column(Integer, nullable=False, default=0)
+    entered_stories = Column(Integer, nullable=False, default=0)
+    entered_points = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_story_daily_snapshots_assignee_day", "assignee", "day"),
+    )
+
+
+class SearchPosting(Base):
+    """One row per (term, story) in the full-text inverted index, see search.py"""
+    __tablename__ = "search_postings"
+
+    term = Column(String(64), primary_key=True)
+    story_id = Column(Integer, ForeignKey("stories.id", ondelete="CASCADE"), primary_key=True)
+    tf = Column(Integer, nullable=False)
+    doc_length = Column(Integer, nullable=False)
+    # The posting's BM25 weight before idf; queries read a term's postings in this order
+    impact = Column(Float, nullable=False, server_default="0")
+
+    __table_args__ = (
+        Index("ix_search_postings_story_id", "story_id"),
+        Index("ix_search_postings_term_impact", "term", "impact"),
+    )
+
+
+class SearchDocument(Base):
+    __tablename__ = "search_documents"
+
+    story_id = Column(Integer, ForeignKey("stories.id", ondelete="CASCADE"), primary_key=True)
+    length = Column(Integer, nullable=False)
 
 
 class User(Base):
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, EmailStr, ConfigDict, field_validator
-from typing import Optional, List, Union
-from datetime import datetime
+from typing import Literal, Optional, List, Union
+from datetime import date, datetime
 
 from helper import to_camel_case
 
@@ -15,7 +15,21 @@ class StoryCreate(BaseModel):
     tags: Optional[Union[List[str], str]] = None
     acceptance_criteria: Optional[list] = Field(default=[], description="List of acceptance criteria (max 5)")
     story_points: Optional[int] = Field(default=None, description="Story points")
-    activity: Optional[list] = Field(default=[], description="Activity/comments log")
+    activity: Optional[list] = Field(default=[], description="New comments as {\"text\": ...} items; other entries are ignored")
+
+
+class StoryPatch(BaseModel):
+    """Partial update: only the fields present in the body are changed"""
+    title: Optional[str] = None
+    description: Optional[str] = None
+    assignee: Optional[str] = None
+    status: Optional[str] = None
+    tags: Optional[Union[List[str], str]] = None
+    acceptance_criteria: Optional[list] = None
+    story_points: Optional[int] = None
+    comment: Optional[str] = Field(default=None, description="New comment to add to the story's activity")
+
+    model_config = ConfigDict(populate_by_name=True, alias_generator=to_camel_case)
 
 
 class StoryResponse(BaseModel):
@@ -27,22 +41,90 @@ class StoryResponse(BaseModel):
     tags: Optional[List[str]] = None
     acceptance_criteria: Optional[list] = None
     story_points: Optional[int] = None
-    activity: Optional[list] = None
     created_by: Optional[str]
     created_on: datetime
 
     @field_validator("tags", mode="before")
     @classmethod
     def parse_tags(cls, v):
-        """Convert string tags to list of strings"""
+        """Convert stored tags (association proxy or legacy string) to a list of strings"""
         if v is None:
             return []
-        if isinstance(v, list):
-            return v
         if isinstance(v, str):
             # Split by comma and strip whitespace
             return [tag.strip() for tag in v.split(",") if tag.strip()]
-        return []
+        return list(v)
+
+    model_config = ConfigDict(
+        from_attributes=True,
+        alias_generator=to_camel_case,
+        populate_by_name=True,
+    )
+
+class StoryFilters(BaseModel):
+    """Normalized GET /stories filters"""
+    assignee: Optional[str] = None
+    status: Optional[str] = None
+    tags: List[str] = []
+    tags_match: Literal["any", "all"] = "any"
+    created_by: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+    model_config = ConfigDict(frozen=True)
+
+class StorySummary(BaseModel):
+    """Slim projection for board and list views (view=summary)"""
+    id: int
+    title: str
+    status: str
+    assignee: Optional[str]
+    story_points: Optional[int] = None
+
+    model_config = ConfigDict(
+        from_attributes=True,
+        alias_generator=to_camel_case,
+        populate_by_name=True,
+    )
+
+class StoryPage(BaseModel):
+    items: list[StoryResponse]
+    next_cursor: Optional[str] = Field(
+        default=None, description="Opaque cursor for the next page, null on the last page")
+
+    model_config = ConfigDict(
+        from_attributes=True,
+        alias_generator=to_camel_case,
+        populate_by_name=True,
+    )
+
+class BulkRowError(BaseModel):
+    row: int = Field(..., description="1-based position of the item in the upload")
+    detail: Union[str, list, dict]
+
+class BulkImportResult(BaseModel):
+    created: int = 0
+    ids: list[int] = []
+    errors: list[BulkRowError] = []
+
+class ActivityResponse(BaseModel):
+    id: int
+    timestamp: datetime
+    user: Optional[str]
+    action: str
+    field: Optional[str] = None
+    old_value: Optional[str] = None
+    new_value: Optional[str] = None
+
+    model_config = ConfigDict(
+        from_attributes=True,
+        alias_generator=to_camel_case,
+        populate_by_name=True,
+    )
+
+class ActivityPage(BaseModel):
+    items: list[ActivityResponse]
+    next_cursor: Optional[str] = None
 
     model_config = ConfigDict(
         from_attributes=True,
@@ -76,15 +158,56 @@ class LoginRequest(BaseModel):
     password: str
 class Token(BaseModel):
     access_token: str
+    refresh_token: str
     token_type: str  # always "bearer"
+    expires_in: int  # access token lifetime, seconds
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class WorkspaceSummary(BaseModel):
     username: str
     total_stories: int
     by_status: dict
-    stories: list[StoryResponse]
+    stories: Optional[list[StoryResponse]] = None
     model_config = ConfigDict(
         from_attributes=True,
         alias_generator=to_camel_case,
         populate_by_name=True,
-    )
\ No newline at end of file
+    )
+class BurndownDay(BaseModel):
+    day: date
+    total_points: int
+    remaining_points: int
+    remaining_stories: int
+    completed_points: int = Field(description="Points moved to Done that day")
+    ideal_points: float = Field(description="Straight line from the first day's remaining points to zero")
+
+    model_config = ConfigDict(alias_generator=to_camel_case, populate_by_name=True)
+
+class BurndownReport(BaseModel):
+    assignee: Optional[str]
+    start: date
+    end: date
+    through: Optional[date] = Field(description="Last day the snapshots cover; later days are not reported yet")
+    days: list[BurndownDay]
+
+    model_config = ConfigDict(alias_generator=to_camel_case, populate_by_name=True)
+
+class VelocityPeriod(BaseModel):
+    start: date
+    completed_points: int
+    completed_stories: int
+
+    model_config = ConfigDict(alias_generator=to_camel_case, populate_by_name=True)
+
+class VelocityReport(BaseModel):
+    assignee: Optional[str]
+    period: Literal["day", "week", "month"]
+    start: date
+    end: date
+    through: Optional[date] = Field(description="Last day the snapshots cover")
+    average_points: float
+    periods: list[VelocityPeriod]
+
+    model_config = ConfigDict(alias_generator=to_camel_case, populate_by_name=True)
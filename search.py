@@ -0,0 +1,280 @@
+"""
+Full-text search over stories.
+
+Stories are tokenized into an inverted index (search_postings: one row per
+term and story) that the story writes keep current through the
+tasks.index_stories background job, shortly after they commit. Queries
+score postings with BM25. Each posting stores its impact, the BM25 weight
+before idf, and a query reads each term's postings highest impact first,
+only as far as it takes to settle the requested page (a threshold check
+on the weakest posting read), so even a common term costs a bounded
+number of rows. Every
+index change bumps the "search" collection version, so /filter's ETag
+moves when the index catches up with a write.
+"""
+import math
+import re
+import time
+from collections import Counter
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+import models
+import versions
+
+# BM25 parameters, the usual defaults
+K1 = 1.2
+B = 0.75
+
+# Matches in the title count this many times towards a term's frequency
+TITLE_WEIGHT = 2
+
+MAX_TERM_LENGTH = 64
+STATS_TTL_SECONDS = 60
+
+# Postings read per query term at first; quadrupled while the page is not settled
+CANDIDATES_PER_TERM = 200
+# Past this many candidates a query scores every posting of its terms instead
+MAX_CANDIDATES = 20000
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i if in into is it its "
+    "of on or so that the their then there these this to was we were will with".split()
+)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# (expires_at, document_count, average_length)
+_stats_cache = (0.0, 0, 0.0)
+# term -> (expires_at, document frequency), for terms in at least one story
+_doc_freqs = {}
+MAX_CACHED_TERMS = 10000
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens with stopwords and single characters removed"""
+    if not text:
+        return []
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in _TOKEN_RE.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def _criteria_text(criteria) -> str:
+    if not criteria:
+        return ""
+    parts = []
+    for item in criteria:
+        if isinstance(item, dict):
+            parts.extend(str(v) for v in item.values() if isinstance(v, str))
+        else:
+            parts.append(str(item))
+    return " ".join(parts)
+
+
+def document_terms(story: models.UserStory) -> Counter:
+    """Term frequencies for a story across title, description, acceptance criteria and tags"""
+    terms = Counter()
+    for token in tokenize(story.title):
+        terms[token] += TITLE_WEIGHT
+    terms.update(tokenize(story.description))
+    terms.update(tokenize(_criteria_text(story.acceptance_criteria)))
+    terms.update(tokenize(" ".join(story.tags)))
+    return terms
+
+
+def impact(tf: int, doc_length: int, average: float) -> float:
+    return tf * (K1 + 1) / (tf + K1 * (1 - B + B * doc_length / average))
+
+
+def _average_length(db: Session, documents: list) -> float:
+    """The index's average document length, or for an empty index the batch's"""
+    _, average = _collection_stats(db)
+    if not average and documents:
+        average = sum(document["length"] for document in documents) / len(documents)
+    return average or 1.0
+
+
+def index_new_stories(db: Session, stories) -> None:
+    """Index stories created in this transaction with one insert per table for the whole batch"""
+    postings, documents = [], []
+    for story in stories:
+        terms = document_terms(story)
+        length = sum(terms.values())
+        postings.extend(
+            {"term": term, "story_id": story.id, "tf": tf, "doc_length": length}
+            for term, tf in terms.items()
+        )
+        documents.append({"story_id": story.id, "length": length})
+    average = _average_length(db, documents)
+    for posting in postings:
+        posting["impact"] = impact(posting["tf"], posting["doc_length"], average)
+    db.bulk_insert_mappings(models.SearchPosting, postings)
+    db.bulk_insert_mappings(models.SearchDocument, documents)
+
+
+def index_story(db: Session, story: models.UserStory) -> None:
+    """
+    Bring the postings of one story up to date. Runs inside the caller's
+    transaction; the story must already have an id (flush first).
+    """
+    terms = document_terms(story)
+    length = sum(terms.values())
+
+    current = dict(
+        db.query(models.SearchPosting.term, models.SearchPosting.tf)
+        .filter(models.SearchPosting.story_id == story.id)
+        .all()
+    )
+    if current == terms and db.get(models.SearchDocument, story.id) is not None:
+        return
+
+    db.query(models.SearchPosting).filter(
+        models.SearchPosting.story_id == story.id
+    ).delete(synchronize_session=False)
+    average = _average_length(db, [{"length": length}])
+    db.bulk_insert_mappings(models.SearchPosting, [
+        {"term": term, "story_id": story.id, "tf": tf, "doc_length": length, "impact": impact(tf, length, average)}
+        for term, tf in terms.items()
+    ])
+    db.merge(models.SearchDocument(story_id=story.id, length=length))
+
+
+def rebuild_index(db: Session, batch_size: int = 1000) -> int:
+    """Drop and rebuild the whole index from the stories table, returns the number of stories indexed"""
+    global _stats_cache
+
+    db.query(models.SearchPosting).delete(synchronize_session=False)
+    db.query(models.SearchDocument).delete(synchronize_session=False)
+    db.commit()
+
+    indexed = 0
+    stories = db.query(models.UserStory).order_by(models.UserStory.id).yield_per(batch_size)
+    batch = []
+    for story in stories:
+        batch.append(story)
+        indexed += 1
+        if len(batch) >= batch_size:
+            index_new_stories(db, batch)
+            batch = []
+
+    if batch:
+        index_new_stories(db, batch)
+    # The batches were weighed against the average so far; weigh all against the final one
+    _stats_cache = (0.0, 0, 0.0)
+    _, average = _collection_stats(db)
+    posting = models.SearchPosting
+    length_norm = 1 - B + B * posting.doc_length / (average or 1.0)
+    db.query(posting).update(
+        {posting.impact: posting.tf * (K1 + 1) / (posting.tf + K1 * length_norm)}, synchronize_session=False
+    )
+    versions.bump(db, versions.SEARCH)
+    db.commit()
+    _doc_freqs.clear()
+    return indexed
+
+
+def _collection_stats(db: Session) -> tuple[int, float]:
+    """Document count and average length; BM25 barely moves with these, so they are cached briefly"""
+    global _stats_cache
+
+    expires_at, count, average = _stats_cache
+    if time.monotonic() < expires_at:
+        return count, average
+
+    count, total = db.query(
+        func.count(models.SearchDocument.story_id),
+        func.coalesce(func.sum(models.SearchDocument.length), 0),
+    ).one()
+    average = (total / count) if count else 0.0
+    _stats_cache = (time.monotonic() + STATS_TTL_SECONDS, count, average)
+    return count, average
+
+
+def _document_frequencies(db: Session, terms: list[str]) -> dict[str, int]:
+    """
+    Stories per term, for the terms in any; cached briefly like the
+    collection stats, since counting a common term reads all its postings
+    """
+    now = time.monotonic()
+    found = {term: _doc_freqs[term][1] for term in terms if term in _doc_freqs and _doc_freqs[term][0] > now}
+    missing = [term for term in terms if term not in found]
+    if missing:
+        counted = dict(
+            db.query(models.SearchPosting.term, func.count(models.SearchPosting.story_id))
+            .filter(models.SearchPosting.term.in_(missing))
+            .group_by(models.SearchPosting.term)
+            .all()
+        )
+        if len(_doc_freqs) + len(counted) > MAX_CACHED_TERMS:
+            _doc_freqs.clear()
+        for term, df in counted.items():
+            _doc_freqs[term] = (now + STATS_TTL_SECONDS, df)
+        found.update(counted)
+    return found
+
+
+def search_stories(db: Session, text: str, limit: int, offset: int = 0) -> list[tuple[int, float]]:
+    """
+    Return up to `limit` (story_id, score) pairs ranked by BM25, starting at
+    `offset`. Terms are OR-ed; stories matching more of them rank higher.
+    """
+    terms = sorted(set(tokenize(text)))
+    if not terms:
+        return []
+
+    doc_freqs = _document_frequencies(db, terms)
+    if not doc_freqs:
+        return []
+
+    count, _ = _collection_stats(db)
+    count = max(count, max(doc_freqs.values()))
+    idf = {
+        term: math.log(1 + (count - df + 0.5) / (df + 0.5))
+        for term, df in doc_freqs.items()
+    }
+
+    posting = models.SearchPosting
+    score = func.sum(case(idf, value=posting.term, else_=0.0) * posting.impact).label("score")
+    wanted = offset + limit
+    per_term = max(CANDIDATES_PER_TERM, 2 * wanted)
+    while per_term * len(idf) <= MAX_CANDIDATES:
+        candidates, bound = set(), 0.0
+        for term in idf:
+            # A rare term is read whole and adds nothing to the bound
+            take = 4 * per_term if doc_freqs[term] <= 4 * per_term else per_term
+            top = (
+                db.query(posting.story_id, posting.impact)
+                .filter(posting.term == term)
+                .order_by(posting.impact.desc(), posting.story_id)
+                .limit(take)
+                .all()
+            )
+            candidates.update(story_id for story_id, _ in top)
+            if len(top) == take:
+                bound += idf[term] * top[-1][1]
+        # A story outside every term's top postings scores at most `bound`
+        rows = (
+            db.query(posting.story_id, score)
+            .filter(posting.term.in_(list(idf)), posting.story_id.in_(candidates))
+            .group_by(posting.story_id)
+            .all()
+        )
+        rows.sort(key=lambda row: (-row[1], row[0]))
+        if not bound or (len(rows) >= wanted and rows[wanted - 1][1] >= bound):
+            return [(story_id, float(value)) for story_id, value in rows[offset:wanted]]
+        per_term *= 4
+
+    rows = (
+        db.query(posting.story_id, score)
+        .filter(posting.term.in_(list(idf)))
+        .group_by(posting.story_id)
+        .order_by(score.desc(), posting.story_id)
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    return [(story_id, float(value)) for story_id, value in rows]
@@ -0,0 +1,109 @@
+"""
+Fast serialization path for story lists.
+
+Building a StoryResponse per row (from_attributes, the tags validator,
+the alias generator) and then letting FastAPI encode the result again
+dominates GET /stories, /filter and /workspace once lists get long. The
+list endpoints instead select plain column rows, turn them into dicts
+through an alias map computed once per field set, attach tags from one
+query per page (they are stored pre-split in story_tags) and encode the
+result with orjson.
+
+The output matches what the StoryResponse models produce; the response
+models stay on the routes for validation of the other paths and for the
+OpenAPI schema.
+"""
+import json
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+from helper import to_camel_case
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup, see requirements.txt
+    orjson = None
+
+STORY_FIELDS = tuple(schemas.StoryResponse.model_fields)
+# Story ids per tags query, under every driver's bound parameter limit
+TAG_BATCH_SIZE = 900
+
+
+def json_default(value):
+    """Encoding for the non-JSON values in story rows, matching pydantic's"""
+    if isinstance(value, datetime):
+        return _isoformat(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _isoformat(value: datetime) -> str:
+    # Same as pydantic: UTC as "Z"
+    text = value.isoformat()
+    if value.tzinfo is not None and value.utcoffset() == timezone.utc.utcoffset(None):
+        text = text[:-6] + "Z"
+    return text
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_UTC_Z)
+    return json.dumps(value, default=json_default, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with orjson when it is installed"""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+@lru_cache(maxsize=64)
+def aliases(fields: tuple) -> tuple:
+    """(field, response key) pairs for a field set, in response order"""
+    return tuple((name, to_camel_case(name)) for name in fields)
+
+
+def story_columns(fields: Optional[list[str]]) -> list:
+    """Columns for `fields` (all of them by default), always with the keyset columns pagination needs"""
+    names = STORY_FIELDS if fields is None else fields
+    columns = [models.UserStory.id, models.UserStory.created_on]
+    columns.extend(
+        getattr(models.UserStory, name) for name in names if name not in ("id", "created_on", "tags")
+    )
+    return columns
+
+
+def load_tags(db: Session, story_ids: Iterable[int]) -> dict[int, list[str]]:
+    tags = {}
+    story_ids = list(story_ids)
+    for start in range(0, len(story_ids), TAG_BATCH_SIZE):
+        rows = db.execute(
+            select(models.StoryTag.story_id, models.StoryTag.tag)
+            .where(models.StoryTag.story_id.in_(story_ids[start:start + TAG_BATCH_SIZE]))
+            .order_by(models.StoryTag.story_id, models.StoryTag.position)
+        )
+        for story_id, tag in rows:
+            tags.setdefault(story_id, []).append(tag)
+    return tags
+
+
+def story_dicts(db: Session, rows: list, fields: Optional[list[str]]) -> list[dict]:
+    """Response dicts (camelCase keys) for rows selected with story_columns(fields)"""
+    fields = STORY_FIELDS if fields is None else tuple(fields)
+    pairs = aliases(fields)
+    # Tags are a placeholder here, filled in below from their own table
+    items = [{alias: None if name == "tags" else getattr(row, name) for name, alias in pairs} for row in rows]
+    if "tags" in fields:
+        tags = load_tags(db, (row.id for row in rows))
+        for row, item in zip(rows, items):
+            item["tags"] = tags.get(row.id, [])
+    return items
@@ -0,0 +1,372 @@
+"""
+Background jobs, run by Celery.
+
+The story write paths commit the story, its history, the status counters
+and the version bump, and collect what does not have to be in that
+transaction; the endpoint queues it (enqueue_all) from a background task
+once the write's session is closed, so an eager job never waits for a
+second connection while the write holds the first:
+
+- index_stories: search postings for the stories just written. /filter
+  sees a write once the job has run, normally well under a second later.
+- notify: mail the assignee when a story is assigned to them or changes
+  status.
+- export_stories: POST /stories/exports writes large exports to
+  EXPORT_DIR for download instead of holding a request open.
+- build_analytics_snapshots and remove_expired_exports run on the beat
+  schedule. Eager mode has no beat, so there a write queues the snapshot
+  build, at most once per ANALYTICS_SNAPSHOT_MINUTES.
+
+The status counters stay in the write transaction: GET /workspace shows
+them next to the stories and they have to agree.
+
+Every job is idempotent, so a retry or a redelivery (acks_late) is
+harmless: indexing and the snapshot build recompute from the current
+rows, an export id is written once (through an atomic rename) and a
+notification is sent once per key. Database and I/O errors are retried
+with exponential backoff and jitter.
+
+TASKS_MODE=eager (default) runs jobs in-process as they are queued, with
+no broker, for local development and tests. TASKS_MODE=celery sends them
+to CELERY_BROKER_URL (REDIS_URL by default); run the workers and the
+beat with
+
+    celery -A tasks worker --beat --loglevel=info
+"""
+import hashlib
+import json
+import logging
+import os
+import smtplib
+import threading
+import time
+import uuid
+from collections import Counter
+from email.message import EmailMessage
+from typing import Optional
+
+from celery import Celery, Task
+from fastapi import HTTPException, status
+from sqlalchemy.exc import SQLAlchemyError
+
+import crud
+import database
+import models
+import schemas
+import search
+import versions
+from config import redis_client, settings
+
+logger = logging.getLogger("tasks")
+
+INDEX_BATCH_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+NOTIFY_ONCE_SECONDS = 7 * 24 * 3600
+CLAIM_PREFIX = "tasks:claim:"
+
+celery_app = Celery("tasks", broker=settings.celery_broker_url)
+celery_app.conf.update(
+    task_always_eager=settings.tasks_mode == "eager",
+    task_ignore_result=True,
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    worker_prefetch_multiplier=1,
+    # A broker outage fails the enqueue quickly instead of stalling the write
+    task_publish_retry_policy={"max_retries": 2, "interval_start": 0, "interval_step": 0.2},
+    beat_schedule={
+        "build-analytics-snapshots": {
+            "task": "tasks.build_analytics_snapshots",
+            "schedule": settings.analytics_snapshot_minutes * 60,
+        },
+        "remove-expired-exports": {"task": "tasks.remove_expired_exports", "schedule": 3600},
+    },
+)
+
+_counts = Counter()
+_counts_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _counts_lock:
+        _counts[name] += 1
+
+
+def stats() -> dict:
+    """This process's side of the queue: jobs it queued, and jobs it ran (eager mode or a worker)"""
+    with _counts_lock:
+        counts = dict(_counts)
+    return {
+        "mode": settings.tasks_mode,
+        **{name: counts.get(name, 0) for name in ("enqueued", "enqueue_errors", "succeeded", "retried", "failed")},
+    }
+
+
+class JobTask(Task):
+    autoretry_for = (SQLAlchemyError, OSError)
+    retry_backoff = True
+    retry_backoff_max = 300
+    retry_jitter = True
+    max_retries = 5
+
+    def on_success(self, retval, task_id, args, kwargs):
+        _count("succeeded")
+
+    def on_retry(self, exc, task_id, args, kwargs, einfo):
+        _count("retried")
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        _count("failed")
+        logger.error("Task %s[%s] failed: %s", self.name, task_id, exc, exc_info=einfo.exc_info if einfo else None)
+
+
+def enqueue(task, *args, task_id: Optional[str] = None) -> bool:
+    """
+    Queue `task`; called once the write has committed and closed its
+    session. A broker outage is logged rather than raised: the write
+    itself succeeded, and the maintenance commands (manage.py) repair a
+    missed index update.
+    """
+    try:
+        task.apply_async(args, task_id=task_id)
+    except Exception:
+        _count("enqueue_errors")
+        logger.exception("Could not queue %s%r", task.name, args)
+        return False
+    _count("enqueued")
+    return True
+
+
+class _MemoryClaims:
+    """Once-only keys for eager mode, where every job runs in this process"""
+
+    def __init__(self):
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def set(self, key: str, value, nx: bool, ex: int) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._expires.get(key, 0) > now:
+                return False
+            self._expires[key] = now + ex
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._expires.pop(key, None)
+
+
+_claims = None
+
+
+def _claims_client():
+    global _claims
+    if _claims is None:
+        if settings.tasks_mode == "celery":
+            _claims = redis_client(settings.redis_url)
+        else:
+            _claims = _MemoryClaims()
+    return _claims
+
+
+def claim(key: str, ttl: int) -> bool:
+    """True for the first caller of `key` within `ttl` seconds, across workers in celery mode"""
+    return bool(_claims_client().set(CLAIM_PREFIX + key, 1, nx=True, ex=max(1, int(ttl))))
+
+
+def release(key: str) -> None:
+    _claims_client().delete(CLAIM_PREFIX + key)
+
+
+@celery_app.task(base=JobTask)
+def index_stories(story_ids: list[int]) -> int:
+    """Bring the search postings of `story_ids` in line with the stories as they are now"""
+    db = database.SessionLocal()
+    try:
+        indexed = 0
+        for start in range(0, len(story_ids), INDEX_BATCH_SIZE):
+            batch = story_ids[start:start + INDEX_BATCH_SIZE]
+            stories = db.query(models.UserStory).filter(models.UserStory.id.in_(batch)).all()
+            known = {
+                story_id for (story_id,) in
+                db.query(models.SearchDocument.story_id).filter(models.SearchDocument.story_id.in_(batch))
+            }
+            search.index_new_stories(db, [story for story in stories if story.id not in known])
+            for story in stories:
+                if story.id in known:
+                    search.index_story(db, story)
+            indexed += len(stories)
+        versions.bump(db, versions.SEARCH)
+        db.commit()
+        return indexed
+    finally:
+        db.close()
+
+
+def enqueue_all(jobs: list[tuple]) -> None:
+    """Queue the (task, *args) jobs a write collected; blocking, so off the event loop"""
+    for task, *args in jobs:
+        enqueue(task, *args)
+    if settings.tasks_mode == "eager" and claim("analytics:due", settings.analytics_snapshot_minutes * 60):
+        enqueue(build_analytics_snapshots)
+
+
+def notify_change(jobs: list, story_id: int, version: int, actor: str, before: Optional[tuple], after: tuple) -> None:
+    """
+    Add the notification a story write calls for, if any, to `jobs`: the
+    new assignee on (re)assignment, otherwise the assignee on a status
+    change. `before`/`after` are (assignee, status); `before` is None for
+    a new story.
+    """
+    assignee, story_status = after
+    if before is None or before[0] != assignee:
+        kind = "assigned"
+    elif before[1] != story_status:
+        kind = "status"
+    else:
+        return
+    if assignee != actor:
+        jobs.append((notify, story_id, assignee, actor, kind, f"{story_id}:{version}:{kind}"))
+
+
+@celery_app.task(base=JobTask)
+def notify(story_id: int, recipient: str, actor: str, kind: str, key: str) -> bool:
+    if not claim(f"notify:{key}", NOTIFY_ONCE_SECONDS):
+        return False
+    try:
+        db = database.SessionLocal()
+        try:
+            email = db.query(models.User.email).filter(models.User.username == recipient).scalar()
+            story = db.query(models.UserStory.title, models.UserStory.status).filter(
+                models.UserStory.id == story_id
+            ).first()
+        finally:
+            db.close()
+        if email is None or story is None:
+            return False
+        message = EmailMessage()
+        message["From"] = settings.notify_from
+        message["To"] = email
+        if kind == "assigned":
+            message["Subject"] = f"{actor} assigned you story #{story_id}"
+        else:
+            message["Subject"] = f"Story #{story_id} moved to {story.status}"
+        message.set_content(f"#{story_id} {story.title}\nStatus: {story.status}\nChanged by {actor}\n")
+        if settings.smtp_host is None:
+            logger.info("Notification for %s: %s", email, message["Subject"])
+        else:
+            with smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=10) as smtp:
+                smtp.send_message(message)
+        return True
+    except Exception:
+        # Let the retry send it
+        release(f"notify:{key}")
+        raise
+
+
+def export_id(version: int, filters: schemas.StoryFilters, fmt: str) -> str:
+    """
+    "<digest>.<format>": the same filters and format at the same collection
+    version give the same id, so repeating a request reuses the file
+    """
+    key = json.dumps({"filters": filters.model_dump(mode="json"), "format": fmt, "version": version}, sort_keys=True)
+    return f"{hashlib.sha256(key.encode()).hexdigest()[:32]}.{fmt}"
+
+
+def export_path(identifier: str, suffix: str = "") -> str:
+    return os.path.join(settings.export_dir, identifier + suffix)
+
+
+def export_status(identifier: str) -> str:
+    """ready, failed, pending or unknown"""
+    for state, suffix in (("ready", ""), ("failed", ".failed"), ("pending", ".pending")):
+        if os.path.exists(export_path(identifier, suffix)):
+            return state
+    return "unknown"
+
+
+def start_export(version: int, filters: schemas.StoryFilters, fmt: str) -> tuple[str, str]:
+    """Queue an export unless the same one exists or is underway; returns (export id, status)"""
+    os.makedirs(settings.export_dir, exist_ok=True)
+    identifier = export_id(version, filters, fmt)
+    current = export_status(identifier)
+    if current in ("ready", "pending"):
+        return identifier, current
+    _remove(export_path(identifier, ".failed"))
+    with open(export_path(identifier, ".pending"), "w"):
+        pass
+    if not enqueue(export_stories, identifier, filters.model_dump(mode="json"), fmt, task_id=f"export-{identifier}"):
+        _remove(export_path(identifier, ".pending"))
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Exports are unavailable, retry shortly",
+            headers={"Retry-After": "5"},
+        )
+    return identifier, export_status(identifier)
+
+
+class ExportTask(JobTask):
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        super().on_failure(exc, task_id, args, kwargs, einfo)
+        identifier = args[0]
+        with open(export_path(identifier, ".failed"), "w") as handle:
+            handle.write(str(exc))
+        _remove(export_path(identifier, ".pending"))
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@celery_app.task(base=ExportTask)
+def export_stories(identifier: str, filters: dict, fmt: str) -> str:
+    path = export_path(identifier)
+    if not os.path.exists(path):
+        # Written under a unique name and renamed into place, so a reader
+        # never sees half a file and a redelivered job does no harm
+        part = export_path(identifier, f".{uuid.uuid4().hex}.part")
+        # The primary, which the export id's version was read from: a
+        # lagging replica would file older rows under the newer version
+        db = database.SessionLocal()
+        try:
+            with open(part, "wb") as handle:
+                for chunk in crud.export_stories(db, schemas.StoryFilters(**filters), fmt, EXPORT_BATCH_SIZE):
+                    handle.write(chunk.encode() if isinstance(chunk, str) else chunk)
+            os.replace(part, path)
+        finally:
+            db.close()
+            _remove(part)
+    _remove(export_path(identifier, ".pending"))
+    return path
+
+
+@celery_app.task(base=JobTask)
+def remove_expired_exports() -> int:
+    if not os.path.isdir(settings.export_dir):
+        return 0
+    cutoff = time.time() - settings.export_ttl_seconds
+    removed = 0
+    for entry in os.scandir(settings.export_dir):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            _remove(entry.path)
+            removed += 1
+    return removed
+
+
+@celery_app.task(base=JobTask)
+def build_analytics_snapshots(full: bool = False) -> int:
+    import analytics  # pandas; only the worker that builds needs it
+
+    # One build at a time: two would delete and insert the same days
+    lock = "analytics:build"
+    if not claim(lock, settings.analytics_snapshot_minutes * 60):
+        return 0
+    db = database.SessionLocal()
+    try:
+        return analytics.build_snapshots(db, full=full)
+    finally:
+        db.close()
+        release(lock)
@@ -0,0 +1,96 @@
+"""
+Change tracking for conditional GETs.
+
+Every story write bumps the "stories" row of collection_versions in the
+same transaction, and each story carries its own version column. The
+search index, which catches up after the write, bumps "search". An
+ETag is derived from those numbers plus whatever shapes the response
+(filters, cursor, fields, user), so deciding whether a client's copy is
+still current costs one primary-key lookup instead of re-running the
+query.
+"""
+import hashlib
+import json
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+
+STORIES = "stories"
+SEARCH = "search"
+
+
+def bump(db: Session, name: str = STORIES) -> None:
+    """Advance a collection's version inside the caller's transaction"""
+    version = models.CollectionVersion
+    updated = db.query(version).filter(version.name == name).update(
+        {version.version: version.version + 1}, synchronize_session=False
+    )
+    if updated:
+        return
+    try:
+        with db.begin_nested():
+            db.add(version(name=name, version=1))
+    except IntegrityError:
+        # Created concurrently; count our write on top of it
+        db.query(version).filter(version.name == name).update(
+            {version.version: version.version + 1}, synchronize_session=False
+        )
+
+
+def current(db: Session, name: str = STORIES) -> int:
+    value = db.query(models.CollectionVersion.version).filter(
+        models.CollectionVersion.name == name
+    ).scalar()
+    return value or 0
+
+
+def collection_etag(db: Session, name: str, *shape) -> str:
+    """Strong ETag for a response over `name` whose content is determined by `shape`"""
+    key = json.dumps([name, current(db, name), *shape], default=str, sort_keys=True)
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+
+def collections_etag(db: Session, names: tuple, *shape) -> str:
+    """collection_etag for a response that changes with any of `names`"""
+    key = json.dumps([*names, *(current(db, name) for name in names), *shape], default=str, sort_keys=True)
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+
+def story_etag(db: Session, story_id: int) -> Optional[str]:
+    """ETag of a single story from its version column alone, None if it does not exist"""
+    version = db.query(models.UserStory.version).filter(
+        models.UserStory.id == story_id
+    ).scalar()
+    return None if version is None else format_story_etag(story_id, version)
+
+
+def format_story_etag(story_id: int, version: int) -> str:
+    return f'"story-{story_id}-v{version}"'
+
+
+def parse_story_etag(if_match: Optional[str], story_id: int) -> Optional[int]:
+    """
+    The story version an If-Match header expects: None when absent or "*"
+    (no precondition), -1 when it names no version of this story.
+    """
+    if not if_match or if_match.strip() == "*":
+        return None
+    for tag in if_match.split(","):
+        prefix = f'"story-{story_id}-v'
+        tag = tag.strip()
+        if tag.startswith(prefix) and tag.endswith('"') and tag[len(prefix):-1].isdigit():
+            return int(tag[len(prefix):-1])
+    return -1
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """RFC 9110 If-None-Match comparison (weak, so W/ prefixes are ignored)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates